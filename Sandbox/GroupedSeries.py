@@ -0,0 +1,52 @@
+import numpy as np
+
+from Sandbox.TimeSeries import TimeSeries
+
+
+# Flat (category, date, value) rows grouped by category in one pass.
+# All dates and values are stored in two contiguous arrays, ordered by first appearance of each category,
+# and blocks maps category -> (start, stop) into those arrays.
+class GroupedSeries:
+    def __init__(self, dates, values, blocks):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.values = np.asarray(values, dtype=np.float64)
+        self.blocks = blocks
+
+    # Grouping of column arrays (see bulk_csv.read_columns), without a Python loop over the rows.
+    @classmethod
+    def from_columns(cls, categories, dates, values):
+        names, first_rows, row_names = np.unique(categories, return_index=True, return_inverse=True)
+        appearance = np.argsort(first_rows)
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[appearance] = np.arange(len(names))
+        row_ranks = rank[row_names]
+        order = np.argsort(row_ranks, kind="stable")
+        stops = np.cumsum(np.bincount(row_ranks, minlength=len(names)))
+        starts = np.concatenate([[0], stops[:-1]])
+        blocks = {str(names[n]): (int(start), int(stop)) for n, start, stop in zip(appearance, starts, stops)}
+        return cls(np.asarray(dates)[order], np.asarray(values)[order], blocks)
+
+    def categories(self):
+        return list(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, category):
+        return category in self.blocks
+
+    def __getitem__(self, category):
+        start, stop = self.blocks[category]
+        return TimeSeries(self.dates[start:stop], self.values[start:stop])
+
+    # One row per category on the union of all dates, NaN where a category has no row for a date.
+    def to_matrix(self, categories=None):
+        if categories is None:
+            categories = self.categories()
+        grid = np.unique(self.dates)
+        positions = np.searchsorted(grid, self.dates)
+        matrix = np.full((len(categories), len(grid)), np.nan)
+        for row, category in enumerate(categories):
+            start, stop = self.blocks[category]
+            matrix[row, positions[start:stop]] = self.values[start:stop]
+        return grid, matrix
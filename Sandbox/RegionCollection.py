@@ -0,0 +1,26 @@
+# Ordered collection of RegionPrices with constant time lookup by region name.
+# Iterating and indexing with an int behaves like the list of RegionPrices it replaces.
+class RegionCollection:
+    def __init__(self, region_prices):
+        self.region_prices = list(region_prices)
+        self.by_region = {r.region: r for r in self.region_prices}
+
+    def regions(self):
+        return list(self.by_region)
+
+    def get(self, region):
+        return self.by_region.get(region)
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.by_region[item]
+        return self.region_prices[item]
+
+    def __contains__(self, region):
+        return region in self.by_region
+
+    def __iter__(self):
+        return iter(self.region_prices)
+
+    def __len__(self):
+        return len(self.region_prices)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from Sandbox.TimeSeries import TimeSeries
+
+
+# Growable storage for a series that is extended at the end. The capacity doubles when it is full,
+# so appending k points costs O(k) amortized. series() is a view of the filled part: it sees later changes
+# to the values, and keeps the old arrays when the buffer grows.
+class SeriesBuffer:
+    def __init__(self, capacity=256):
+        self._dates = np.empty(capacity, dtype='datetime64[D]')
+        self._values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def dates(self):
+        return self._dates[:self.size]
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    def last_date(self):
+        return self._dates[self.size - 1] if self.size else None
+
+    def append(self, dates, values):
+        dates = np.atleast_1d(np.asarray(dates, dtype='datetime64[D]'))
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        size = self.size + len(values)
+        if size > len(self._values):
+            capacity = max(2 * len(self._values), size)
+            self._dates = np.concatenate([self.dates, np.empty(capacity - self.size, dtype='datetime64[D]')])
+            self._values = np.concatenate([self.values, np.empty(capacity - self.size, dtype=np.float64)])
+        self._dates[self.size:size] = dates
+        self._values[self.size:size] = values
+        self.size = size
+
+    def truncate(self, size):
+        self.size = min(self.size, size)
+
+    def series(self):
+        return TimeSeries(self.dates, self.values)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from Sandbox.DataPoint import DataPoint
+
+
+# Columnar time series: one datetime64[D] array of dates and one float64 array of values.
+# Indexing with an int returns a DataPoint so code written against lists of DataPoint keeps working,
+# slicing returns a new TimeSeries sharing the underlying arrays.
+class TimeSeries:
+    def __init__(self, dates, values):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.dates.shape != self.values.shape:
+            raise ValueError("dates and values must have the same length")
+
+    @classmethod
+    def from_data_points(cls, data_points):
+        return cls([p.date for p in data_points], [p.value for p in data_points])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return TimeSeries(self.dates[item], self.values[item])
+        return DataPoint(self.dates[item].item(), float(self.values[item]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        if len(self) == 0:
+            return "TimeSeries([])"
+        return f"TimeSeries({len(self)} points, {self.dates[0]} - {self.dates[-1]})"
+
+    def normalize(self):
+        return TimeSeries(self.dates, self.values / self.values[0])
+
+    def crop(self, min_date, max_date):
+        mask = (self.dates >= np.datetime64(min_date, 'D')) & (self.dates <= np.datetime64(max_date, 'D'))
+        return TimeSeries(self.dates[mask], self.values[mask])
+
+    # Combining two series is positional: the n-th value of self is paired with the n-th value of other,
+    # as the loaders produce series on the same monthly grid starting at the same date.
+    def divide(self, other):
+        return TimeSeries(self.dates, self.values / self._aligned_values(other))
+
+    def multiply(self, other):
+        return TimeSeries(self.dates, self.values * self._aligned_values(other))
+
+    def diff(self):
+        return TimeSeries(self.dates[:-1], np.diff(self.values))
+
+    def _aligned_values(self, other):
+        if isinstance(other, TimeSeries):
+            if len(other) < len(self):
+                raise ValueError(f"series has {len(other)} points, expected at least {len(self)}")
+            return other.values[:len(self)]
+        return other
@@ -0,0 +1,5 @@
+import sys
+
+from Sandbox.cli import main
+
+sys.exit(main())
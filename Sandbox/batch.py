@@ -0,0 +1,97 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Sandbox.TimeSeries import TimeSeries
+from Sandbox.load_data import load_regional_prices
+
+DEFAULT_SEED = 8927
+
+
+# Seeds for every chain of every region, derived from one base seed so a batch is reproducible
+# and a region gets the same seeds whether it is run alone or together with others.
+def region_seeds(regions, chains, seed=DEFAULT_SEED):
+    seeds = {}
+    for region in regions:
+        entropy = [seed] + list(region.encode())
+        seeds[region] = [int(s) for s in np.random.SeedSequence(entropy).generate_state(chains)]
+    return seeds
+
+
+# Runs in a worker process. The relative prices are sent as arrays, the model is compiled in the worker
+# once per series length and reused for the following regions the worker gets.
+def fit_breakpoint_region(region, dates, relative_prices, draws, tune, chains, cores, random_seed, model,
+                          trace_store=None, prescan=False, streaming=False, thin=1):
+    from Sandbox.model_cache import default_model_cache
+    from Sandbox.run_model import run_breakpoint_model
+
+    start = time.perf_counter()
+    summary = run_breakpoint_model(TimeSeries(dates, relative_prices), draws=draws, tune=tune, chains=chains,
+                                   cores=cores, random_seed=random_seed, show=False, model=model,
+                                   model_cache=default_model_cache, trace_store=trace_store,
+                                   run_info={"region": region}, prescan=prescan, streaming=streaming, thin=thin)
+    return region, summary, time.perf_counter() - start
+
+
+# Fits run_breakpoint_model for every region in a pool of processes and collects one summary table,
+# indexed by region and variable. When there are fewer regions than processes the idle cores are
+# given to the chains within each region. With a trace_store directory every region's trace is saved there.
+# With streaming the workers summarize the draws while sampling instead of keeping them, see
+# run_model.stream_model, and save every thin-th draw to the trace store.
+def run_breakpoint_batch(regions=None, processes=None, chains=2, draws=1000, tune=1000, seed=DEFAULT_SEED,
+                         model="cauchy", trace_store=None, prescan=False, streaming=False, thin=1):
+    import pandas as pd
+
+    regional_prices = load_regional_prices()
+    if regions is None:
+        regions = regional_prices.regions()
+    processes = processes or os.cpu_count() or 1
+    workers = min(processes, len(regions))
+    cores_per_region = max(1, min(chains, processes // len(regions)))
+    seeds = region_seeds(regions, chains, seed)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for region in regions:
+            relative_prices = regional_prices[region].prices.diff()
+            futures.append(pool.submit(fit_breakpoint_region, region, relative_prices.dates, relative_prices.values,
+                                       draws, tune, chains, cores_per_region, seeds[region], model, trace_store,
+                                       prescan, streaming, thin))
+        for future in futures:
+            region, summary, seconds = future.result()
+            summary = summary.copy()
+            summary["seconds"] = seconds
+            summary["chain_seeds"] = ",".join(str(s) for s in seeds[region])
+            results[region] = summary
+
+    return pd.concat([results[r] for r in regions], keys=regions, names=["region", "variable"])
+
+
+# Relative price changes of the regions as one (regions, months) matrix on the union of their months,
+# NaN before a region's first observation.
+def region_change_matrix(regional_prices, regions):
+    changes = [regional_prices[region].prices.diff() for region in regions]
+    dates = np.unique(np.concatenate([series.dates for series in changes]))
+    matrix = np.full((len(regions), len(dates)), np.nan)
+    for row, series in enumerate(changes):
+        matrix[row, np.searchsorted(dates, series.dates)] = series.values
+    return dates, matrix
+
+
+# One joint fit of run_hierarchical_breakpoint_model on all regions, instead of a fit per region.
+def run_hierarchical_breakpoint(regions=None, chains=2, cores=1, draws=1000, tune=1000, seed=DEFAULT_SEED,
+                                show=False, plot_output=None, trace_store=None):
+    from Sandbox.run_model import run_hierarchical_breakpoint_model
+
+    regional_prices = load_regional_prices()
+    if regions is None:
+        regions = regional_prices.regions()
+    dates, changes = region_change_matrix(regional_prices, regions)
+    random_seed = [int(s) for s in np.random.SeedSequence(seed).generate_state(chains)]
+    return run_hierarchical_breakpoint_model(regions, changes, draws=draws, tune=tune, chains=chains, cores=cores,
+                                             random_seed=random_seed, show=show, plot_output=plot_output,
+                                             trace_store=trace_store,
+                                             run_info={"first_month": str(dates[0]), "seed": seed})
@@ -0,0 +1,400 @@
+import contextlib
+import csv
+import datetime
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from Sandbox import disk_cache, load_data, resample
+from Sandbox.TimeSeries import TimeSeries
+from Sandbox.cache import loader_cache
+from Sandbox.load_data import load_regional_prices
+from Sandbox.run_model import BREAKPOINT_SCALING_FACTOR, build_breakpoint_model, build_marginalized_breakpoint_model, \
+    breakpoint_posterior, breakpoint_data, changepoint_statistics
+
+BREAKPOINT_MODELS = {
+    "cauchy": (build_breakpoint_model, breakpoint_data),
+    "marginalized": (build_marginalized_breakpoint_model, changepoint_statistics),
+}
+
+RESULTS_FORMAT = 1
+# Row and region multipliers of the synthetic inputs. Scale 1 is the real data.
+SCALES = [1, 10, 100, 1000]
+# Series length multipliers for the models, which are much slower per observation
+MODEL_SCALES = [1, 10]
+REPEAT = 3
+# strptime only parses four digit years, which limits how far the national series can be extended
+LAST_PARSABLE_YEAR = 9999
+# a benchmark slower than this many times its time in the baseline is reported as a regression
+REGRESSION_FACTOR = 1.2
+
+
+# Effective samples per second of sampling for the two breakpoint models on the same region and seeds.
+# Compilation is reported separately, as total_seconds - sampling_seconds.
+def compare_breakpoint_models(region="Stavanger", draws=1000, tune=1000, chains=2, seed=8927):
+    import arviz as az
+    import pymc3 as pm
+
+    relative_changes = load_regional_prices()[region].prices.diff().values * BREAKPOINT_SCALING_FACTOR
+    random_seed = [seed + chain for chain in range(chains)]
+    results = []
+    for name, (build, model_data) in BREAKPOINT_MODELS.items():
+        start = time.perf_counter()
+        model = build(model_data(relative_changes))
+        with model:
+            trace = pm.sample(draws=draws, tune=tune, chains=chains, cores=1, random_seed=random_seed,
+                              progressbar=False, return_inferencedata=False)
+            total_seconds = time.perf_counter() - start
+            if name == "marginalized":
+                posterior = breakpoint_posterior(trace, relative_changes, random_seed)
+            else:
+                posterior = az.from_pymc3(trace)
+
+        sampling_seconds = trace.report.t_sampling
+        ess = az.ess(posterior, var_names=["changepoint", "early_trend", "late_trend"])
+        result = {"model": name, "total_seconds": total_seconds, "sampling_seconds": sampling_seconds,
+                  "divergences": int(trace.get_sampler_stats("diverging").sum())}
+        for variable in ["changepoint", "early_trend", "late_trend"]:
+            result[f"ess_{variable}"] = float(ess[variable])
+            result[f"ess_per_second_{variable}"] = float(ess[variable]) / sampling_seconds
+        results.append(result)
+    return results
+
+
+# How far the ADVI approximations (run_model.fit_model) are from NUTS on the bundled data: for every model and
+# variable the distance of the posterior means in NUTS posterior sds, and the ratio of the posterior sds.
+# Wall times are of whole run_* calls, compilation included, the speedup is NUTS time over ADVI time.
+def calibrate_variational(methods=("advi", "fullrank_advi"), region="Stavanger", min_year=1992, draws=1000,
+                          seed=8927):
+    from Sandbox.load_data import load_national_prices, load_wage_growth
+    from Sandbox.main import absolute_to_relative_prices, monthly_to_quarterly
+    from Sandbox.run_model import run_breakpoint_model, run_price_trend_model, run_wage_correlation_model
+
+    prices = load_national_prices(min_year)
+    wages = load_wage_growth(min_year)
+    regional_changes = absolute_to_relative_prices(load_regional_prices()[region].prices)
+    fits = {
+        "price_trend": lambda method: run_price_trend_model(prices, method=method, draws=draws, show=False,
+                                                            random_seed=seed),
+        "wage_correlation": lambda method: run_wage_correlation_model(
+            monthly_to_quarterly(prices), monthly_to_quarterly(wages), method=method, draws=draws, show=False,
+            random_seed=seed),
+        "marginalized_breakpoint": lambda method: run_breakpoint_model(
+            regional_changes, draws=draws, tune=draws, chains=2, random_seed=[seed, seed + 1], show=False,
+            model="marginalized", method=method),
+    }
+    results = []
+    for model, fit in fits.items():
+        start = time.perf_counter()
+        reference = fit("nuts")
+        nuts_seconds = time.perf_counter() - start
+        for method in methods:
+            start = time.perf_counter()
+            summary = fit(method)
+            seconds = time.perf_counter() - start
+            for variable in reference.index:
+                sd = reference.loc[variable, "sd"]
+                results.append({"model": model, "method": method, "variable": variable,
+                                "mean_error_in_sd": float(abs(summary.loc[variable, "mean"] -
+                                                              reference.loc[variable, "mean"]) / sd),
+                                "sd_ratio": float(summary.loc[variable, "sd"] / sd),
+                                "nuts_seconds": nuts_seconds, "seconds": seconds, "speedup": nuts_seconds / seconds})
+    return results
+
+
+def print_results(results):
+    columns = list(results[0])
+    print(";".join(columns))
+    for result in results:
+        print(";".join(f"{result[c]:.3f}" if isinstance(result[c], float) else str(result[c]) for c in columns))
+
+
+# Wall times of repeat calls of func. setup runs before every call and is not timed.
+# Printing by the loaders is discarded so it does not count.
+def time_calls(func, repeat=REPEAT, setup=None):
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def timing_result(name, scale, size, seconds):
+    return {"benchmark": name, "scale": scale, "size": size, "repeat": len(seconds), "seconds": seconds,
+            "min_seconds": min(seconds), "median_seconds": statistics.median(seconds)}
+
+
+# Every cold load starts without cached rows or series
+def clear_caches():
+    loader_cache.invalidate()
+
+
+# Points the loaders at the files in directory, without the on-disk cache, and restores them afterwards.
+@contextlib.contextmanager
+def data_directory(directory):
+    previous_dir, previous_cache = load_data.DATA_DIR, disk_cache.active_cache
+    load_data.DATA_DIR = Path(directory)
+    disk_cache.active_cache = None
+    clear_caches()
+    try:
+        yield
+    finally:
+        load_data.DATA_DIR, disk_cache.active_cache = previous_dir, previous_cache
+        clear_caches()
+
+
+def read_rows(file_name):
+    with open(load_data.DATA_DIR / file_name) as csv_file:
+        return list(csv.reader(csv_file, delimiter=';'))
+
+
+def write_rows(directory, file_name, rows):
+    with open(Path(directory) / file_name, "w", newline="") as csv_file:
+        csv.writer(csv_file, delimiter=';', lineterminator="\n").writerows(rows)
+
+
+# The last year of the national series when the monthly index has scale times as many rows
+def synthetic_last_year(scale):
+    months = (len(read_rows(load_data.NATIONAL_MONTHLY_INDEX_FILE)) - 1) * scale
+    return 2003 + (months - 1) // 12
+
+
+# Writes the source files scaled up to directory, in the format of the real files:
+#   monthly index: scale times as many months, the real values repeated
+#   wage file: extended to the last year of the monthly index
+#   interest rates: scale times as many announcements at random days of the real period
+#   regional index: scale copies of every region
+# Returns {"national": False} when the dates of the national series would not be parsable any more.
+def write_synthetic_data(directory, scale, seed=8927):
+    rng = np.random.default_rng(seed)
+    source_dir = load_data.DATA_DIR
+    shutil.copy(source_dir / load_data.NATIONAL_QUARTERLY_INDEX_FILE, Path(directory))
+
+    last_year = synthetic_last_year(scale)
+    national = last_year <= LAST_PARSABLE_YEAR
+    monthly = read_rows(load_data.NATIONAL_MONTHLY_INDEX_FILE)
+    wages = read_rows(load_data.WAGE_FILE)
+    wages = [wages[0]] + [row for row in wages[1:] if len(row) > 3]
+    if national:
+        months = (len(monthly) - 1) * scale
+        rows = [monthly[0]]
+        for i in range(months):
+            source = monthly[1 + i % (len(monthly) - 1)]
+            rows.append([f"01.{i % 12 + 1:02d}.{2003 + i // 12}"] + source[1:])
+        monthly = rows
+        first_year = int(wages[1][0])
+        wages = [wages[0]] + [[str(year)] + wages[1 + (year - first_year) % (len(wages) - 1)][1:]
+                              for year in range(first_year, last_year + 1)]
+    write_rows(directory, load_data.NATIONAL_MONTHLY_INDEX_FILE, monthly)
+    write_rows(directory, load_data.WAGE_FILE, wages)
+
+    interest = read_rows(load_data.INTEREST_RATE_FILE)
+    announcements = [row for row in interest[1:] if len(row) > 1]
+    dates = [load_data.parse_date(row[0]) for row in announcements]
+    first, last = min(dates).toordinal(), max(dates).toordinal()
+    days = np.sort(rng.integers(first, last + 1, len(announcements) * scale))[::-1]
+    rates = [announcements[i % len(announcements)][1:] for i in range(len(days))]
+    write_rows(directory, load_data.INTEREST_RATE_FILE,
+               [interest[0]] + [[datetime.date.fromordinal(int(day)).strftime("%d.%m.%Y")] + rate
+                                for day, rate in zip(days, rates)])
+
+    regional = read_rows(load_data.REGIONAL_INDEX_FILE)
+    rows = [regional[0]]
+    for copy in range(scale):
+        suffix = f" {copy}" if copy else ""
+        rows.extend([row[0] + suffix] + row[1:] for row in regional[1:] if len(row) > 2)
+    write_rows(directory, load_data.REGIONAL_INDEX_FILE, rows)
+    return {"national": national}
+
+
+def pipeline_benchmarks(scale, repeat=REPEAT, national=True):
+    from Sandbox.GroupedSeries import GroupedSeries
+    from Sandbox.batch import region_change_matrix
+    from Sandbox.bulk_csv import read_columns
+    from Sandbox.load_data import load_columns, transform_interest_rates, load_national_prices, \
+        get_regional_prices
+    from Sandbox.segmentation import detect_changepoints
+
+    regional_path = load_data.data_file_path(load_data.REGIONAL_INDEX_FILE)
+    regional_kinds = list(load_data.SOURCE_COLUMNS[load_data.REGIONAL_INDEX_FILE].values())
+    results = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        interest = TimeSeries(*load_columns(load_data.INTEREST_RATE_FILE, [0, 1]))
+        regional = load_columns(load_data.REGIONAL_INDEX_FILE, [0, 1, 2])
+        national_size = len(load_columns(load_data.NATIONAL_MONTHLY_INDEX_FILE, [0])[0])
+    results.append(timing_result("load_columns_interest", scale, len(interest),
+                                 time_calls(lambda: load_columns(load_data.INTEREST_RATE_FILE, [0, 1]), repeat,
+                                            clear_caches)))
+    results.append(timing_result("load_columns_regional", scale, len(regional[0]),
+                                 time_calls(lambda: load_columns(load_data.REGIONAL_INDEX_FILE, [0, 1, 2]), repeat,
+                                            clear_caches)))
+    results.append(timing_result("read_columns", scale, len(regional[0]),
+                                 time_calls(lambda: read_columns(regional_path, [0, 1, 2], regional_kinds), repeat)))
+
+    quarter_dates, quarterly_prices = get_regional_prices(GroupedSeries.from_columns(*regional), None)
+    results.append(timing_result("quarterly_to_monthly", scale, quarterly_prices.size,
+                                 time_calls(lambda: resample.quarterly_to_monthly(quarter_dates, quarterly_prices),
+                                            repeat)))
+    results.append(timing_result("transform_interest_rates", scale, len(interest),
+                                 time_calls(lambda: transform_interest_rates(interest, 1992), repeat)))
+
+    results.append(timing_result("load_regional_prices_cold", scale, len(regional[0]),
+                                 time_calls(load_regional_prices, repeat, clear_caches)))
+    results.append(timing_result("load_regional_prices_warm", scale, len(regional[0]),
+                                 time_calls(load_regional_prices, repeat)))
+    regional_prices = load_regional_prices()
+    _, changes = region_change_matrix(regional_prices, regional_prices.regions())
+    results.append(timing_result("detect_changepoints", scale, len(changes),
+                                 time_calls(lambda: detect_changepoints(changes), repeat)))
+    if national:
+        results.append(timing_result("load_national_prices_cold", scale, national_size,
+                                     time_calls(lambda: load_national_prices(1992, None), repeat, clear_caches)))
+        results.append(timing_result("load_national_prices_warm", scale, national_size,
+                                     time_calls(lambda: load_national_prices(1992, None), repeat)))
+    return results
+
+
+# A series of scale times the length with the same shape, by linear interpolation
+def stretch(values, scale):
+    values = np.asarray(values, dtype=np.float64)
+    positions = np.linspace(0, len(values) - 1, len(values) * scale)
+    return np.interp(positions, np.arange(len(values)), values)
+
+
+def model_inputs(scale):
+    from Sandbox.load_data import load_national_prices, load_wage_growth
+    from Sandbox.main import monthly_to_quarterly
+    from Sandbox.run_model import price_trend_data, wage_correlation_data
+
+    def series(values):
+        return TimeSeries(resample.month_starts("1992-01", len(values)), values)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        prices = load_national_prices(1992)
+        wages = load_wage_growth(1992)
+        stavanger = load_regional_prices()["Stavanger"].prices.diff()
+    return {
+        "price_trend": price_trend_data(series(stretch(prices.values, scale))),
+        "wage_correlation": wage_correlation_data(series(stretch(monthly_to_quarterly(prices).values, scale)),
+                                                  series(stretch(monthly_to_quarterly(wages).values, scale))),
+        "breakpoint": breakpoint_data(stretch(stavanger.values, scale) * BREAKPOINT_SCALING_FACTOR),
+    }
+
+
+# Build time of the model and sampling time (creating the NUTS step included) of the models behind
+# run_price_trend_model, run_wage_correlation_model and run_breakpoint_model, on series stretched by scale.
+# Theano keeps compiled code in its compile directory, so only the first run on a machine pays for the C compiler.
+def model_benchmarks(scale, draws=1000, tune=1000, chains=2, seed=8927):
+    from Sandbox.model_cache import ModelCache
+
+    results = []
+    for kind, data in model_inputs(scale).items():
+        model_cache = ModelCache()
+        with contextlib.redirect_stdout(io.StringIO()):
+            compiled = model_cache.get(kind, data)
+            model_cache.sample(kind, data, draws=draws, tune=tune, chains=chains, cores=1,
+                               random_seed=[seed + chain for chain in range(chains)], progressbar=False)
+        total_seconds = compiled.compile_seconds + compiled.sampling_seconds
+        result = timing_result(f"model_{kind}", scale, len(next(iter(data.values()))), [total_seconds])
+        result.update({"compile_seconds": compiled.compile_seconds, "sampling_seconds": compiled.sampling_seconds,
+                       "draws": draws, "tune": tune, "chains": chains})
+        results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs the suite and returns the results with the commit and machine they were measured on.
+# Scale 1 runs on the files in data/, larger scales on synthetic files written to a temporary directory.
+def run_benchmarks(scales=SCALES, model_scales=MODEL_SCALES, repeat=REPEAT, draws=1000, tune=1000):
+    results = []
+    for scale in scales:
+        if scale == 1:
+            with data_directory(load_data.DATA_DIR):
+                results.extend(pipeline_benchmarks(scale, repeat))
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            available = write_synthetic_data(directory, scale)
+            with data_directory(directory):
+                results.extend(pipeline_benchmarks(scale, repeat, available["national"]))
+        if not available["national"]:
+            results.append({"benchmark": "load_national_prices_cold", "scale": scale,
+                            "skipped": f"the monthly index would end in {synthetic_last_year(scale)}"})
+    for scale in model_scales:
+        results.extend(model_benchmarks(scale, draws, tune))
+
+    return {
+        "format": RESULTS_FORMAT,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "results": results,
+    }
+
+
+def write_benchmark_results(report, path):
+    with open(path, "w") as results_file:
+        json.dump(report, results_file, indent=1)
+
+
+def read_benchmark_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+# Benchmarks of two result files side by side, with new / baseline of the fastest time.
+# The compile and sampling times of the models are compared separately.
+def compare_benchmark_results(baseline, new, regression_factor=REGRESSION_FACTOR):
+    def timings(report):
+        rows = {}
+        for result in report["results"]:
+            if "skipped" in result:
+                continue
+            rows[(result["benchmark"], result["scale"])] = result["min_seconds"]
+            for part in ["compile_seconds", "sampling_seconds"]:
+                if part in result:
+                    rows[(f"{result['benchmark']}_{part[:-len('_seconds')]}", result["scale"])] = result[part]
+        return rows
+
+    baseline_timings, new_timings = timings(baseline), timings(new)
+    comparison = []
+    for key in [key for key in new_timings if key in baseline_timings]:
+        ratio = new_timings[key] / baseline_timings[key]
+        comparison.append({"benchmark": key[0], "scale": key[1], "baseline_seconds": baseline_timings[key],
+                           "new_seconds": new_timings[key], "ratio": ratio,
+                           "regression": "yes" if ratio > regression_factor else ""})
+    return comparison
+
+
+def print_benchmark_results(report):
+    print_results([{"benchmark": r["benchmark"], "scale": r["scale"], "size": r.get("size", ""),
+                    "min_seconds": r.get("min_seconds", float("nan")),
+                    "median_seconds": r.get("median_seconds", float("nan")),
+                    "compile_seconds": r.get("compile_seconds", ""), "sampling_seconds": r.get("sampling_seconds", ""),
+                    "skipped": r.get("skipped", "")} for r in report["results"]])
+
+
+if __name__ == "__main__":
+    print_benchmark_results(run_benchmarks())
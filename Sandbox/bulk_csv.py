@@ -0,0 +1,126 @@
+import csv
+import itertools
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from Sandbox import instrument
+
+logger = logging.getLogger(__name__)
+
+# rows converted at a time by read_column_chunks, a few hundred MB of Python lists for the regional extracts
+CHUNK_ROWS = 1_000_000
+
+
+# Semicolon separated files parsed into one typed array per column.
+# csv.reader splits the rows (quoted fields, BOM through the utf-8-sig encoding), every other step
+# works on whole columns: decimal commas, dd.mm.yyyy dates and YYYYKq quarter codes are converted
+# with array operations instead of float() and strptime per cell.
+# kinds: "text" (str array), "decimal" (float64), "integer" (int64), "date" and "quarter" (datetime64[D]).
+# Rows too short to hold all columns are skipped, like the row by row loaders did.
+def read_columns(file_path, columns, kinds, chunk_rows=CHUNK_ROWS, header=True):
+    with instrument.stage("read_columns", file=Path(file_path).name) as current:
+        chunks = list(read_column_chunks(file_path, columns, kinds, chunk_rows, header))
+        if not chunks:
+            chunks = [convert_rows([], columns, kinds)]
+        result = [np.concatenate(column_chunks) for column_chunks in zip(*chunks)]
+        current.update(rows_out=len(result[0]) if result else 0)
+    return result
+
+
+# The typed columns of chunk_rows rows at a time, see read_columns. Only the typed arrays of a chunk are kept
+# once it is converted, so a file of any size is never held in memory as lists or text.
+def read_column_chunks(file_path, columns, kinds, chunk_rows=CHUNK_ROWS, header=True):
+    if len(columns) != len(kinds):
+        raise ValueError("one kind per column is needed")
+    rows = read_rows(file_path, header)
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_rows)), []):
+        yield convert_rows(chunk, columns, kinds, file_path)
+
+
+# The rows of a file as lists of cells, one at a time
+def read_rows(file_path, header=True):
+    with open(file_path, newline="", encoding="utf-8-sig") as csv_file:
+        reader = csv.reader(csv_file, delimiter=";")
+        if header:
+            logger.debug("columns of %s: %s", file_path, ", ".join(next(reader, [])))
+        yield from reader
+
+
+# Typed arrays of columns of a list of rows, without the rows too short to hold them
+def convert_rows(rows, columns, kinds, file_path=None):
+    width = max(columns, default=-1) + 1
+    complete = [row for row in rows if len(row) >= width]
+    if len(complete) < len(rows):
+        logger.debug("skipped %d short rows of %s", len(rows) - len(complete), file_path)
+    return [CONVERTERS[kind](np.array([row[column] for row in complete], dtype=str))
+            for column, kind in zip(columns, kinds)]
+
+
+def parse_text(cells):
+    return np.array(cells, dtype=str)
+
+
+# "18,8" -> 18.8. The comma is swapped for a point in the character codes of the whole column, then every cell
+# is converted on its own, so an empty or malformed cell raises a ValueError naming it.
+def parse_decimals(cells):
+    text = np.array(cells, dtype=str)
+    codes = text.view(np.uint32)
+    codes[codes == ord(",")] = ord(".")
+    return text.astype(np.float64)
+
+
+def parse_integers(cells):
+    return np.array(cells, dtype=str).astype(np.int64)
+
+
+# "21.01.2021" -> 2021-01-21
+def parse_dates(cells):
+    digits = fixed_width_digits(cells, "dd.mm.yyyy")
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+    first_of_month = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = first_of_month.astype('datetime64[D]') + (day - 1)
+    invalid = (month < 1) | (month > 12) | (day < 1) | (dates.astype('datetime64[M]') != first_of_month)
+    if invalid.any():
+        raise ValueError(f"invalid date {cells[np.flatnonzero(invalid)[0]]!r}")
+    return dates
+
+
+# "1992K3" -> first day of the quarter, 1992-07-01
+def parse_quarters(cells):
+    digits = fixed_width_digits(cells, "yyyyKq")
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    quarter = digits[:, 5]
+    if ((quarter < 1) | (quarter > 4)).any():
+        raise ValueError(f"invalid quarter {cells[np.flatnonzero((quarter < 1) | (quarter > 4))[0]]!r}")
+    return ((year - 1970) * 12 + (quarter - 1) * 3).astype('datetime64[M]').astype('datetime64[D]')
+
+
+# The characters of equally long cells as a (cells, width) array of digit values.
+# pattern gives the width, with letters where digits belong and the literal separators in between.
+def fixed_width_digits(cells, pattern):
+    text = np.array(cells, dtype=str)
+    if text.dtype.itemsize > 4 * len(pattern):
+        too_long = np.flatnonzero(np.char.str_len(text) > len(pattern))[0]
+        raise ValueError(f"{cells[too_long]!r} does not match {pattern}")
+    # shorter cells are padded with NUL characters, which fail the checks below
+    codes = text.astype(f"<U{len(pattern)}").view(np.uint32).reshape(len(text), len(pattern)).astype(np.int64)
+    expected = np.array([ord(c) for c in pattern])
+    is_digit = np.array([c.islower() for c in pattern])
+    valid = ((codes[:, is_digit] >= ord("0")) & (codes[:, is_digit] <= ord("9"))).all(axis=1)
+    valid &= (codes[:, ~is_digit] == expected[~is_digit]).all(axis=1)
+    if not valid.all():
+        raise ValueError(f"{cells[np.flatnonzero(~valid)[0]]!r} does not match {pattern}")
+    return codes - ord("0")
+
+
+CONVERTERS = {
+    "text": parse_text,
+    "decimal": parse_decimals,
+    "integer": parse_integers,
+    "date": parse_dates,
+    "quarter": parse_quarters,
+}
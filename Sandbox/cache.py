@@ -0,0 +1,71 @@
+import os
+from collections import OrderedDict
+
+from Sandbox import instrument
+
+
+# Process level LRU cache for parsed source files and series derived from them.
+# Entries are keyed by kind, the source file paths with their modification times and the loader parameters,
+# so editing a file in data/ makes the old entries unreachable. Cached values are shared between callers
+# and must not be modified in place.
+class LoaderCache:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.file_reads = {}
+
+    def get_or_load(self, kind, file_paths, params, load):
+        file_paths = tuple(str(p) for p in file_paths)
+        key = (kind, tuple((p, os.stat(p).st_mtime_ns) for p in file_paths), params)
+        if key in self.entries:
+            self.hits += 1
+            instrument.count("cache", cache="memory", kind=kind, hit=True)
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        instrument.count("cache", cache="memory", kind=kind, hit=False)
+        value = load()
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def record_file_read(self, file_path):
+        file_path = str(file_path)
+        self.file_reads[file_path] = self.file_reads.get(file_path, 0) + 1
+
+    # Drop all entries depending on file_path, or everything when no path is given.
+    def invalidate(self, file_path=None):
+        if file_path is None:
+            self.entries.clear()
+            return
+        file_path = str(file_path)
+        for key in [k for k in self.entries if any(p == file_path for p, _ in k[1])]:
+            del self.entries[key]
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.file_reads = {}
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "file_reads": dict(self.file_reads),
+        }
+
+
+loader_cache = LoaderCache()
+
+
+def cache_stats():
+    return loader_cache.stats()
+
+
+def invalidate_cache(file_path=None):
+    loader_cache.invalidate(file_path)
@@ -0,0 +1,491 @@
+import argparse
+import os
+import sys
+import time
+
+from Sandbox import instrument
+from Sandbox.load_data import load_national_prices, load_wage_growth, load_interest_rate, load_inflation, \
+    load_cost_factor_of_purchase, load_regional_prices
+from Sandbox.trace_store import DEFAULT_TRACE_DIR
+
+# Data-only commands must stay well below this, measured from the start of the interpreter.
+# They never import the libraries below; plotting and model commands import them lazily when they run.
+DATA_COMMAND_BUDGET_SECONDS = 1.0
+HEAVY_MODULES = ["pymc3", "theano", "arviz", "matplotlib"]
+# models of the trace store runs whose late_trend draws the breakpoint projection uses
+BREAKPOINT_RUN_MODELS = ["breakpoint", "marginalized_breakpoint"]
+
+NATIONAL_SERIES = {
+    "national": load_national_prices,
+    "wage": load_wage_growth,
+    "interest": load_interest_rate,
+    "inflation": load_inflation,
+    "cost": load_cost_factor_of_purchase,
+}
+
+
+def price_series(args):
+    if args.region is None:
+        return load_national_prices(args.min_year), args.min_year
+    region = load_regional_prices()[args.region]
+    return region.prices, region.start_year
+
+
+def command_load(args):
+    if args.series == "regional":
+        if args.region is None:
+            raise SystemExit("--region is required for the regional series")
+        series = load_regional_prices()[args.region].prices
+    else:
+        series = NATIONAL_SERIES[args.series](args.min_year)
+
+    if not args.quiet:
+        for date, value in zip(series.dates, series.values):
+            print(f"{date};{value}")
+    return check_budget("load", args)
+
+
+def command_stats(args):
+    from Sandbox.main import display_stats
+
+    prices, min_year = price_series(args)
+    display_stats(prices, min_year)
+
+
+def command_trend(args):
+    from Sandbox.run_model import run_price_trend_model
+
+    prices, _ = price_series(args)
+    run_price_trend_model(prices, method=args.method, trace_store=args.trace_store, run_info=run_info(args))
+
+
+def command_wage_correlation(args):
+    from Sandbox.main import monthly_to_quarterly
+    from Sandbox.run_model import run_wage_correlation_model
+
+    prices = load_national_prices(args.min_year)
+    wages = load_wage_growth(args.min_year)
+    run_wage_correlation_model(monthly_to_quarterly(prices), monthly_to_quarterly(wages), method=args.method,
+                               trace_store=args.trace_store, run_info=run_info(args))
+
+
+def command_breakpoint(args):
+    from Sandbox.main import absolute_to_relative_prices
+    from Sandbox.run_model import run_breakpoint_model
+
+    prices = load_regional_prices()[args.region].prices
+    run_breakpoint_model(absolute_to_relative_prices(prices), model=args.model, trace_store=args.trace_store,
+                         run_info=run_info(args), prescan=args.prescan, method=args.method, streaming=args.streaming,
+                         thin=args.thin)
+
+
+def command_changepoints(args):
+    from Sandbox.batch import region_change_matrix
+    from Sandbox.segmentation import detect_changepoints
+
+    regional_prices = load_regional_prices()
+    regions = args.regions or regional_prices.regions()
+    dates, changes = region_change_matrix(regional_prices, regions)
+    for region, changepoints in zip(regions, detect_changepoints(changes, penalty=args.penalty)):
+        # the knee of the prices is the month after the last change of a segment
+        print(f"{region};{','.join(str(dates[k + 1]) for k in changepoints)}")
+
+
+def command_breakpoint_batch(args):
+    from Sandbox.batch import run_breakpoint_batch
+
+    summary = run_breakpoint_batch(args.regions, processes=args.processes, chains=args.chains, draws=args.draws,
+                                   tune=args.tune, seed=args.seed, model=args.model, trace_store=args.trace_store,
+                                   prescan=args.prescan, streaming=args.streaming, thin=args.thin)
+    if args.output:
+        summary.to_csv(args.output, sep=';')
+    print(summary.to_string())
+
+
+def command_breakpoint_hierarchical(args):
+    from Sandbox.batch import run_hierarchical_breakpoint
+
+    summary = run_hierarchical_breakpoint(args.regions, chains=args.chains, cores=args.cores, draws=args.draws,
+                                          tune=args.tune, seed=args.seed, plot_output=args.plot_output,
+                                          trace_store=args.trace_store)
+    if args.output:
+        summary.to_csv(args.output, sep=';')
+    print(summary.to_string())
+
+
+def command_rolling(args):
+    from Sandbox.rolling import rolling_price_trend, rolling_wage_correlation
+
+    options = {"window": args.window, "step": args.step, "expanding": args.expanding, "draws": args.draws,
+               "warm_start": not args.no_warm_start, "processes": args.processes, "trace_store": args.trace_store,
+               "run_info": run_info(args)}
+    if args.model == "trend":
+        prices, _ = price_series(args)
+        summary = rolling_price_trend(prices, **options)
+    else:
+        summary = rolling_wage_correlation(load_national_prices(args.min_year), load_wage_growth(args.min_year),
+                                           **options)
+    if args.output:
+        summary.to_csv(args.output, sep=';')
+    print(summary.to_string())
+
+
+def command_sweep(args):
+    from Sandbox.scenarios import SweepInputs, sweep_to_disk
+
+    inputs = SweepInputs.from_regions(args.regions)
+    output_dir = sweep_to_disk(args.output, inputs, args.margins, args.payback_years, args.debt_ratios,
+                               args.rate_shocks, cost=args.cost)
+    print(f"wrote {len(inputs.regions)} regions x {len(inputs.dates)} months of scenarios to {output_dir}")
+
+
+# Run id of the latest run of either breakpoint model for a region, both sample late_trend
+def latest_breakpoint_run(store, region):
+    runs = [run for model in BREAKPOINT_RUN_MODELS for run in store.runs(model=model, region=region)]
+    if not runs:
+        raise SystemExit(f"no {' or '.join(BREAKPOINT_RUN_MODELS)} run for {region} in {store.root}, "
+                         f"run breakpoint-batch first or pass --run-ids")
+    return max(runs, key=lambda metadata: (metadata["created"], metadata["run_id"]))["run_id"]
+
+
+def command_project(args):
+    from Sandbox.projection import ProjectionInputs, analytic_draws, project, projection_table, stored_draws
+    from Sandbox.trace_store import TraceStore
+
+    if args.model == "breakpoint":
+        inputs = ProjectionInputs.from_regions(args.regions)
+        if args.trace_store is None:
+            raise SystemExit("the breakpoint model needs --trace-store with a run for every region")
+        store = TraceStore(args.trace_store)
+        # the latest run of every region unless the runs are given, in the order of the regions
+        run_ids = args.run_ids or [latest_breakpoint_run(store, region) for region in inputs.regions]
+        draws = {"late_trend": stored_draws(store, run_ids, "late_trend")}
+    else:
+        inputs = ProjectionInputs.national(args.min_year)
+        if args.run_ids:
+            draws = {"beta": stored_draws(args.trace_store, args.run_ids[:1], "beta")}
+        else:
+            draws = analytic_draws(args.model, min_year=args.min_year, seed=args.seed)
+    result = project(inputs, args.model, draws, paths=args.paths, horizon=args.horizon, margin=args.margin,
+                     cost=args.cost, seed=args.seed, memory_bytes=args.memory_mb * 2 ** 20, processes=args.processes)
+    table = projection_table(result)
+    if args.output:
+        table.to_csv(args.output, sep=";", index=False)
+        print(f"wrote {len(table)} rows to {args.output}")
+    else:
+        print(table[table["month"] % 12 == 0].round(3).to_string(index=False))
+
+
+def command_compare(args):
+    from Sandbox.comparison import run_model_comparison
+
+    table = run_model_comparison(args.regions, processes=args.processes, draws=args.draws, seed=args.seed)
+    if args.output:
+        table.to_csv(args.output, sep=";")
+        print(f"wrote {len(table)} rows to {args.output}")
+    else:
+        print(table.round(3).to_string())
+
+
+def command_report(args):
+    from Sandbox.report import REPORT_DIR, RESULTS_DIR, render_report, report_jobs
+
+    output_dir = args.output_dir or (RESULTS_DIR if args.replace_committed else REPORT_DIR)
+    rendered, skipped = render_report(output_dir, processes=args.processes, force=args.force, names=args.only,
+                                      jobs=report_jobs(draws=args.draws), replace_committed=args.replace_committed)
+    print(f"rendered {len(rendered)}: {', '.join(sorted(rendered))}")
+    print(f"unchanged {len(skipped)}: {', '.join(sorted(skipped))}")
+
+
+# metadata saved with the traces of a command
+def run_info(args):
+    info = {"region": getattr(args, "region", None)}
+    if getattr(args, "min_year", None) is not None:
+        info["min_year"] = args.min_year
+    return info
+
+
+def command_traces(args):
+    from Sandbox.trace_store import TraceStore
+
+    selection = {key: value for key, value in [("model", args.model), ("region", args.region)] if value is not None}
+    for metadata in TraceStore(args.trace_store).runs(**selection):
+        window = f" {metadata['window_start']} - {metadata['window_end']}" if "window_end" in metadata else ""
+        print(f"{metadata['run_id']};{metadata['model']};{metadata.get('region') or 'national'}{window};"
+              f"{metadata.get('sampling_seconds', 0):.2f} s")
+
+
+def command_trace_summary(args):
+    from Sandbox.trace_store import TraceStore
+
+    summary = TraceStore(args.trace_store).summary(args.run_id, args.var_names, draws=args.draws)
+    print(summary.round(3).to_string())
+
+
+def command_trace_plot(args):
+    import arviz as az
+    from Sandbox.figures import show_or_save
+    from Sandbox.trace_store import TraceStore
+
+    az.plot_trace(TraceStore(args.trace_store).open(args.run_id, args.var_names, draws=args.draws))
+    show_or_save(args.output)
+
+
+def command_benchmark(args):
+    from Sandbox.benchmark import run_benchmarks, print_benchmark_results, print_results, write_benchmark_results, \
+        read_benchmark_results, compare_benchmark_results
+
+    if args.results:
+        report = read_benchmark_results(args.results)
+    else:
+        report = run_benchmarks(args.scales, [] if args.skip_models else args.model_scales, args.repeat, args.draws,
+                                args.tune)
+        print_benchmark_results(report)
+    if args.output:
+        write_benchmark_results(report, args.output)
+    if args.compare:
+        comparison = compare_benchmark_results(read_benchmark_results(args.compare), report)
+        print_results(comparison)
+        if args.fail_on_regression and any(row["regression"] for row in comparison):
+            return 4
+
+
+def command_calibrate_advi(args):
+    from Sandbox.benchmark import calibrate_variational, print_results
+
+    print_results(calibrate_variational(args.methods, args.region, args.min_year, args.draws, args.seed))
+
+
+# Wall time since this process started, interpreter startup and imports included. Linux gives the start in clock
+# ticks since boot in /proc/self/stat, elsewhere the CPU time of the process is the nearest measure.
+def seconds_since_process_start():
+    try:
+        with open("/proc/self/stat") as stat_file:
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.process_time()
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def check_budget(command, args):
+    elapsed = seconds_since_process_start()
+    heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"{command} took {elapsed:.3f} s (budget {args.budget:.3f} s)", file=sys.stderr)
+    if heavy:
+        print(f"{command} imported {', '.join(heavy)}", file=sys.stderr)
+    if args.enforce_budget and (elapsed > args.budget or heavy):
+        return 3
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m Sandbox", description="Housing price analysis")
+    parser.add_argument("--log-events", action="store_true",
+                        help="log a timing event for every loader, transform and model stage to stderr")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the summed time, rows and cache hits per stage to stderr when done")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="include the allocation peak of every stage, slows down the loaders")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help="load one series and print it as date;value rows")
+    load.add_argument("--series", choices=list(NATIONAL_SERIES) + ["regional"], default="national")
+    load.add_argument("--min-year", type=int, default=1992)
+    load.add_argument("--region")
+    load.add_argument("--quiet", action="store_true", help="load without printing the series")
+    load.add_argument("--budget", type=float, default=DATA_COMMAND_BUDGET_SECONDS,
+                      help="startup time budget in seconds")
+    load.add_argument("--enforce-budget", action="store_true",
+                      help="exit with status 3 when over budget or when a heavy library was imported")
+    load.set_defaults(func=command_load)
+
+    stats = subparsers.add_parser("stats", help="plot P, r, L, c, K and K/L")
+    stats.add_argument("--min-year", type=int, default=1992)
+    stats.add_argument("--region", help="use the prices of a region instead of the national index")
+    stats.set_defaults(func=command_stats)
+
+    trend = subparsers.add_parser("trend", help="fit the linear price trend model")
+    trend.add_argument("--min-year", type=int, default=1992)
+    trend.add_argument("--region", help="use the prices of a region instead of the national index")
+    trend.add_argument("--method", choices=["analytic", "nuts", "advi", "fullrank_advi"], default="analytic",
+                       help="closed form posterior, pymc3 sampling to validate it, or a variational approximation")
+    trend.set_defaults(func=command_trend)
+
+    wage_correlation = subparsers.add_parser("wage-correlation", help="fit prices against wages")
+    wage_correlation.add_argument("--min-year", type=int, default=1992)
+    wage_correlation.add_argument("--method", choices=["analytic", "nuts", "advi", "fullrank_advi"],
+                                  default="analytic",
+                                  help="closed form posterior, pymc3 sampling to validate it, "
+                                       "or a variational approximation")
+    wage_correlation.set_defaults(func=command_wage_correlation)
+
+    breakpoint = subparsers.add_parser("breakpoint", help="fit the changepoint model on a region")
+    breakpoint.add_argument("--region", default="Stavanger")
+    breakpoint.add_argument("--model", choices=["cauchy", "marginalized"], default="cauchy")
+    breakpoint.add_argument("--method", choices=["nuts", "advi", "fullrank_advi"], default="nuts",
+                            help="sampling, or a variational approximation of the marginalized model")
+    breakpoint.set_defaults(func=command_breakpoint)
+
+    changepoints = subparsers.add_parser("changepoints", help="detect the changepoints of every region's prices")
+    changepoints.add_argument("--regions", nargs="+", help="defaults to every region in the data")
+    changepoints.add_argument("--penalty", type=float, help="cost of a changepoint, defaults to BIC")
+    changepoints.set_defaults(func=command_changepoints)
+
+    breakpoint_batch = subparsers.add_parser("breakpoint-batch", help="fit the changepoint model on many regions")
+    breakpoint_batch.add_argument("--regions", nargs="+", help="defaults to every region in the data")
+    breakpoint_batch.add_argument("--processes", type=int, help="defaults to the number of cores")
+    breakpoint_batch.add_argument("--chains", type=int, default=2)
+    breakpoint_batch.add_argument("--draws", type=int, default=1000)
+    breakpoint_batch.add_argument("--tune", type=int, default=1000)
+    breakpoint_batch.add_argument("--seed", type=int, default=8927)
+    breakpoint_batch.add_argument("--model", choices=["cauchy", "marginalized"], default="cauchy")
+    breakpoint_batch.add_argument("--output", help="write the summary table to this file as csv")
+    for command in [breakpoint, breakpoint_batch]:
+        command.add_argument("--prescan", action="store_true",
+                             help="centre the changepoint prior on the strongest detected changepoint and start there")
+        command.add_argument("--streaming", action="store_true",
+                             help="summarize the draws while sampling instead of keeping them in memory")
+        command.add_argument("--thin", type=int, default=1,
+                             help="with --streaming and --trace-store, save every thin-th draw")
+    breakpoint_batch.set_defaults(func=command_breakpoint_batch)
+
+    hierarchical = subparsers.add_parser("breakpoint-hierarchical",
+                                         help="fit one changepoint model on all regions with partial pooling")
+    hierarchical.add_argument("--regions", nargs="+", help="defaults to every region in the data")
+    hierarchical.add_argument("--chains", type=int, default=2)
+    hierarchical.add_argument("--cores", type=int, default=1)
+    hierarchical.add_argument("--draws", type=int, default=1000)
+    hierarchical.add_argument("--tune", type=int, default=1000)
+    hierarchical.add_argument("--seed", type=int, default=8927)
+    hierarchical.add_argument("--plot-output", help="save the trace plot of the common parameters to this file")
+    hierarchical.add_argument("--output", help="write the summary table to this file as csv")
+    hierarchical.set_defaults(func=command_breakpoint_hierarchical)
+
+    rolling = subparsers.add_parser("rolling", help="re-estimate a model over rolling or expanding windows")
+    rolling.add_argument("--model", choices=["trend", "wage-correlation"], default="trend")
+    rolling.add_argument("--min-year", type=int, default=1992)
+    rolling.add_argument("--region", help="trend only: use the prices of a region instead of the national index")
+    rolling.add_argument("--window", type=int, default=60, help="months, or the first window when expanding")
+    rolling.add_argument("--step", type=int, default=1, help="months between windows")
+    rolling.add_argument("--expanding", action="store_true")
+    rolling.add_argument("--draws", type=int, default=1000)
+    rolling.add_argument("--no-warm-start", action="store_true",
+                         help="fit windows independently, in parallel over --processes")
+    rolling.add_argument("--processes", type=int)
+    rolling.add_argument("--output", help="write the summary table to this file as csv")
+    rolling.set_defaults(func=command_rolling)
+
+    scenarios = subparsers.add_parser("sweep", help="cost factor, K and K/L over a grid of loan scenarios")
+    scenarios.add_argument("--regions", nargs="+", help="defaults to every region in the data")
+    scenarios.add_argument("--margins", nargs="+", type=float, default=[2], help="interest margins in percent")
+    scenarios.add_argument("--payback-years", nargs="+", type=float, default=[30])
+    scenarios.add_argument("--debt-ratios", nargs="+", type=float, default=[0.85])
+    scenarios.add_argument("--rate-shocks", nargs="+", type=float, default=[0],
+                           help="changes of the interest rate in percentage points")
+    scenarios.add_argument("--cost", choices=["annuity", "regression"], default="annuity")
+    scenarios.add_argument("--output", required=True, help="directory for the .npy results and axes.json")
+    scenarios.set_defaults(func=command_sweep)
+
+    projection = subparsers.add_parser("project", help="Monte Carlo projection of K and K/L from posterior draws")
+    projection.add_argument("--model", choices=["trend", "wage_correlation", "breakpoint"], default="trend")
+    projection.add_argument("--regions", nargs="+", help="regions of the breakpoint model, defaults to every region")
+    projection.add_argument("--trace-store", help="take the posterior draws from runs in this directory")
+    projection.add_argument("--run-ids", nargs="+", help="runs to take the draws from, one per region for "
+                                                         "breakpoint, defaults to the latest run of every region")
+    projection.add_argument("--min-year", type=int, default=1992)
+    projection.add_argument("--paths", type=int, default=100_000)
+    projection.add_argument("--horizon", type=int, default=120, help="months after the last observation")
+    projection.add_argument("--margin", type=float, default=2, help="interest margin in percent")
+    projection.add_argument("--cost", choices=["annuity", "regression"], default="regression")
+    projection.add_argument("--seed", type=int, default=8927)
+    projection.add_argument("--memory-mb", type=int, default=512, help="memory of the simulated paths per process")
+    projection.add_argument("--processes", type=int, default=1)
+    projection.add_argument("--output", help="csv file for every month, prints every year otherwise")
+    projection.set_defaults(func=command_project)
+
+    compare = subparsers.add_parser("compare", help="rank the trend, wage correlation and breakpoint models of every "
+                                                    "region by PSIS-LOO, with WAIC and posterior-predictive checks")
+    compare.add_argument("--regions", nargs="+", help="defaults to every region in the data")
+    compare.add_argument("--processes", type=int, help="defaults to the number of cores")
+    compare.add_argument("--draws", type=int, default=4000)
+    compare.add_argument("--seed", type=int, default=8927)
+    compare.add_argument("--output", help="csv file for the table, prints it otherwise")
+    compare.set_defaults(func=command_compare)
+
+    report = subparsers.add_parser("report", help="render every figure to png files without showing them")
+    report.add_argument("--output-dir", help="defaults to results/report, which is not committed")
+    report.add_argument("--replace-committed", action="store_true",
+                        help="render into results/, over the committed figures")
+    report.add_argument("--processes", type=int, help="defaults to the number of cores")
+    report.add_argument("--force", action="store_true", help="render figures whose inputs have not changed too")
+    report.add_argument("--only", nargs="+", help="names of the figures to render")
+    report.add_argument("--draws", type=int, default=1000)
+    report.set_defaults(func=command_report)
+
+    for command in [trend, wage_correlation, breakpoint, breakpoint_batch, hierarchical, rolling]:
+        command.add_argument("--trace-store", help="save the sampled traces to this directory")
+
+    traces = subparsers.add_parser("traces", help="list the runs saved in a trace store")
+    traces.add_argument("--model")
+    traces.add_argument("--region")
+    traces.set_defaults(func=command_traces)
+
+    trace_summary = subparsers.add_parser("trace-summary", help="summary of a saved run")
+    trace_summary.add_argument("run_id")
+    trace_summary.set_defaults(func=command_trace_summary)
+
+    trace_plot = subparsers.add_parser("trace-plot", help="trace plot of a saved run")
+    trace_plot.add_argument("run_id")
+    trace_plot.add_argument("--output", help="save the plot to this file instead of showing it")
+    trace_plot.set_defaults(func=command_trace_plot)
+
+    for command in [trace_summary, trace_plot]:
+        command.add_argument("--var-names", nargs="+", help="read only these variables")
+        command.add_argument("--draws", type=int, help="read only the first draws of each chain")
+    for command in [traces, trace_summary, trace_plot]:
+        command.add_argument("--trace-store", default=str(DEFAULT_TRACE_DIR))
+
+    benchmark = subparsers.add_parser("benchmark", help="time the loaders and models on real and scaled-up data")
+    benchmark.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100, 1000])
+    benchmark.add_argument("--model-scales", nargs="+", type=int, default=[1, 10])
+    benchmark.add_argument("--skip-models", action="store_true")
+    benchmark.add_argument("--repeat", type=int, default=3)
+    benchmark.add_argument("--draws", type=int, default=1000)
+    benchmark.add_argument("--tune", type=int, default=1000)
+    benchmark.add_argument("--output", help="write the results to this json file")
+    benchmark.add_argument("--results", help="use the results in this json file instead of running the suite")
+    benchmark.add_argument("--compare", help="compare with the results in this json file, e.g. from another commit")
+    benchmark.add_argument("--fail-on-regression", action="store_true",
+                           help="exit with status 4 when a benchmark is slower than in --compare")
+    benchmark.set_defaults(func=command_benchmark)
+
+    calibrate_advi = subparsers.add_parser("calibrate-advi",
+                                           help="compare the ADVI approximations with NUTS on the bundled data")
+    calibrate_advi.add_argument("--methods", nargs="+", choices=["advi", "fullrank_advi"],
+                                default=["advi", "fullrank_advi"])
+    calibrate_advi.add_argument("--region", default="Stavanger", help="region of the breakpoint model")
+    calibrate_advi.add_argument("--min-year", type=int, default=1992)
+    calibrate_advi.add_argument("--draws", type=int, default=1000)
+    calibrate_advi.add_argument("--seed", type=int, default=8927)
+    calibrate_advi.set_defaults(func=command_calibrate_advi)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.log_events or args.profile or args.profile_memory:
+        instrument.enable(memory=args.profile_memory, as_profile=not args.log_events)
+        if args.log_events:
+            instrument.log_to_stderr()
+    try:
+        return args.func(args) or 0
+    finally:
+        if instrument.profile is not None:
+            instrument.print_profile()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
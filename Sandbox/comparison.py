@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Sandbox.batch import DEFAULT_SEED, region_seeds
+from Sandbox.conjugate import linear_regression_posterior
+from Sandbox.load_data import MAX_DATE, load_regional_prices, load_wage_growth
+from Sandbox.run_model import BREAKPOINT_PRIORS, BREAKPOINT_SCALING_FACTOR, CHANGEPOINT_PRIOR, PRICE_TREND_PRIORS, \
+    WAGE_CORRELATION_PRIORS, changepoint_statistics
+
+MODEL_FAMILIES = ["trend", "wage_correlation", "breakpoint"]
+# statistics of the observed series that the posterior-predictive series are checked against
+PPC_STATISTICS = ["mean", "sd", "autocorrelation"]
+# Pareto k above which the PSIS-LOO estimate of an observation is unreliable
+PARETO_K_THRESHOLD = 0.7
+
+
+# The model families compared on the same observations, the scaled monthly price changes y of a series, each
+# with the unit observation sd of the pymc3 models, y ~ N(mu, 1):
+#   "trend": the change of run_price_trend_model's linear trend, mu = beta (the monthly slope) * scaling factor
+#   "wage_correlation": the change of run_wage_correlation_model's line, mu = beta * the scaled wage change
+#   "breakpoint": the breakpoint model, mu = early_trend up to the changepoint and late_trend after it
+# The priors are those of the pymc3 models, so every posterior is exact: the linear models are conjugate,
+# and the breakpoint model is conjugate given the changepoint, which is summed over like in
+# build_marginalized_breakpoint_model. Returns the posterior draws and the mean of every observation,
+# shape (draws, observations).
+def posterior_draws(family, changes, wage_changes, draws, rng, prior_location=CHANGEPOINT_PRIOR[0]):
+    if family == "trend":
+        return linear_posterior_draws("beta", PRICE_TREND_PRIORS["beta"], np.full(len(changes), 1.0), changes,
+                                      draws, rng)
+    if family == "wage_correlation":
+        return linear_posterior_draws("beta", WAGE_CORRELATION_PRIORS["beta"], wage_changes, changes, draws, rng)
+    if family == "breakpoint":
+        return breakpoint_posterior_draws(changes, draws, rng, prior_location)
+    raise ValueError(f"unknown model family {family}, expected one of {MODEL_FAMILIES}")
+
+
+# y ~ N(coefficient * scaling factor * x, 1) with a Normal prior (mu, sd) on the coefficient
+def linear_posterior_draws(name, prior, x, changes, draws, rng):
+    design = BREAKPOINT_SCALING_FACTOR * np.asarray(x, dtype=np.float64)[:, None]
+    mean, covariance = linear_regression_posterior(design, changes, [prior[0]], [prior[1]])
+    coefficient = rng.normal(mean[0], np.sqrt(covariance[0, 0]), size=draws)
+    return {name: coefficient}, coefficient[:, None] * design[:, 0]
+
+
+# Draws the changepoint from its exact posterior over the candidates of changepoint_statistics, then the
+# trends from their Normal posteriors given the changepoint
+def breakpoint_posterior_draws(changes, draws, rng, prior_location=CHANGEPOINT_PRIOR[0]):
+    statistics = changepoint_statistics(changes, prior_location)
+    segments = {"early_trend": "early", "late_trend": "late"}
+    log_posterior = statistics["log_prior"] + sum(
+        segment_log_evidence(statistics[f"count_{segment}"], statistics[f"sum_{segment}"],
+                             statistics[f"sum_sq_{segment}"], *BREAKPOINT_PRIORS[name])
+        for name, segment in segments.items())
+    probabilities = np.exp(log_posterior - np.logaddexp.reduce(log_posterior))
+    candidate = rng.choice(len(probabilities), size=draws, p=probabilities / probabilities.sum())
+
+    posterior = {"changepoint": statistics["candidates"][candidate]}
+    for name, segment in segments.items():
+        prior_mean, prior_sd = BREAKPOINT_PRIORS[name]
+        precision = 1 / prior_sd ** 2 + statistics[f"count_{segment}"][candidate]
+        mean = (prior_mean / prior_sd ** 2 + statistics[f"sum_{segment}"][candidate]) / precision
+        posterior[name] = rng.normal(mean, 1 / np.sqrt(precision))
+    early = np.arange(len(changes)) <= posterior["changepoint"][:, None]
+    return posterior, np.where(early, posterior["early_trend"][:, None], posterior["late_trend"][:, None])
+
+
+# Log marginal likelihood of count unit sd observations with the given sum and sum of squares sharing one mean
+# with a Normal prior (mu, sd), for arrays of segments
+def segment_log_evidence(count, total, total_sq, prior_mean, prior_sd):
+    variance = prior_sd ** 2
+    residual_sq = total_sq - 2 * prior_mean * total + count * prior_mean ** 2
+    residual = total - count * prior_mean
+    return -0.5 * (count * np.log(2 * np.pi) + np.log1p(count * variance)
+                   + residual_sq - variance * residual ** 2 / (1 + count * variance))
+
+
+# Pointwise log likelihood of every draw and observation, (draws, observations)
+def pointwise_log_likelihood(changes, mean):
+    return -0.5 * (changes - mean) ** 2 - 0.5 * np.log(2 * np.pi)
+
+
+def ppc_statistics(series):
+    centred = series - series.mean(axis=-1, keepdims=True)
+    autocorrelation = (centred[..., 1:] * centred[..., :-1]).sum(axis=-1) / (centred * centred).sum(axis=-1)
+    return {"mean": series.mean(axis=-1), "sd": series.std(axis=-1), "autocorrelation": autocorrelation}
+
+
+# Posterior-predictive series of every draw and the fraction of them whose statistic is at least the
+# observed one, per PPC_STATISTICS. Values near 0 or 1 show what the model does not reproduce.
+def posterior_predictive_check(changes, mean, rng):
+    predicted = mean + rng.standard_normal(mean.shape)
+    observed = ppc_statistics(changes)
+    p_values = {name: float((values >= observed[name]).mean()) for name, values in ppc_statistics(predicted).items()}
+    return predicted, p_values
+
+
+# Fits every model family on one series of price changes and ranks them by PSIS-LOO.
+# changes and wage_changes are the monthly changes of the price index and the wage level on the same months.
+# Returns the comparison table (see rank_models) and the InferenceData of every family, with the
+# log_likelihood, posterior_predictive and observed_data groups for arviz' plots.
+def compare_models(changes, wage_changes, draws=4000, random_seed=None, families=MODEL_FAMILIES,
+                   prior_location=CHANGEPOINT_PRIOR[0]):
+    import arviz as az
+
+    rng = np.random.default_rng(random_seed)
+    changes = np.asarray(changes, dtype=np.float64) * BREAKPOINT_SCALING_FACTOR
+    wage_changes = np.asarray(wage_changes, dtype=np.float64)
+    fits, p_values = {}, {}
+    for family in families:
+        posterior, mean = posterior_draws(family, changes, wage_changes, draws, rng, prior_location)
+        predicted, p_values[family] = posterior_predictive_check(changes, mean, rng)
+        fits[family] = az.from_dict(posterior={name: values[None] for name, values in posterior.items()},
+                                    log_likelihood={"price_change": pointwise_log_likelihood(changes, mean)[None]},
+                                    posterior_predictive={"price_change": predicted[None]},
+                                    observed_data={"price_change": changes})
+    return rank_models(fits, p_values), fits
+
+
+# One row per model family, best first: elpd_loo and its standard error, the effective number of parameters,
+# the difference to the best model with the standard error of the pointwise differences, pseudo-BMA weights,
+# the same for WAIC, the observations with a Pareto k above PARETO_K_THRESHOLD and the PPC p-values.
+def rank_models(fits, p_values=None):
+    import arviz as az
+    import pandas as pd
+
+    loo = {family: az.loo(fit, pointwise=True) for family, fit in fits.items()}
+    waic = {family: az.waic(fit, pointwise=True) for family, fit in fits.items()}
+    best = max(loo, key=lambda family: loo[family]["loo"])
+    elpd = np.array([loo[family]["loo"] for family in fits])
+    weights = np.exp(elpd - np.logaddexp.reduce(elpd))
+
+    rows = []
+    for family, weight in zip(fits, weights):
+        difference = loo[best]["loo_i"].values - loo[family]["loo_i"].values
+        rows.append({
+            "model": family,
+            "elpd_loo": loo[family]["loo"],
+            "se": loo[family]["loo_se"],
+            "p_loo": loo[family]["p_loo"],
+            "elpd_diff": difference.sum(),
+            "dse": np.sqrt(len(difference) * difference.var()),
+            "weight": weight,
+            "elpd_waic": waic[family]["waic"],
+            "p_waic": waic[family]["p_waic"],
+            "high_pareto_k": int((loo[family]["pareto_k"].values > PARETO_K_THRESHOLD).sum()),
+            **{f"ppc_{name}": value for name, value in (p_values or {}).get(family, {}).items()},
+        })
+    table = pd.DataFrame(rows).sort_values("elpd_loo", ascending=False).set_index("model")
+    table.insert(0, "rank", np.arange(len(table)))
+    return table
+
+
+# The monthly changes of a region's price index and of the wage level on the same months. As in
+# SweepInputs.from_regions the wages are normalized at the region's start year, like its prices.
+def region_changes(regional_prices, region, max_date=MAX_DATE):
+    changes = regional_prices[region].prices.diff()
+    wage_changes = load_wage_growth(regional_prices[region].start_year, max_date).diff()
+    positions = np.searchsorted(wage_changes.dates, changes.dates)
+    if positions.max() >= len(wage_changes) or np.any(wage_changes.dates[positions] != changes.dates):
+        raise ValueError(f"the wage series does not cover the months of {region}")
+    return changes, wage_changes.values[positions]
+
+
+# Runs in a worker process, the InferenceData stay there
+def compare_region(region, changes, wage_changes, draws, random_seed):
+    table, _ = compare_models(changes, wage_changes, draws, random_seed)
+    return region, table
+
+
+# compare_models for every region in a pool of processes. Returns one table indexed by region and model,
+# the models of every region ranked best first.
+def run_model_comparison(regions=None, processes=None, draws=4000, seed=DEFAULT_SEED):
+    import pandas as pd
+
+    regional_prices = load_regional_prices()
+    if regions is None:
+        regions = regional_prices.regions()
+    seeds = region_seeds(regions, 1, seed)
+    processes = processes or os.cpu_count() or 1
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(processes, len(regions))) as pool:
+        futures = []
+        for region in regions:
+            changes, wage_changes = region_changes(regional_prices, region)
+            futures.append(pool.submit(compare_region, region, changes.values, wage_changes, draws, seeds[region][0]))
+        for future in futures:
+            region, table = future.result()
+            results[region] = table
+
+    return pd.concat([results[r] for r in regions], keys=regions, names=["region", "model"])
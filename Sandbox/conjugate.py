@@ -0,0 +1,105 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from Sandbox.run_model import PRICE_TREND_PRIORS, PRICE_TREND_INTERCEPT, WAGE_CORRELATION_PRIORS
+
+HDI_PROB = 0.94
+
+
+# Exact posterior of Bayesian linear regression with independent Normal priors and a known observation sd:
+#   observed = offset + design @ coefficients + N(0, sigma)
+# design has shape (..., n, p) and observed (..., n), so many series or windows are solved in one call.
+# Returns the posterior means (..., p) and covariances (..., p, p).
+def linear_regression_posterior(design, observed, prior_mean, prior_sd, sigma=1.0, offset=0.0):
+    design = np.asarray(design, dtype=np.float64)
+    observed = np.asarray(observed, dtype=np.float64)
+    prior_mean = np.asarray(prior_mean, dtype=np.float64)
+    prior_precision = 1 / np.asarray(prior_sd, dtype=np.float64) ** 2
+
+    precision = np.einsum('...ni,...nj->...ij', design, design) / sigma ** 2 + np.diag(prior_precision)
+    rhs = np.einsum('...ni,...n->...i', design, observed - offset) / sigma ** 2 + prior_precision * prior_mean
+    covariance = np.linalg.inv(precision)
+    mean = np.einsum('...ij,...j->...i', covariance, rhs)
+    return mean, covariance
+
+
+# Same columns as pm.summary(..., kind="stats"). For a Normal marginal the highest density interval is central.
+def posterior_summary(names, mean, covariance, hdi_prob=HDI_PROB):
+    import pandas as pd
+
+    sd = np.sqrt(np.diagonal(covariance))
+    z = NormalDist().inv_cdf(0.5 + hdi_prob / 2)
+    low = f"hdi_{100 * (1 - hdi_prob) / 2:g}%"
+    high = f"hdi_{100 * (1 + hdi_prob) / 2:g}%"
+    return pd.DataFrame({"mean": mean, "sd": sd, low: mean - z * sd, high: mean + z * sd}, index=names)
+
+
+def price_trend_design(n):
+    return np.arange(0, n, dtype=np.float64)[:, None]
+
+
+def wage_correlation_design(wages):
+    wages = np.asarray(wages, dtype=np.float64)
+    return np.stack([np.ones_like(wages), wages], axis=-1)
+
+
+# run_price_trend_model without sampling
+def price_trend_posterior(pricedata):
+    mean, covariance = linear_regression_posterior(price_trend_design(len(pricedata)), pricedata.values,
+                                                   *prior_arrays(PRICE_TREND_PRIORS), offset=PRICE_TREND_INTERCEPT)
+    return posterior_summary(list(PRICE_TREND_PRIORS), mean, covariance)
+
+
+# run_wage_correlation_model without sampling
+def wage_correlation_posterior(pricedata, wages):
+    mean, covariance = linear_regression_posterior(wage_correlation_design(wages.values), pricedata.values,
+                                                   *prior_arrays(WAGE_CORRELATION_PRIORS))
+    return posterior_summary(list(WAGE_CORRELATION_PRIORS), mean, covariance)
+
+
+def prior_arrays(priors):
+    return [p[0] for p in priors.values()], [p[1] for p in priors.values()]
+
+
+# Windows over the last axis: shape (..., windows, window). Windows are views, nothing is copied.
+def rolling_windows(values, window, step=1):
+    windows = np.lib.stride_tricks.sliding_window_view(np.asarray(values, dtype=np.float64), window, axis=-1)
+    return windows[..., ::step, :]
+
+
+# Price trend slope for many series at once, values (..., n). As in the trend model the series
+# starts at the intercept 1, so each row is first normalized by its first value.
+# Returns posterior means and sds of the slope, shape (...).
+def batch_price_trend(values):
+    values = np.asarray(values, dtype=np.float64)
+    values = values / values[..., :1]
+    mean, covariance = linear_regression_posterior(price_trend_design(values.shape[-1]), values,
+                                                   *prior_arrays(PRICE_TREND_PRIORS), offset=PRICE_TREND_INTERCEPT)
+    return mean[..., 0], np.sqrt(covariance[..., 0, 0])
+
+
+# Intercept and wage coefficient for many pairs of price and wage series, shapes (..., n).
+# Returns posterior means (..., 2) and sds (..., 2) in the order intercept, beta.
+def batch_wage_correlation(prices, wages):
+    mean, covariance = linear_regression_posterior(wage_correlation_design(wages), prices,
+                                                   *prior_arrays(WAGE_CORRELATION_PRIORS))
+    return mean, np.sqrt(np.diagonal(covariance, axis1=-2, axis2=-1))
+
+
+# Validation against pymc3: fits the model both ways and returns the analytic and sampled summaries
+# with the largest absolute difference of means and sds in units of the analytic sd.
+def compare_with_sampling(pricedata, wages=None, draws=2000, random_seed=None):
+    from Sandbox.run_model import run_price_trend_model, run_wage_correlation_model
+
+    if wages is None:
+        analytic = run_price_trend_model(pricedata, method="analytic", show=False)
+        sampled = run_price_trend_model(pricedata, draws=draws, show=False, random_seed=random_seed)
+    else:
+        analytic = run_wage_correlation_model(pricedata, wages, method="analytic", show=False)
+        sampled = run_wage_correlation_model(pricedata, wages, draws=draws, show=False, random_seed=random_seed)
+
+    sampled = sampled.loc[analytic.index]
+    mean_error = float((abs(sampled["mean"] - analytic["mean"]) / analytic["sd"]).max())
+    sd_error = float((abs(sampled["sd"] - analytic["sd"]) / analytic["sd"]).max())
+    return analytic, sampled, mean_error, sd_error
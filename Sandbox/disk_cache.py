@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from Sandbox import instrument
+from Sandbox.RegionCollection import RegionCollection
+from Sandbox.RegionPrices import RegionPrices
+from Sandbox.TimeSeries import TimeSeries
+
+# bump when the stored layout or any transformation in load_data changes meaning
+FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent / "cache"
+
+
+# Optional on-disk cache of fully transformed series.
+# Each entry is a directory of .npy files, named by a hash of the source file contents and the loader parameters,
+# and is loaded with memory mapping so a warm start neither parses CSV nor copies the arrays.
+class DiskCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.file_hashes = {}
+
+    def get_or_load(self, kind, file_paths, params, load):
+        entry_dir = self.cache_dir / f"{kind}-{self.key(kind, file_paths, params)}"
+        if entry_dir.is_dir():
+            self.hits += 1
+            instrument.count("cache", cache="disk", kind=kind, hit=True)
+            return read_entry(entry_dir)
+
+        self.misses += 1
+        instrument.count("cache", cache="disk", kind=kind, hit=False)
+        value = load()
+        self.write(entry_dir, value)
+        return value
+
+    def key(self, kind, file_paths, params):
+        digest = hashlib.sha256(f"{FORMAT_VERSION}|{kind}|{params!r}".encode())
+        for file_path in file_paths:
+            digest.update(self.file_hash(file_path).encode())
+        return digest.hexdigest()[:24]
+
+    # content hash, recomputed only when the size or modification time of the file changes
+    def file_hash(self, file_path):
+        stat = os.stat(file_path)
+        stamp = (str(file_path), stat.st_mtime_ns, stat.st_size)
+        if stamp not in self.file_hashes:
+            with open(file_path, 'rb') as f:
+                self.file_hashes[stamp] = hashlib.sha256(f.read()).hexdigest()
+        return self.file_hashes[stamp]
+
+    # entries are written to a temporary directory first, so a reader never sees a half written entry
+    def write(self, entry_dir, value):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-"))
+        try:
+            write_entry(tmp_dir, value)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def clear(self):
+        if self.cache_dir.is_dir():
+            shutil.rmtree(self.cache_dir)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cache_dir": str(self.cache_dir)}
+
+
+def write_entry(entry_dir, value):
+    if isinstance(value, TimeSeries):
+        meta = {"type": "series"}
+        dates, values = value.dates, value.values
+    elif isinstance(value, RegionCollection):
+        regions = []
+        position = 0
+        for region in value:
+            regions.append({"region": region.region, "start_year": region.start_year,
+                            "start": position, "stop": position + len(region.prices)})
+            position += len(region.prices)
+        meta = {"type": "regions", "regions": regions}
+        dates = np.concatenate([r.prices.dates for r in value])
+        values = np.concatenate([r.prices.values for r in value])
+    else:
+        raise TypeError(f"cannot store {type(value).__name__} in the disk cache")
+
+    np.save(entry_dir / "dates.npy", dates)
+    np.save(entry_dir / "values.npy", values)
+    with open(entry_dir / "meta.json", 'w') as f:
+        json.dump(meta, f)
+
+
+def read_entry(entry_dir):
+    with open(entry_dir / "meta.json") as f:
+        meta = json.load(f)
+    dates = np.load(entry_dir / "dates.npy", mmap_mode='r')
+    values = np.load(entry_dir / "values.npy", mmap_mode='r')
+
+    if meta["type"] == "series":
+        return TimeSeries(dates, values)
+    return RegionCollection(
+        RegionPrices(r["region"], TimeSeries(dates[r["start"]:r["stop"]], values[r["start"]:r["stop"]]), r["start_year"])
+        for r in meta["regions"])
+
+
+# The cache is off unless enabled here or through the SANDBOX_DISK_CACHE environment variable (a directory).
+active_cache = None
+
+
+def enable_disk_cache(cache_dir=DEFAULT_CACHE_DIR):
+    global active_cache
+    active_cache = DiskCache(cache_dir)
+    return active_cache
+
+
+def disable_disk_cache():
+    global active_cache
+    active_cache = None
+
+
+def get_or_load(kind, file_paths, params, load):
+    if active_cache is None:
+        return load()
+    return active_cache.get_or_load(kind, file_paths, params, load)
+
+
+if os.environ.get("SANDBOX_DISK_CACHE"):
+    enable_disk_cache(os.environ["SANDBOX_DISK_CACHE"])
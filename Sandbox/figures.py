@@ -0,0 +1,27 @@
+from pathlib import Path
+
+
+# Ends a plot: shows the current figure, or saves it to output and closes it when output is given.
+def show_or_save(output=None, dpi=100):
+    import matplotlib.pyplot as plt
+
+    if output is None:
+        plt.show()
+        return
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    plt.savefig(output, dpi=dpi, bbox_inches="tight")
+    plt.close("all")
+
+
+# A summary table (see run_model.show_summary) as a figure, rounded like the printed table.
+def plot_summary_table(summary, title=None, output=None):
+    import matplotlib.pyplot as plt
+
+    rounded = summary.round(3)
+    fig, ax = plt.subplots(figsize=(1.4 * (len(rounded.columns) + 1), 0.4 * (len(rounded) + 2)))
+    ax.axis("off")
+    ax.table(cellText=rounded.values.astype(str), rowLabels=[str(i) for i in rounded.index],
+             colLabels=list(rounded.columns), loc="center")
+    if title:
+        ax.set_title(title)
+    show_or_save(output)
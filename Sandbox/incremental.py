@@ -0,0 +1,223 @@
+import csv
+import datetime
+import time
+
+import numpy as np
+
+from Sandbox import resample
+from Sandbox.SeriesBuffer import SeriesBuffer
+from Sandbox.load_data import NATIONAL_MONTHLY_INDEX_FILE, INTEREST_RATE_FILE, WAGE_FILE, MONTHLY_INDEX_START, \
+    INTEREST_MARGIN, load_rows, load_quarterly_index, parse_date, interest_to_cost
+
+SOURCE_SERIES = ["index", "inflation", "wage", "interest"]
+
+# name -> (inputs, values of the months in tail). Every series comes after its inputs.
+# The operations are the ones of the loaders and main, in the same order.
+DERIVED_SERIES = {
+    "prices": (["index", "inflation"],
+               lambda index, inflation, tail: index[tail] / index[0] / inflation[tail]),
+    "wage_growth": (["wage", "inflation"],
+                    lambda wage, inflation, tail: wage[tail] / wage[0] / inflation[tail]),
+    "cost_factor": (["interest"],
+                    lambda interest, tail: interest_to_cost(interest[tail] + INTEREST_MARGIN)),
+    "total_cost": (["prices", "cost_factor"],
+                   lambda prices, cost_factor, tail: prices[tail] * cost_factor[tail]),
+    "total_cost_to_wage": (["total_cost", "wage_growth"],
+                           lambda total_cost, wage_growth, tail: total_cost[tail] / wage_growth[tail]),
+}
+
+
+# The national series of load_data, kept up to date by appending new observations instead of reloading the files.
+# Sources, all monthly from January of min_year:
+#   index      nominal price index: the quarterly index before 2003, the rescaled monthly index after
+#   inflation  inflation index, 1 in the first month
+#   wage       nominal wage level
+#   interest   policy rate as of the latest announcement
+# Derived: prices (P), wage_growth (L), cost_factor (c), total_cost (K) and total_cost_to_wage (K/L).
+# A month of a derived series is computed once all its inputs cover it, and only the months from the first
+# changed input month on are computed again. Every value is identical to a full rebuild with max_date=None.
+# The append methods return {series name: first changed position} for the series they changed.
+class IncrementalNationalSeries:
+    def __init__(self, min_year):
+        self.min_date = np.datetime64(datetime.date(min_year, 1, 1), 'D')
+        self.series = {name: SeriesBuffer() for name in SOURCE_SERIES + list(DERIVED_SERIES)}
+        self.announcements = SeriesBuffer()
+        self.last_year = None
+        self.last_wage = None
+        self.inflation_level = 100.0
+
+        index_quarterly = load_quarterly_index(MONTHLY_INDEX_START)
+        self.index_scale = index_quarterly.values[-1]
+        self.index_end = index_quarterly.dates[-1]
+        self._update(self._append_months("index", index_quarterly.dates, index_quarterly.values))
+
+    @classmethod
+    def from_files(cls, min_year):
+        series = cls(min_year)
+        series.append_index_rows(load_rows(NATIONAL_MONTHLY_INDEX_FILE))
+        series.append_yearly_rows(load_rows(WAGE_FILE))
+        # the interest rate file is newest first
+        announcements = [row for row in load_rows(INTEREST_RATE_FILE) if len(row) > 1]
+        series.append_interest_rows(sorted(announcements, key=lambda row: parse_date(row[0])))
+        return series
+
+    def __getitem__(self, name):
+        return self.series[name].series()
+
+    # Rows of the monthly index file: date (dd.mm.yyyy); index. Months the index already covers are skipped,
+    # which drops the month that overlaps the quarterly index and rows that are read again.
+    def append_index_rows(self, rows):
+        dates, values = [], []
+        for row in rows:
+            if len(row) < 2:
+                continue
+            date = np.datetime64(parse_date(row[0]), 'D')
+            if date <= self.index_end:
+                continue
+            self.index_end = date
+            dates.append(date)
+            values.append(parse_number(row[1]))
+        scaled = np.array(values, dtype=np.float64) * self.index_scale / 100
+        return self._update(self._append_months("index", dates, scaled))
+
+    # Rows of the wage file: year; wage; wage growth; inflation in percent. Years already added are skipped.
+    # A year adds its twelve months of wage and inflation.
+    def append_yearly_rows(self, rows):
+        wage_years, wage_starts, wage_ends = [], [], []
+        inflation_years, inflation_starts, inflation_ends = [], [], []
+        for row in rows:
+            if len(row) < 4:
+                continue
+            year = int(row[0])
+            if self.last_year is not None and year <= self.last_year:
+                continue
+            if self.last_year is not None and year != self.last_year + 1:
+                raise ValueError(f"expected the year {self.last_year + 1}, got {year}")
+            wage = parse_number(row[1])
+            if self.last_wage is not None:
+                wage_years.append(year)
+                wage_starts.append(self.last_wage)
+                wage_ends.append(wage)
+            if year >= self.min_date.astype('datetime64[Y]').astype(int) + 1970:
+                level = self.inflation_level * ((100 + parse_number(row[3])) / 100)
+                inflation_years.append(year)
+                inflation_starts.append(self.inflation_level)
+                inflation_ends.append(level)
+                self.inflation_level = level
+            self.last_year = year
+            self.last_wage = wage
+
+        changed = self._append_months("wage", *yearly_months(wage_years, wage_starts, wage_ends))
+        inflation_dates, inflation = yearly_months(inflation_years, inflation_starts, inflation_ends)
+        # normalized by the first month, which is the start level 100
+        changed.update(self._append_months("inflation", inflation_dates, inflation / 100.0))
+        return self._update(changed)
+
+    # Rows of the interest rate file: announcement date; rate, in date order. An announcement sets the rate
+    # of the months from its date on, so those months of r, c, K and K/L are computed again.
+    def append_interest_rows(self, rows):
+        dates, values = [], []
+        for row in rows:
+            if len(row) < 2:
+                continue
+            date = np.datetime64(parse_date(row[0]), 'D')
+            last_date = dates[-1] if dates else self.announcements.last_date()
+            if last_date is not None and date < last_date:
+                raise ValueError(f"interest rate announcement {date} is older than {last_date}")
+            dates.append(date)
+            values.append(parse_number(row[1]))
+        if not dates:
+            return {}
+        self.announcements.append(dates, values)
+
+        interest = self.series["interest"]
+        months = int(np.datetime64(dates[-1], 'M') - np.datetime64(self.min_date, 'M')) + 1
+        grid = resample.month_starts(self.min_date, max(months, 0))
+        start = min(int(np.searchsorted(grid, dates[0])), len(interest))
+        if start == len(grid):
+            return {}
+
+        # as of join of the changed months, like resample.asof on the sorted announcements
+        positions = np.searchsorted(self.announcements.dates, grid[start:], side='right') - 1
+        rates = np.where(positions >= 0, self.announcements.values[np.maximum(positions, 0)], np.nan)
+        interest.truncate(start)
+        interest.append(grid[start:], rates)
+        return self._update({"interest": start})
+
+    # Appends the months of a source from January of min_year on. They must continue the series without gaps.
+    def _append_months(self, name, dates, values):
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        values = np.asarray(values, dtype=np.float64)
+        keep = dates >= self.min_date
+        dates, values = dates[keep], values[keep]
+        if len(dates) == 0:
+            return {}
+
+        buffer = self.series[name]
+        last_date = buffer.last_date()
+        first_date = self.min_date if last_date is None else resample.month_starts(last_date, 2)[1]
+        if not np.array_equal(dates, resample.month_starts(first_date, len(dates))):
+            raise ValueError(f"{name} must continue with consecutive months from {first_date}, got {dates[0]}")
+        start = len(buffer)
+        buffer.append(dates, values)
+        return {name: start}
+
+    def _update(self, changed):
+        for name, (inputs, compute) in DERIVED_SERIES.items():
+            starts = [changed[i] for i in inputs if i in changed]
+            if not starts:
+                continue
+            buffer = self.series[name]
+            start = min(starts + [len(buffer)])
+            stop = min(len(self.series[i]) for i in inputs)
+            if stop <= start:
+                continue
+            tail = slice(start, stop)
+            values = compute(*[self.series[i].values for i in inputs], tail)
+            buffer.truncate(start)
+            buffer.append(self.series[inputs[0]].dates[tail], values)
+            changed[name] = start
+        return changed
+
+
+# Twelve months per year from the start to the end level of the year, as resample.yearly_to_monthly.
+def yearly_months(years, starts, ends):
+    if not years:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.float64)
+    return resample.month_starts(f"{years[0]}-01", 12 * len(years)), resample.linear_within_period(starts, ends, 12)
+
+
+def parse_number(value):
+    return float(value.replace(",", "."))
+
+
+# Rows added to a semicolon separated file. Iterating reads from offset (bytes, None to start after the header)
+# to the end of the file, waiting idle_seconds for more rows before stopping. offset is kept up to date,
+# so a nightly job can store it and continue from there on the next run. A last line without a line break
+# is left until it is complete.
+#   series.append_index_rows(CsvTail(path, offset))
+class CsvTail:
+    def __init__(self, file_path, offset=None, idle_seconds=0.0, poll_seconds=1.0):
+        self.file_path = file_path
+        self.offset = offset
+        self.idle_seconds = idle_seconds
+        self.poll_seconds = poll_seconds
+
+    def __iter__(self):
+        with open(self.file_path, 'rb') as csv_file:
+            if self.offset is None:
+                csv_file.readline()
+                self.offset = csv_file.tell()
+            csv_file.seek(self.offset)
+            last_row_time = time.monotonic()
+            while True:
+                line = csv_file.readline()
+                if line.endswith(b"\n"):
+                    self.offset += len(line)
+                    last_row_time = time.monotonic()
+                    yield next(csv.reader([line.decode()], delimiter=';'))
+                    continue
+                csv_file.seek(self.offset)
+                if time.monotonic() - last_row_time >= self.idle_seconds:
+                    return
+                time.sleep(self.poll_seconds)
@@ -0,0 +1,216 @@
+import atexit
+import functools
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+logger = logging.getLogger("Sandbox.instrument")
+
+# Off by default. While off, stage() returns a shared no-op object and instrumented functions call
+# straight through after one flag check, so the hooks cost next to nothing.
+enabled = False
+track_memory = False
+log_events = True
+callbacks = []
+# stage name -> totals, while a profile is collected instead of logging every event
+profile = None
+_open_stages = []
+
+
+# Turns instrumentation on. Events go to the "Sandbox.instrument" logger at INFO level, with the event
+# dict in the record's "event" attribute, and to callback(event) when one is given.
+# memory traces allocations with tracemalloc to report the allocation peak of every stage, which slows
+# down allocation heavy code. With as_profile the events are summed per stage instead of logged,
+# see profile_report.
+def enable(callback=None, memory=False, as_profile=False):
+    global enabled, track_memory, log_events, profile
+    enabled = True
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if callback is not None:
+        callbacks.append(callback)
+    log_events = not as_profile
+    profile = {} if as_profile else None
+
+
+def disable():
+    global enabled, track_memory, profile
+    enabled = False
+    if track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    track_memory = False
+    callbacks.clear()
+    profile = None
+
+
+class Stage:
+    def __init__(self, name, fields):
+        self.event = dict(fields, event="stage", stage=name)
+        self.child_peak = 0
+
+    def update(self, **fields):
+        self.event.update(fields)
+
+    def __enter__(self):
+        if track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if _open_stages:
+                _open_stages[-1].child_peak = max(_open_stages[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+        _open_stages.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.event["seconds"] = time.perf_counter() - self.start
+        _open_stages.pop()
+        if track_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            self.event["peak_bytes"] = peak - self.start_memory
+            if _open_stages:
+                _open_stages[-1].child_peak = max(_open_stages[-1].child_peak, peak)
+        if exc_type is not None:
+            self.event["error"] = exc_type.__name__
+        emit(self.event)
+        return False
+
+
+class NoStage:
+    def update(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+# Times the code in a with block as one stage. Fields given here or later with update() are part of the event.
+def stage(name, **fields):
+    if not enabled:
+        return NO_STAGE
+    return Stage(name, fields)
+
+
+# Decorator for functions that take and return series: one stage per call, with the number of
+# rows of the sized arguments as rows_in and of the result as rows_out.
+def instrumented(name=None):
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Stage(stage_name, {"rows_in": sum(rows(arg) or 0 for arg in args)}) as current:
+                result = func(*args, **kwargs)
+                current.update(rows_out=rows(result))
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+def rows(value):
+    if isinstance(value, (str, bytes)) or not hasattr(value, "__len__"):
+        return None
+    return len(value)
+
+
+def count(name, **fields):
+    if enabled:
+        emit(dict(fields, event=name))
+
+
+# Sampler statistics of a MultiTrace from pm.sample. draw_seconds is the time spent in the kept draws
+# (pymc3's perf_counter_diff), tuning_seconds the rest of the sampling time: tuning and sampler setup.
+# The split is only meaningful for chains sampled one after the other (cores=1).
+def sampler_stats(kind, trace, **fields):
+    if not enabled:
+        return
+    sampling_seconds = trace.report.t_sampling
+    draws = len(trace) * trace.nchains
+    event = dict(fields, event="sampler", stage=kind, chains=trace.nchains, draws=len(trace), seconds=sampling_seconds,
+                 draws_per_second=draws / sampling_seconds if sampling_seconds else None)
+    # streaming traces (see streaming.py) keep no sampler statistics
+    if "diverging" in trace.stat_names:
+        event["divergences"] = int(trace.get_sampler_stats("diverging").sum())
+    if "perf_counter_diff" in trace.stat_names:
+        event["draw_seconds"] = float(trace.get_sampler_stats("perf_counter_diff").sum())
+        event["tuning_seconds"] = max(sampling_seconds - event["draw_seconds"], 0.0)
+    if "tree_size" in trace.stat_names:
+        event["mean_tree_size"] = float(trace.get_sampler_stats("tree_size").mean())
+    emit(event)
+
+
+def emit(event):
+    if profile is not None:
+        add_to_profile(event)
+    for callback in callbacks:
+        callback(event)
+    if log_events and logger.isEnabledFor(logging.INFO):
+        logger.info(format_event(event), extra={"event": event})
+
+
+def format_event(event):
+    return " ".join(f"{key}={value:.6g}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in event.items())
+
+
+def add_to_profile(event):
+    key = (event["event"], event.get("stage") or ":".join(str(event[k]) for k in ("cache", "kind") if k in event))
+    totals = profile.setdefault(key, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows_in": 0, "rows_out": 0,
+                                      "peak_bytes": 0, "hits": 0, "misses": 0, "divergences": 0})
+    totals["calls"] += 1
+    seconds = event.get("seconds") or 0.0
+    totals["seconds"] += seconds
+    totals["max_seconds"] = max(totals["max_seconds"], seconds)
+    totals["rows_in"] += event.get("rows_in") or 0
+    totals["rows_out"] += event.get("rows_out") or 0
+    totals["peak_bytes"] = max(totals["peak_bytes"], event.get("peak_bytes") or 0)
+    if "hit" in event:
+        totals["hits" if event["hit"] else "misses"] += 1
+    totals["divergences"] += event.get("divergences") or 0
+
+
+# One row per stage of the collected profile, slowest first
+def profile_report():
+    return sorted(({"event": event, "stage": name, **totals} for (event, name), totals in (profile or {}).items()),
+                  key=lambda row: -row["seconds"])
+
+
+def print_profile(file=sys.stderr):
+    report = profile_report()
+    if not report:
+        return
+    columns = list(report[0])
+    print(";".join(columns), file=file)
+    for row in report:
+        print(";".join(f"{row[c]:.4f}" if isinstance(row[c], float) else str(row[c]) for c in columns), file=file)
+
+
+# Logs the events to stderr when the application has not configured logging itself
+def log_to_stderr():
+    if not logger.hasHandlers():
+        logging.basicConfig(format="%(asctime)s %(name)s %(message)s", stream=sys.stderr)
+    logger.setLevel(logging.INFO)
+
+
+# SANDBOX_INSTRUMENT=log logs every event to stderr, SANDBOX_INSTRUMENT=profile prints a profile
+# at exit, with ",memory" added to either to trace allocations.
+if os.environ.get("SANDBOX_INSTRUMENT"):
+    settings = os.environ["SANDBOX_INSTRUMENT"].split(",")
+    enable(memory="memory" in settings, as_profile="profile" in settings)
+    if "profile" in settings:
+        atexit.register(print_profile)
+    else:
+        log_to_stderr()
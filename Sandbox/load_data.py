@@ -1,314 +1,302 @@
-import csv
+import logging
 from pathlib import Path
 
-from Sandbox.MultiValueDataPoint import MultiValueDataPoint
+from Sandbox.GroupedSeries import GroupedSeries
+from Sandbox.RegionCollection import RegionCollection
 from Sandbox.RegionPrices import RegionPrices
+from Sandbox import disk_cache, instrument
+from Sandbox.bulk_csv import read_columns, read_rows
+from Sandbox.TimeSeries import TimeSeries
+from Sandbox.cache import loader_cache
+from Sandbox import resample
+from Sandbox.instrument import instrumented
+from Sandbox.resample import forward_fill
 from .DataPoint import DataPoint
 import datetime
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# the source files are read from here, see benchmark.data_directory for pointing the loaders elsewhere
+DATA_DIR = Path(__file__).parent.parent / "data"
+NATIONAL_MONTHLY_INDEX_FILE = "boligpris index fra 2003.csv"
+NATIONAL_QUARTERLY_INDEX_FILE = "kvartalsvis index.csv"
+REGIONAL_INDEX_FILE = "Boligindeks regionalt.csv"
+INTEREST_RATE_FILE = "renteutvikling fra 2001.csv"
+WAGE_FILE = "lonnsvekst.csv"
+# The columns of every source file the loaders use with their kinds, see bulk_csv.read_columns
+SOURCE_COLUMNS = {
+    NATIONAL_MONTHLY_INDEX_FILE: {0: "date", 1: "decimal"},
+    NATIONAL_QUARTERLY_INDEX_FILE: {0: "quarter", 1: "decimal"},
+    REGIONAL_INDEX_FILE: {0: "text", 1: "quarter", 2: "decimal"},
+    INTEREST_RATE_FILE: {0: "date", 1: "decimal"},
+    WAGE_FILE: {0: "text", 1: "decimal", 3: "decimal"},
+}
+
+# The quarterly index is used before this date, the monthly index from it.
+MONTHLY_INDEX_START = datetime.date(2003, 1, 2)
+# Default end of the national series. max_date=None uses every month the sources cover.
+MAX_DATE = datetime.date(2019, 12, 1)
+INTEREST_MARGIN = 2
+# loan assumed by interest_to_cost
+PAYBACK_YEARS = 30
+DEBT_RATIO = 0.85
+
+
+def load_national_prices(min_year, max_date=MAX_DATE):
+    def load():
+        index_monthly = load_monthly_index()
+        index_quarterly = load_quarterly_index(MONTHLY_INDEX_START)
+        index = transform_index(index_quarterly, index_monthly)
+        index = crop_value(index, min_year, max_date)
+        index = normalize(index)
+
+        # months after the last year of inflation data can not be adjusted yet
+        inflation = load_inflation(min_year, max_date)
+        index = index.crop(index.dates[0], inflation.dates[-1])
+        return adjust_for_inflation(index, inflation)
+
+    files = [NATIONAL_MONTHLY_INDEX_FILE, NATIONAL_QUARTERLY_INDEX_FILE, WAGE_FILE]
+    return load_cached("national_prices", files, (min_year, max_date), load)
 
 
-def load_national_prices(min_year):
-    cutoff_date = datetime.date(2003, 1, 2)
-    index_monthly = load_monthly_index()
-    index_quarterly = load_quarterly_index(cutoff_date)
-    index = transform_index(index_quarterly, index_monthly)
-    index = crop_value(index, min_year)
-    index = normalize(index)
+def load_regional_prices():
+    def load():
+        grouped_prices = GroupedSeries.from_columns(*load_columns(REGIONAL_INDEX_FILE, [0, 1, 2]))
+        regions = get_regions(grouped_prices)
+        quarter_dates, quarterly_prices = get_regional_prices(grouped_prices, regions)
 
-    return adjust_for_inflation(index, load_inflation(min_year))
+        return RegionCollection(transform_regional_prices(regions, quarter_dates, quarterly_prices))
 
+    return load_cached("regional_prices", [REGIONAL_INDEX_FILE, WAGE_FILE], (), load)
 
-def load_regional_prices():
-    regional_prices_flat = load_multi_point_file("Boligindeks regionalt.csv", 0, 1, 2)
-    regions = get_regions(regional_prices_flat)
-    regional_prices = get_regional_prices(regional_prices_flat, regions)
-    transform_regional_prices(regional_prices)
 
-    return regional_prices
+def load_interest_rate(min_year, max_date=MAX_DATE):
+    def load():
+        interest = TimeSeries(*load_columns(INTEREST_RATE_FILE, [0, 1]))
+        interest = transform_interest_rates(interest, min_year)
 
+        return crop_value(interest, min_year, max_date)
 
-def load_interest_rate(min_year):
-    interest = load_file("renteutvikling fra 2001.csv", 0, 1)
-    interest = transform_interest_rates(interest, min_year)
+    return load_cached("interest_rate", [INTEREST_RATE_FILE], (min_year, max_date), load)
 
-    return crop_value(interest, min_year)
 
+def load_wage_growth(min_year, max_date=MAX_DATE):
+    def load():
+        wage = load_file(WAGE_FILE, 0, 1)
+        wage = transform_wage(wage)
+        wage = crop_value(wage, min_year, max_date)
+        wage = normalize(wage)
 
-def load_wage_growth(min_year):
-    wage = load_file("lonnsvekst.csv", 0, 1)
-    wage = transform_wage(wage)
-    wage = crop_value(wage, min_year)
-    wage = normalize(wage)
+        return adjust_for_inflation(wage, load_inflation(min_year, max_date))
 
-    return adjust_for_inflation(wage, load_inflation(min_year))
+    return load_cached("wage_growth", [WAGE_FILE], (min_year, max_date), load)
 
 
-def load_inflation(min_year):
-    inflation = load_file("lonnsvekst.csv", 0, 3)
-    inflation = string_to_dates(inflation)
-    inflation = crop_value(inflation, min_year)
-    inflation = transform_inflation(inflation)
+def load_inflation(min_year, max_date=MAX_DATE):
+    def load():
+        inflation = load_file(WAGE_FILE, 0, 3)
+        inflation = string_to_dates(inflation)
+        inflation = crop_value(inflation, min_year, max_date)
+        inflation = transform_inflation(inflation)
 
-    return normalize(inflation)
+        return normalize(inflation)
+
+    return load_cached("inflation", [WAGE_FILE], (min_year, max_date), load)
 
 
 # total cost of loan as a multiple of price. With 0 net interes rate this will return 1.
-def load_cost_factor_of_purchase(min_year):
-    interest = load_interest_rate(min_year)
+def load_cost_factor_of_purchase(min_year, max_date=MAX_DATE):
+    interest = load_interest_rate(min_year, max_date)
     return calculate_total_loan_cost_factor(interest)
 
 
-def load_file(file_name, first_col_nr, second_col_nr):
-    relative_path_1 = "data/" + file_name
-    mod_path = Path(__file__).parent.parent
-    file_path = (mod_path / relative_path_1).resolve()
-    return load_csv(file_path, first_col_nr, second_col_nr)
-
-
-def load_multi_point_file(file_name, first_col_nr, second_col_nr, third_col_nr):
-    relative_path_1 = "data/" + file_name
-    mod_path = Path(__file__).parent.parent
-    file_path = (mod_path / relative_path_1).resolve()
-    return load_tri_col_csv(file_path, first_col_nr, second_col_nr, third_col_nr)
-
-
-def load_csv(file_path, first_col_nr, second_col_nr):
-    result = []
-    with open(file_path) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=';')
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                print(f'Column names are {", ".join(row)}')
-            elif len(row) > second_col_nr:
-                result.append(DataPoint(row[first_col_nr], float((row[second_col_nr]).replace(",", "."))))
-            else:
-                print("exmpty row:")
-                print(row)
-            line_count += 1
-        print(f'Processed {line_count} lines.')
-    return result
+def data_file_path(file_name):
+    return (DATA_DIR / file_name).resolve()
 
 
-def load_tri_col_csv(file_path, first_col_nr, second_col_nr, third_col_nr):
-    result = []
-    with open(file_path) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=';')
-        line_count = 0
-        for row in csv_reader:
-            if line_count == 0:
-                print(f'Column names are {", ".join(row)}')
-            elif len(row) > second_col_nr:
-                result.append(MultiValueDataPoint(row[first_col_nr], row[second_col_nr],
-                                                  float((row[third_col_nr]).replace(",", "."))))
-            else:
-                print("exmpty row:")
-                print(row)
-            line_count += 1
-        print(f'Processed {line_count} lines.')
-    return result
+def data_file_paths(file_names):
+    return [data_file_path(file_name) for file_name in file_names]
 
 
-def transform_index(first_index, second_index):
-    first_end_value = first_index[-1].value
+# Derived series are looked up in the process cache, then in the on-disk cache when it is enabled,
+# and only built from the source files when both miss.
+def load_cached(kind, file_names, params, load):
+    file_paths = data_file_paths(file_names)
+    with instrument.stage(kind, params=params) as current:
+        result = loader_cache.get_or_load(kind, file_paths, params,
+                                          lambda: disk_cache.get_or_load(kind, file_paths, params, load))
+        current.update(rows_out=len(result))
+    return result
 
-    # transform to get overlapping values
-    second_index = list(map(lambda x: DataPoint(x.date, x.value * first_end_value / 100), second_index))
 
-    # remove data point that overlaps
-    second_index.pop(0)
+# Data points of two columns of a file
+def load_file(file_name, first_col_nr, second_col_nr):
+    dates, values = load_columns(file_name, [first_col_nr, second_col_nr])
+    return [DataPoint(date, value) for date, value in zip(dates.tolist(), values.tolist())]
 
-    return first_index + second_index
 
+# Typed column arrays of a file, of the kinds in SOURCE_COLUMNS. All of them are read in one chunked pass and
+# only the typed arrays are kept, so a file is read once per process while it is unchanged, whichever
+# columns are used.
+def load_columns(file_name, columns):
+    file_path = data_file_path(file_name)
+    kinds = SOURCE_COLUMNS[file_name]
 
-def load_monthly_index():
-    index = load_file("boligpris index fra 2003.csv", 0, 1)
-    return list(map(lambda x: DataPoint(parse_date(x.date), x.value), index))
+    def read():
+        loader_cache.record_file_read(file_path)
+        return dict(zip(kinds, read_columns(file_path, list(kinds), list(kinds.values()))))
 
+    typed_columns = loader_cache.get_or_load("typed_columns", [file_path], (), read)
+    return [typed_columns[column] for column in columns]
 
-def parse_date(date_as_string):
-    return datetime.datetime.strptime(date_as_string, '%d.%m.%Y').date()
 
+# The rows of a file as lists of cells, without the header, for parsers working row by row
+def load_rows(file_name):
+    file_path = data_file_path(file_name)
+    loader_cache.record_file_read(file_path)
+    return list(read_rows(file_path))
 
-def load_quarterly_index(cutoff_date):
-    index_quarterly = load_file("kvartalsvis index.csv", 0, 1)
-    result = quarterly_to_monthly(index_quarterly)
-    result = list(filter(lambda x: x.date < cutoff_date, result))
 
-    return result
+@instrumented()
+def transform_index(first_index, second_index):
+    first_end_value = first_index.values[-1]
 
+    # transform to get overlapping values, and remove data point that overlaps
+    second_index = second_index[1:]
+    second_index = TimeSeries(second_index.dates, second_index.values * first_end_value / 100)
 
-def quarterly_to_monthly(index_quarterly):
-    result = []
-    for i in range(0, len(index_quarterly)):
-        quarter = index_quarterly[i]
-        year = int(quarter.date[0:4])
-        quarter_number = int(quarter.date[5])
-        if i == 0:
-            value_at_start_of_quarter = quarter.value
-            value_at_end_of_quarter = quarter.value
-        else:
-            value_at_start_of_quarter = index_quarterly[i - 1].value
-            value_at_end_of_quarter = quarter.value
-        for month_in_quarter in range(1, 4):
-            month = (quarter_number - 1) * 3 + month_in_quarter
-            date = datetime.date(year, month, 1)
-
-            value_increase_quarter = value_at_end_of_quarter - value_at_start_of_quarter
-            avg = value_increase_quarter / 3
-            value = value_at_start_of_quarter + avg * (month_in_quarter - 1)
-
-            result.append(DataPoint(date, value))
-    last_data_point = result[-1]
-    last_date = last_data_point.date
-    if last_date.month == 12:
-        date = datetime.date(last_date.year + 1, 1, 1)
-        value = index_quarterly[-1].value
-        result.append(DataPoint(date, value))
-    else:
-        date = datetime.date(last_date.year, last_date.month + 1, 1)
-        value = index_quarterly[-1].value
-        result.append(DataPoint(date, value))
-    return result
+    return TimeSeries(np.concatenate([first_index.dates, second_index.dates]),
+                      np.concatenate([first_index.values, second_index.values]))
 
 
-def get_regions(regional_prices):
-    regions = []
-    for region in regional_prices:
-        if region.category not in regions:
-            regions.append(region.category)
-    return regions
+def load_monthly_index():
+    return TimeSeries(*load_columns(NATIONAL_MONTHLY_INDEX_FILE, [0, 1]))
 
 
-def get_regional_prices(flat_prices, regions):
-    sorted_prices = []
-    for region in regions:
-        prices = list(filter(lambda x: x.category == region and x.value != 0, flat_prices))
-        if prices[0].date == "2005K1":
-            start_year = 2005
-        elif prices[0].date == "1992K1":
-            start_year = 1992
-        else:
-            raise ValueError("unexpected start")
+def parse_date(date_as_string):
+    return datetime.datetime.strptime(date_as_string, '%d.%m.%Y').date()
 
-        sorted_prices.append(RegionPrices(region, prices, start_year))
-    return sorted_prices
 
+def load_quarterly_index(cutoff_date):
+    index_quarterly = TimeSeries(*load_columns(NATIONAL_QUARTERLY_INDEX_FILE, [0, 1]))
+    result = quarterly_to_monthly(index_quarterly)
+    result = result.crop(result.dates[0], cutoff_date - datetime.timedelta(days=1))
 
-def transform_regional_prices(regional_prices):
-    for region in regional_prices:
-        region.prices = quarterly_to_monthly(region.prices)
-        region.prices = crop_value(region.prices, region.start_year)
-        region.prices = adjust_for_inflation(region.prices, load_inflation(region.start_year))
-    normalize_regional_prices(regional_prices)
+    return result
 
 
-def normalize_regional_prices(regional_prices):
-    for region in regional_prices:
-        start_value = region.prices[0].value
-        region.prices = list(map(lambda p: DataPoint(p.date, p.value / start_value), region.prices))
+# expects a series dated at the first day of each quarter
+@instrumented()
+def quarterly_to_monthly(index_quarterly):
+    dates, values = resample.quarterly_to_monthly(index_quarterly.dates, index_quarterly.values)
+    return TimeSeries(dates, values)
+
+
+def get_regions(grouped_prices):
+    return grouped_prices.categories()
+
+
+# One row of quarterly prices per region. Missing observations are stored as 0 in the file and become NaN.
+def get_regional_prices(grouped_prices, regions):
+    quarter_dates, prices = grouped_prices.to_matrix(regions)
+    prices[prices == 0] = np.nan
+    return quarter_dates, prices
+
+
+# All regions are resampled to months in one 2-D operation. A region's series starts at its first observed quarter,
+# and regions starting at the same date are adjusted for inflation and normalized together.
+@instrumented()
+def transform_regional_prices(regions, quarter_dates, quarterly_prices):
+    observed = ~np.isnan(quarterly_prices)
+    if not observed.any(axis=1).all():
+        raise ValueError(f"no prices for regions {[r for r, o in zip(regions, observed.any(axis=1)) if not o]}")
+    first_observed = observed.argmax(axis=1)
+    gaps = ~observed & (np.arange(len(quarter_dates)) > first_observed[:, None])
+    if gaps.any():
+        raise ValueError(f"missing quarters after the start of regions {[r for r, g in zip(regions, gaps.any(axis=1)) if g]}")
+
+    month_dates, monthly_prices = resample.quarterly_to_monthly(quarter_dates, quarterly_prices)
+    start_dates = quarter_dates[first_observed]
+
+    regional_prices = [None] * len(regions)
+    for start_date in np.unique(start_dates):
+        rows = np.flatnonzero(start_dates == start_date)
+        start_year = start_date.item().year
+        in_range = (month_dates >= start_date) & (month_dates <= np.datetime64(MAX_DATE))
+        dates = month_dates[in_range]
+
+        inflation = load_inflation(start_year)
+        inflation = inflation.crop(start_date, inflation.dates[-1])
+        prices = monthly_prices[np.ix_(rows, in_range)] / inflation.values[:len(dates)]
+        prices = prices / prices[:, :1]
+
+        for row, region_prices in zip(rows, prices):
+            regional_prices[row] = RegionPrices(regions[row], TimeSeries(dates, region_prices), start_year)
+    return regional_prices
 
 
 def calculate_total_loan_cost_factor(interest_rates):
-    result = []
-    interest_margin = 2
-    for interest in interest_rates:
-        net_interest_rate = interest.value + interest_margin
-        cost = interest_to_cost(net_interest_rate)
-        result.append(DataPoint(interest.date, cost))
-    return result
+    net_interest_rate = interest_rates.values + INTEREST_MARGIN
+    return TimeSeries(interest_rates.dates, interest_to_cost(net_interest_rate))
 
 
-def calculate_marginal_cost_increase():
-    marginal_cost_increase = []
-    for i in range(16):
-        r1 = i
-        r2 = (i + 1)
-        c1 = interest_to_cost(r1)
-        c2 = interest_to_cost(r2)
-        relative_cost_increase = c2 / c1
-        cost_increase_percent = (relative_cost_increase - 1) * 100
-        marginal_cost_increase.append(cost_increase_percent)
-    return marginal_cost_increase
+# percent increase of the cost factor when the interest rate goes from r to r + 1, for r = 0, ..., 15
+def calculate_marginal_cost_increase(interest_rates=None, cost_function=None):
+    interest_rates = np.arange(16) if interest_rates is None else np.asarray(interest_rates)
+    cost_function = cost_function or interest_to_cost
+    relative_cost_increase = cost_function(interest_rates + 1) / cost_function(interest_rates)
+    return ((relative_cost_increase - 1) * 100).tolist()
 
 
 def interest_to_cost(interest):
     # Created from quadratic regression of values from sbanken loan calculator
-    # Uses 30 year payback, 0.85 debt ratio
+    # Uses 30 year payback, 0.85 debt ratio. scenarios.annuity_cost is the exact cost for any loan.
     return 1.01307 + 0.112859 * interest + 0.00696783 * interest * interest
 
 
-# day -> month
-def transform_interest_rates(interest_rates, min_year):
-    for rate in interest_rates:
-        rate.date = parse_date(rate.date)
-    result = []
-    for year in range(min_year, 2020):
-        for month in range(1, 13):
-            date = datetime.date(year, month, 1)
-            result.append(DataPoint(date, find_interest_rate_for_day(date, interest_rates)))
-    return result
-
-
-def find_interest_rate_for_day(day, interest_rates):
-    before_date = list(filter(lambda x: x.date <= day, interest_rates))
-    before_date.sort(key=lambda r: r.date)
-    return before_date[len(before_date) - 1].value
+# day -> month (or any other frequency supported by resample.date_grid).
+# The grid runs from January of min_year to the latest announcement unless end is given.
+# interest_rates is a TimeSeries or a list of data points with dd.mm.yyyy dates.
+@instrumented()
+def transform_interest_rates(interest_rates, min_year, end=None, frequency='M'):
+    if not isinstance(interest_rates, TimeSeries):
+        interest_rates = TimeSeries([parse_date(r.date) for r in interest_rates], [r.value for r in interest_rates])
+    return forward_fill(interest_rates, datetime.date(min_year, 1, 1), end, frequency)
 
 
 # yearly -> monthly
+# start on year 1991 as value is denoted at end of year
+@instrumented()
 def transform_wage(wage):
-    result = []
-    for i in range(1, len(wage)):
-        # start on year 1991 as value is denoted at end of year
-        year = wage[i].date
-        year_end = wage[i].value
-        year_start = wage[i - 1].value
-        increase_in_year = year_end - year_start
-        avg_montly_increase = increase_in_year / 12
-        for month in range(1, 13):
-            # subtract 1 from month as date is at start
-            value_for_month = year_start + avg_montly_increase * (month - 1)
-            date = datetime.date(int(year), month, 1)
-            result.append(DataPoint(date, value_for_month))
-    return result
+    years = [int(w.date) for w in wage]
+    dates, values = resample.yearly_to_monthly(years, [w.value for w in wage])
+    return TimeSeries(dates, values)
 
 
 # yearly -> monthly
 # TODO vurder å del på 100 på alle verdiene
+@instrumented()
 def transform_inflation(inflation):
-    result = []
-    index_current = 100
-    for inflation_for_year in inflation[0:]:
-        year_start = index_current
-        year_end = index_current * ((100 + inflation_for_year.value) / 100)
-        index_current = year_end
-        avg_monthly_change = (year_end - year_start) / 12
-        for month in range(1, 13):
-            date = datetime.date(inflation_for_year.date.year, month, 1)
-            value = (year_start + avg_monthly_change * (month - 1))
-            result.append(DataPoint(date, value))
-    return result
+    years = inflation.dates.astype('datetime64[Y]').astype(int) + 1970
+    dates, values = resample.compound_yearly_to_monthly(years, inflation.values)
+    return TimeSeries(dates, values)
 
 
 def string_to_dates(data_points):
-    return list(map(lambda x: DataPoint(datetime.date(int(x.date), 1, 1), x.value), data_points))
+    return TimeSeries([datetime.date(int(x.date), 1, 1) for x in data_points], [x.value for x in data_points])
 
 
-def crop_value(data, min_year):
-    max_date = datetime.date(2019, 12, 1)
+def crop_value(data, min_year, max_date=MAX_DATE):
     min_date = datetime.date(min_year, 1, 1)
-    return list(filter(lambda p: max_date >= p.date >= min_date, data))
+    if max_date is None:
+        max_date = data.dates.max()
+    return data.crop(min_date, max_date)
 
 
 def normalize(data):
-    first_element_value = data[0].value
-    return list(map(lambda p: DataPoint(p.date, p.value / first_element_value), data))
+    return data.normalize()
 
 
 def adjust_for_inflation(data, inflation):
-    result = []
-    for i in range(0, len(data)):
-        value = data[i].value / inflation[i].value
-        result.append(DataPoint(data[i].date, value))
-    return result
+    return data.divide(inflation)
@@ -1,8 +1,6 @@
-import matplotlib.pyplot as plt
-
-from Sandbox.DataPoint import DataPoint
 from Sandbox.load_data import load_interest_rate, load_national_prices, load_wage_growth, load_cost_factor_of_purchase, \
     load_regional_prices, calculate_marginal_cost_increase, interest_to_cost
+from Sandbox.figures import show_or_save
 from Sandbox.run_model import run_model, run_breakpoint_model, run_price_trend_model, run_wage_correlation_model
 
 
@@ -18,28 +16,24 @@ from Sandbox.run_model import run_model, run_breakpoint_model, run_price_trend_m
 
 
 def calculate_total_price(prices, cost_factors):
-    result = []
-    for i in range(0, len(prices)):
-        result.append(DataPoint(prices[i].date, prices[i].value * cost_factors[i].value))
-    return result
+    return prices.multiply(cost_factors)
 
 
 def calculate_total_price_adjusted_for_wage_growth(costs, wages):
-    result = []
-    for i in range(0, len(costs)):
-        result.append(DataPoint(costs[i].date, costs[i].value / wages[i].value))
-    return result
+    return costs.divide(wages)
 
 
 def dates(timeseries):
-    return list(map(lambda x: x.date, timeseries))
+    return timeseries.dates
 
 
 def values(timeseries):
-    return list(map(lambda x: x.value, timeseries))
+    return timeseries.values
+
 
+def display_stats(price_index, min_year, output=None):
+    import matplotlib.pyplot as plt
 
-def display_stats(price_index, min_year):
     interest_rates = load_interest_rate(min_year)
     wage_growth = load_wage_growth(min_year)
     cost_factor = load_cost_factor_of_purchase(min_year)
@@ -57,10 +51,12 @@ def display_stats(price_index, min_year):
     plt.ylabel('Verdi')
     plt.title('P, r, L, P_f og K')
     plt.legend()
-    plt.show()
+    show_or_save(output)
 
 
-def plot_wages_to_prices(price_index, wage_growth):
+def plot_wages_to_prices(price_index, wage_growth, output=None):
+    import matplotlib.pyplot as plt
+
     # Observed
     y = values(price_index)
     x = values(wage_growth)
@@ -73,10 +69,12 @@ def plot_wages_to_prices(price_index, wage_growth):
     plt.xlabel('Lønnsnivå')
     plt.ylabel('Boligpris')
     plt.legend()
-    plt.show()
+    show_or_save(output)
+
 
+def plot_price_growth(price_index, output=None):
+    import matplotlib.pyplot as plt
 
-def plot_price_growth(price_index):
     # Observed
     plt.plot(dates(price_index), values(price_index), label="Prisindeks")
 
@@ -88,51 +86,53 @@ def plot_price_growth(price_index):
     plt.xlabel('Tid')
     plt.ylabel('Boligpris')
     plt.legend()
-    plt.show()
+    show_or_save(output)
 
 
-def plot_changepoint_analysis(absolute_prices):
-    start_value = absolute_prices[0].value
-
-    # Observed
-    plt.plot(dates(absolute_prices), values(absolute_prices), label="Prisindeks")
-
+def plot_changepoint_analysis(absolute_prices, output=None):
+    import matplotlib.pyplot as plt
+    from Sandbox.segmentation import detect_changepoints, segment_means
 
-    # Estimated
-    estimated_changepoint_index = 100
-    estimated_changepoint = absolute_prices[estimated_changepoint_index]
-    change_date = estimated_changepoint.date
-    change_date_value = estimated_changepoint.value
-    plt.scatter(change_date, change_date_value, label="Knekkpunkt", c="green", s=70)
+    price_dates = dates(absolute_prices)
+    prices = values(absolute_prices)
 
-    #
-    scale = 0.1
-    a1 = 0.082 * scale
-    a2 = -0.054 * scale
+    # Observed
+    plt.plot(price_dates, prices, label="Prisindeks")
 
-    p_top = 1 + a1 * estimated_changepoint_index
-    p_end = change_date_value + a2 * (len(absolute_prices) - estimated_changepoint_index)
+    # Estimated. A changepoint k of the relative prices is a knee of the price curve at month k + 1,
+    # and every segment is drawn as a line with the mean change of the segment as slope.
+    relative_prices = values(absolute_to_relative_prices(absolute_prices))
+    changepoints = detect_changepoints(relative_prices)[0]
+    slopes = segment_means(relative_prices, changepoints)
+    knees = list(changepoints + 1)
+    plt.scatter(price_dates[knees], prices[knees], label="Knekkpunkt", c="green", s=70)
 
-    plt.plot([dates(absolute_prices)[0], dates(absolute_prices)[estimated_changepoint_index]], [start_value, p_top], label="Tidlig trend", c="red")
-    plt.plot([dates(absolute_prices)[estimated_changepoint_index], dates(absolute_prices)[-1]], [change_date_value, p_end], label="Sen trend", c="red")
+    bounds = [0] + knees + [len(prices) - 1]
+    for segment, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        plt.plot([price_dates[start], price_dates[end]], [prices[start], prices[start] + slopes[segment] * (end - start)],
+                 label="Trend" if segment == 0 else None, c="red")
 
     plt.xlabel('Tid')
     plt.ylabel('Boligpris')
     plt.legend()
-    plt.show()
+    show_or_save(output)
 
 
-def plot_marginal_cost_increase(marginal_cost_increase):
+def plot_marginal_cost_increase(marginal_cost_increase, output=None):
+    import matplotlib.pyplot as plt
+
     plt.plot(range(16), marginal_cost_increase)
 
     plt.xlabel('rente')
     plt.ylabel('Prisendring ved 1% renteøkning')
     plt.title('Marginal kostnadsendsøkning ved rentestigning')
     plt.legend()
-    plt.show()
+    show_or_save(output)
+
 
+def plot_interest_to_cost(output=None):
+    import matplotlib.pyplot as plt
 
-def plot_interest_to_cost():
     costs = []
     for r in range(16):
         cost = interest_to_cost(r)
@@ -151,25 +151,21 @@ def plot_interest_to_cost():
     plt.title('Totalkostnad av boligkjøp')
     plt.legend()
     plt.axis([0, 15, 0, 3])
-    plt.show()
+    show_or_save(output)
 
 
 def get_region(regions_prices, region):
-    return (next((x for x in regions_prices if x.region == region), None)).prices
+    return regions_prices[region].prices
 
 
 def absolute_to_relative_prices(prices):
-    relative_prices = []
-    for i in range(1, len(prices)):
-        relative_prices.append(DataPoint(prices[i-1].date, prices[i].value - prices[i-1].value))
-    return relative_prices
+    return prices.diff()
 
 
 def monthly_to_quarterly(values_list):
     return values_list[0::3]
 
 
-
 regions = [
     # 1992
     'Hele landet',
@@ -188,22 +184,27 @@ regions = [
 ]
 
 
-national_price_index = load_national_prices(1992)
-display_stats(national_price_index, 1992)
-#plot_marginal_cost_increase(calculate_marginal_cost_increase())
-#plot_interest_to_cost()
+def main():
+    national_price_index = load_national_prices(1992)
+    display_stats(national_price_index, 1992)
+    # plot_marginal_cost_increase(calculate_marginal_cost_increase())
+    # plot_interest_to_cost()
+
+    # run_price_trend_model(national_price_index)
+    # run_wage_correlation_model(monthly_to_quarterly(national_price_index), monthly_to_quarterly(load_wage_growth(1992)))
+
+    regional_prices = load_regional_prices()
+    # display_stats(get_region(regional_prices, "Stavanger"), 2005)
+    # stavanger_absolute_prices = get_region(regional_prices, "Stavanger")
+    # stavanger_relative_prices = absolute_to_relative_prices(stavanger_absolute_prices)
+    # run_breakpoint_model(stavanger_relative_prices)
 
-# run_price_trend_model(national_price_index)
-# run_wage_correlation_model(monthly_to_quarterly(national_price_index), monthly_to_quarterly(load_wage_growth(1992)))
 
-regional_prices = load_regional_prices()
-# display_stats(get_region(regional_prices, "Stavanger"), 2005)
-# stavanger_absolute_prices = get_region(regional_prices, "Stavanger")
-# stavanger_relative_prices = absolute_to_relative_prices(stavanger_absolute_prices)
-# run_breakpoint_model(stavanger_relative_prices)
 
+    # plot_wages_to_prices(national_price_index, load_wage_growth(1992))
+    # plot_price_growth(national_price_index)
+    # plot_changepoint_analysis(stavanger_absolute_prices)
 
 
-# plot_wages_to_prices(national_price_index, load_wage_growth(1992))
-# plot_price_growth(national_price_index)
-# plot_changepoint_analysis(stavanger_absolute_prices)
+if __name__ == "__main__":
+    main()
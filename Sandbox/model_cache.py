@@ -0,0 +1,95 @@
+import time
+
+from Sandbox import instrument
+from Sandbox.run_model import MODEL_BUILDERS
+
+
+# A built model. Its logp graph reads the observations from the model's pm.Data containers, so it is reused
+# for new data. Every fit creates its own step or variational objective: pm.sample initializes the step
+# (jitter+adapt_diag) from the seed and the start, pm.fit its approximation, and theano takes the compiled
+# functions from its cache, so a fit does not depend on the fits before it.
+class CompiledModel:
+    def __init__(self, kind, model, compile_seconds):
+        self.kind = kind
+        self.model = model
+        self.compile_seconds = compile_seconds
+        self.sampling_seconds = 0.0
+        self.fits = 0
+
+
+# Built models keyed by model kind and the shapes of their data, see run_model.MODEL_BUILDERS, for sampling
+# and variational fits alike.
+# Fitting another region or window of the same length only swaps the data and fits again, so everything
+# a builder takes from data that can differ between series of one length has to be a pm.Data container. The
+# marginalized breakpoint model compiles in only the candidates and counts, its prior is swapped with the sums.
+# Scalar data, like the changepoint location of the breakpoint model, is part of the key by value: it can set
+# the initial value of a variable, which the built model keeps.
+# With match_shape=False only the number of dimensions is part of the key, so series of any length share
+# one built model. That is only valid for models without length dependent constants, which rules out
+# the marginalized breakpoint model.
+class ModelCache:
+    def __init__(self, match_shape=True):
+        self.match_shape = match_shape
+        self.models = {}
+
+    def key(self, kind, data):
+        shapes = []
+        for name, value in data.items():
+            shape = tuple(getattr(value, "shape", ()))
+            if not shape:
+                shapes.append((name, float(value)))
+            else:
+                shapes.append((name, shape if self.match_shape else len(shape)))
+        return kind, tuple(sorted(shapes))
+
+    def get(self, kind, data):
+        key = self.key(kind, data)
+        if key not in self.models:
+            start = time.perf_counter()
+            with instrument.stage("compile", kind=kind):
+                model = MODEL_BUILDERS[kind](data)
+            self.models[key] = CompiledModel(kind, model, time.perf_counter() - start)
+        return self.models[key]
+
+    # backend(model) may give the trace backend to record the draws in, see run_model.stream_model.
+    # A step passed in sample_kwargs is used as given, see rolling.fit_window.
+    def sample(self, kind, data, backend=None, **sample_kwargs):
+        import pymc3 as pm
+
+        compiled = self.get(kind, data)
+        start = time.perf_counter()
+        with compiled.model:
+            pm.set_data({name: value for name, value in data.items() if name in compiled.model.named_vars})
+            trace = pm.sample(return_inferencedata=False, trace=backend and backend(compiled.model), **sample_kwargs)
+        compiled.sampling_seconds += time.perf_counter() - start
+        compiled.fits += 1
+        instrument.sampler_stats(kind, trace, cached=True)
+        return compiled.model, trace
+
+    # Fits a variational approximation (see run_model.fit_approximation) to the built model with the new data.
+    # Returns the model and the MultiTrace of draws.
+    def approximate(self, kind, data, method, **fit_kwargs):
+        import pymc3 as pm
+        from Sandbox.run_model import fit_approximation
+
+        compiled = self.get(kind, data)
+        start = time.perf_counter()
+        with compiled.model:
+            pm.set_data({name: value for name, value in data.items() if name in compiled.model.named_vars})
+        model, trace = fit_approximation(kind, compiled.model, method, **fit_kwargs)
+        compiled.sampling_seconds += time.perf_counter() - start
+        compiled.fits += 1
+        return model, trace
+
+    # one row per compiled model: how long it took to compile and how much sampling it has been reused for
+    def report(self):
+        return [{
+            "kind": compiled.kind,
+            "shape": dict(key[1]),
+            "compile_seconds": compiled.compile_seconds,
+            "fits": compiled.fits,
+            "sampling_seconds": compiled.sampling_seconds,
+        } for key, compiled in self.models.items()]
+
+
+default_model_cache = ModelCache()
@@ -0,0 +1,269 @@
+import numpy as np
+
+from Sandbox.load_data import INTEREST_MARGIN, PAYBACK_YEARS, DEBT_RATIO, MAX_DATE, load_interest_rate, \
+    load_national_prices, load_wage_growth
+from Sandbox.run_model import BREAKPOINT_SCALING_FACTOR, PRICE_TREND_INTERCEPT, PRICE_TREND_PRIORS, \
+    WAGE_CORRELATION_PRIORS
+from Sandbox.scenarios import SweepInputs, cost_function
+
+PRICE_MODELS = ["trend", "wage_correlation", "breakpoint"]
+# months projected after the last observation
+HORIZON_MONTHS = 120
+# memory used by the arrays of one chunk of simulated paths
+MEMORY_CAP_BYTES = 512 * 2 ** 20
+# paths drawn from one random generator. Chunks are whole blocks, so the results do not depend on the chunk size.
+PATH_BLOCK = 4096
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# bins of the histograms the quantiles are read from, per region and month
+HISTOGRAM_BINS = 1000
+MEASURES = ["total_cost", "total_cost_to_wage"]
+
+
+# The last observed price index P of every region, wage level L and interest rate r, where the projected paths
+# start, and the monthly changes of the random walks of the wages (of log L) and of the interest rate,
+# estimated from the history. Prices and wages are normalized like in SweepInputs.
+class ProjectionInputs:
+    def __init__(self, regions, prices, wages, interest_rate, wage_drift, wage_volatility, interest_volatility):
+        self.regions = list(regions)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.wages = np.asarray(wages, dtype=np.float64)
+        self.interest_rate = float(interest_rate)
+        self.wage_drift = float(wage_drift)
+        self.wage_volatility = float(wage_volatility)
+        self.interest_volatility = float(interest_volatility)
+
+    # The national index the trend and wage correlation models are fitted on
+    @classmethod
+    def national(cls, min_year=1992, max_date=MAX_DATE):
+        prices = load_national_prices(min_year, max_date)
+        wages = load_wage_growth(min_year, max_date)
+        interest = load_interest_rate(min_year, max_date)
+        return cls.from_history(["national"], prices.values[None], wages.values[None], interest.values)
+
+    @classmethod
+    def from_regions(cls, regions=None, max_date=MAX_DATE):
+        inputs = SweepInputs.from_regions(regions, max_date)
+        return cls.from_history(inputs.regions, inputs.prices, inputs.wages, inputs.interest_rates)
+
+    # prices and wages (regions, months) and interest_rates (months), NaN where there is no observation
+    @classmethod
+    def from_history(cls, regions, prices, wages, interest_rates):
+        wage_changes = np.diff(np.log(wages), axis=-1)
+        wage_changes = wage_changes[~np.isnan(wage_changes)]
+        interest_changes = np.diff(interest_rates)
+        return cls(regions, last_observed(prices), last_observed(wages), last_observed(interest_rates),
+                   wage_changes.mean(), wage_changes.std(), np.nanstd(interest_changes))
+
+
+def last_observed(values):
+    values = np.asarray(values, dtype=np.float64)
+    observed = ~np.isnan(values)
+    last = values.shape[-1] - 1 - np.argmax(observed[..., ::-1], axis=-1)
+    return np.take_along_axis(values, np.expand_dims(last, -1), -1)[..., 0]
+
+
+# Simulates paths of the price index, wage level and interest rate over the horizon and summarizes the total
+# cost K = P * c(r + margin) and K / L of every region and month, see project_chunk.
+# draws are posterior draws of the price model, one row per draw:
+#   "trend": {"beta": (draws,)}, the monthly slope of the national index (run_price_trend_model)
+#   "wage_correlation": {"beta": (draws,)}, the price change per unit of wage level (run_wage_correlation_model)
+#   "breakpoint": {"late_trend": (draws, regions)}, the monthly change after the changepoint (run_breakpoint_model)
+# The national models move every region by the same amount. Every path takes a random posterior draw.
+# The paths are simulated in chunks that keep the arrays of a process within memory_bytes, and summarized by
+# their mean, sd and the quantiles, which are read from a histogram per region and month. With processes > 1
+# the chunks after the first are simulated in a pool of processes.
+# Returns a dict with "months" (1..horizon), "regions", and for each of MEASURES the arrays "mean", "sd"
+# (regions, months) and "quantiles" (quantiles, regions, months).
+def project(inputs, model, draws, paths=100_000, horizon=HORIZON_MONTHS, margin=INTEREST_MARGIN,
+            payback_years=PAYBACK_YEARS, debt_ratio=DEBT_RATIO, cost="regression", seed=8927,
+            memory_bytes=MEMORY_CAP_BYTES, quantiles=QUANTILES, processes=1):
+    if model not in PRICE_MODELS:
+        raise ValueError(f"unknown price model {model}, expected one of {PRICE_MODELS}")
+    draws = {name: np.asarray(values, dtype=np.float64) for name, values in draws.items()}
+    # float64 arrays of one path: the wage and interest walks and the cost factor, and per region the wages,
+    # prices, the two measures and their bin indices
+    path_bytes = 8 * horizon * (4 + 7 * len(inputs.regions))
+    chunk_blocks = max(1, memory_bytes // (path_bytes * PATH_BLOCK))
+    blocks = -(-paths // PATH_BLOCK)
+    chunks = [range(first, min(first + chunk_blocks, blocks)) for first in range(0, blocks, chunk_blocks)]
+    settings = (inputs, model, draws, paths, horizon, margin, payback_years, debt_ratio, cost, seed)
+
+    # the first chunk sets the histogram bins of every region and month
+    summaries = summarize_chunk(settings, chunks[0])
+    bounds = {name: summary.bounds() for name, summary in summaries.items()}
+    if processes > 1 and len(chunks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(summarize_chunk, [settings] * (len(chunks) - 1), chunks[1:],
+                                  [bounds] * (len(chunks) - 1)))
+    else:
+        parts = [summarize_chunk(settings, chunk, bounds) for chunk in chunks[1:]]
+    for part in parts:
+        for name, summary in part.items():
+            summaries[name].merge(summary)
+
+    result = {"months": np.arange(1, horizon + 1), "regions": inputs.regions}
+    for name, summary in summaries.items():
+        result[name] = {"mean": summary.mean(), "sd": summary.sd(), "quantiles": summary.quantiles(quantiles)}
+    return result
+
+
+# PathSummary of every measure for the paths of the blocks in block_range, in the bins of bounds when given
+def summarize_chunk(settings, block_range, bounds=None):
+    inputs, model, draws, paths, horizon, margin, payback_years, debt_ratio, cost, seed = settings
+    chunk_paths = min(paths, block_range.stop * PATH_BLOCK) - block_range.start * PATH_BLOCK
+    results = project_chunk(inputs, model, draws, block_range, chunk_paths, horizon, margin, payback_years,
+                            debt_ratio, cost, seed)
+    summaries = {}
+    for name, values in results.items():
+        summaries[name] = PathSummary(*bounds[name]) if bounds else PathSummary.spanning(values)
+        summaries[name].add(values)
+    return summaries
+
+
+# K and K / L of one chunk of paths, shape (paths, regions, months), as broadcast array operations.
+# The log wage level is a random walk with the historical drift and volatility, and the interest rate
+# a random walk without drift, floored at 0.
+def project_chunk(inputs, model, draws, block_range, paths, horizon, margin, payback_years, debt_ratio, cost, seed):
+    months = np.arange(1, horizon + 1)
+    draw_count = len(next(iter(draws.values())))
+    choices, wage_steps, interest_steps = [], [], []
+    for block in block_range:
+        rng = np.random.default_rng([seed, block])
+        choices.append(rng.integers(draw_count, size=PATH_BLOCK))
+        wage_steps.append(rng.normal(inputs.wage_drift, inputs.wage_volatility, size=(PATH_BLOCK, horizon)))
+        interest_steps.append(rng.normal(0, inputs.interest_volatility, size=(PATH_BLOCK, horizon)))
+    choice = np.concatenate(choices)[:paths]
+
+    wage_growth = np.exp(np.cumsum(np.concatenate(wage_steps)[:paths], axis=1))
+    interest = np.maximum(inputs.interest_rate + np.cumsum(np.concatenate(interest_steps)[:paths], axis=1), 0)
+    cost_factor = cost_function(cost)(interest + margin, payback_years, debt_ratio)
+
+    wages = inputs.wages[:, None] * wage_growth[:, None, :]
+    start = inputs.prices[:, None]
+    if model == "trend":
+        prices = start + draws["beta"][choice, None, None] * months
+    elif model == "wage_correlation":
+        prices = start + draws["beta"][choice, None, None] * (wages - inputs.wages[:, None])
+    else:
+        prices = start + draws["late_trend"][choice, :, None] / BREAKPOINT_SCALING_FACTOR * months
+    total_cost = prices * cost_factor[:, None, :]
+    return {"total_cost": total_cost, "total_cost_to_wage": total_cost / wages}
+
+
+# Running sums and a histogram per region and month of simulated values (paths, regions, months),
+# with bins of width from low on. Values outside the bins are counted in the outer bins.
+# The sums are taken around the middle of the bins, so the sd of values far from 0 keeps its precision.
+class PathSummary:
+    def __init__(self, low, width, bins=HISTOGRAM_BINS):
+        self.low = low
+        self.width = width
+        self.bins = bins
+        self.center = low + width * bins / 2
+        self.counts = np.zeros(low.shape + (bins,), dtype=np.int64)
+        self.count = 0
+        self.total = np.zeros(low.shape)
+        self.total_sq = np.zeros(low.shape)
+
+    # bins spanning three times the range of values
+    @classmethod
+    def spanning(cls, values, bins=HISTOGRAM_BINS):
+        low, high = values.min(axis=0), values.max(axis=0)
+        span = np.maximum(high - low, 1e-9)
+        return cls(low - span, 3 * span / bins, bins)
+
+    def bounds(self):
+        return self.low, self.width, self.bins
+
+    def add(self, values):
+        self.count += len(values)
+        centered = values - self.center
+        self.total += centered.sum(axis=0)
+        self.total_sq += (centered * centered).sum(axis=0)
+        bin_index = np.clip(((values - self.low) / self.width).astype(np.int64), 0, self.bins - 1)
+        cells = np.arange(self.total.size).reshape(self.total.shape) * self.bins
+        self.counts += np.bincount((bin_index + cells).ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.counts += other.counts
+
+    def mean(self):
+        return self.center + self.total / self.count
+
+    def sd(self):
+        centered_mean = self.total / self.count
+        variance = self.total_sq / self.count - centered_mean ** 2
+        return np.sqrt(np.maximum(variance, 0) * self.count / (self.count - 1))
+
+    # linear within the bin holding the quantile
+    def quantiles(self, quantiles=QUANTILES):
+        cumulative = np.cumsum(self.counts, axis=-1)
+        result = []
+        for q in quantiles:
+            target = q * self.count
+            position = np.argmax(cumulative >= target, axis=-1)[..., None]
+            above = np.take_along_axis(cumulative, position, -1)[..., 0]
+            in_bin = np.take_along_axis(self.counts, position, -1)[..., 0]
+            fraction = 1 - (above - target) / np.maximum(in_bin, 1)
+            result.append(self.low + (position[..., 0] + fraction) * self.width)
+        return np.stack(result)
+
+
+# One row per region, month and measure with the mean, sd and quantiles
+def projection_table(result, quantiles=QUANTILES):
+    import pandas as pd
+
+    rows = []
+    for measure in MEASURES:
+        summary = result[measure]
+        for r, region in enumerate(result["regions"]):
+            for m, month in enumerate(result["months"]):
+                rows.append([region, int(month), measure, summary["mean"][r, m], summary["sd"][r, m]]
+                            + [summary["quantiles"][q, r, m] for q in range(len(quantiles))])
+    return pd.DataFrame(rows, columns=["region", "month", "measure", "mean", "sd"]
+                        + [f"q{100 * q:g}" for q in quantiles])
+
+
+# Draws of the exact posterior of the trend or wage correlation model (see conjugate.py) on the national index,
+# for projections without a sampled trace
+def analytic_draws(model, draws=4000, min_year=1992, seed=8927):
+    from Sandbox.conjugate import linear_regression_posterior, prior_arrays, price_trend_design, \
+        wage_correlation_design
+    from Sandbox.main import monthly_to_quarterly
+
+    prices = load_national_prices(min_year)
+    if model == "trend":
+        mean, covariance = linear_regression_posterior(price_trend_design(len(prices)), prices.values,
+                                                       *prior_arrays(PRICE_TREND_PRIORS), offset=PRICE_TREND_INTERCEPT)
+        names = list(PRICE_TREND_PRIORS)
+    elif model == "wage_correlation":
+        quarterly_prices = monthly_to_quarterly(prices)
+        quarterly_wages = monthly_to_quarterly(load_wage_growth(min_year))
+        mean, covariance = linear_regression_posterior(wage_correlation_design(quarterly_wages.values),
+                                                       quarterly_prices.values, *prior_arrays(WAGE_CORRELATION_PRIORS))
+        names = list(WAGE_CORRELATION_PRIORS)
+    else:
+        raise ValueError(f"the {model} model has no closed form posterior")
+    values = np.random.default_rng(seed).multivariate_normal(mean, covariance, size=draws)
+    return dict(zip(names, values.T))
+
+
+# Posterior draws of a variable from runs in a trace store, chains and draws flattened. With several runs,
+# one per region like from breakpoint-batch, the result has a region column per run, cut to the shortest run.
+def stored_draws(store, run_ids, var_name):
+    from Sandbox.trace_store import TraceStore
+
+    if not isinstance(store, TraceStore):
+        store = TraceStore(store)
+    columns = []
+    for run_id in run_ids:
+        values = store.open_group(run_id, var_names=[var_name])[var_name].values
+        columns.append(values.reshape((-1,) + values.shape[2:]))
+    if len(columns) == 1:
+        return columns[0]
+    length = min(len(column) for column in columns)
+    return np.stack([column[:length] for column in columns], axis=1)
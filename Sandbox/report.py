@@ -0,0 +1,222 @@
+import hashlib
+import inspect
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from Sandbox.TimeSeries import TimeSeries
+
+# results/ holds the committed figures. The report renders into the untracked REPORT_DIR unless it is asked
+# to replace them.
+RESULTS_DIR = Path(__file__).parent.parent / "results"
+REPORT_DIR = RESULTS_DIR / "report"
+# output path -> input hash of the figures in a results directory
+MANIFEST_FILE = "report_hashes.json"
+REPORT_SEED = 8927
+REPORT_DRAWS = 1000
+# a change to these modules can change any figure, so their source is part of every input hash
+PLOTTING_MODULES = ["Sandbox.figures", "Sandbox.main", "Sandbox.run_model"]
+
+
+# One or more figures rendered by render(inputs, outputs). outputs are paths relative to the results directory.
+# inputs holds everything the figures are made from, and is hashed to decide whether they need rendering again.
+class ReportJob:
+    def __init__(self, name, outputs, render, inputs):
+        self.name = name
+        self.outputs = outputs
+        self.render = render
+        self.inputs = inputs
+
+    def input_hash(self):
+        import importlib
+
+        digest = hashlib.sha256(self.name.encode())
+        digest.update(inspect.getsource(self.render).encode())
+        for module in PLOTTING_MODULES:
+            digest.update(inspect.getsource(importlib.import_module(module)).encode())
+        update_hash(digest, self.inputs)
+        return digest.hexdigest()
+
+
+def update_hash(digest, value):
+    if isinstance(value, TimeSeries):
+        update_hash(digest, [value.dates, value.values])
+    elif isinstance(value, np.ndarray):
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(repr(key).encode())
+            update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            update_hash(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def render_stats(inputs, outputs):
+    from Sandbox.main import display_stats
+    display_stats(inputs["prices"], inputs["min_year"], output=outputs[0])
+
+
+def render_price_growth(inputs, outputs):
+    from Sandbox.main import plot_price_growth
+    plot_price_growth(inputs["prices"], output=outputs[0])
+
+
+def render_wages_to_prices(inputs, outputs):
+    from Sandbox.main import plot_wages_to_prices
+    plot_wages_to_prices(inputs["prices"], inputs["wages"], output=outputs[0])
+
+
+def render_changepoint_analysis(inputs, outputs):
+    from Sandbox.main import plot_changepoint_analysis
+    plot_changepoint_analysis(inputs["prices"], output=outputs[0])
+
+
+def render_marginal_cost_increase(inputs, outputs):
+    from Sandbox.main import plot_marginal_cost_increase
+    plot_marginal_cost_increase(inputs["marginal_cost_increase"], output=outputs[0])
+
+
+def render_interest_to_cost(inputs, outputs):
+    from Sandbox.main import plot_interest_to_cost
+    plot_interest_to_cost(output=outputs[0])
+
+
+def render_price_trend_estimation(inputs, outputs):
+    from Sandbox.figures import plot_summary_table
+    from Sandbox.run_model import run_price_trend_model
+
+    summary = run_price_trend_model(inputs["prices"], draws=inputs["draws"], show=False,
+                                    random_seed=inputs["random_seed"], plot_output=outputs[0])
+    plot_summary_table(summary, "Pristrend", output=outputs[1])
+
+
+def render_wage_correlation_estimation(inputs, outputs):
+    from Sandbox.figures import plot_summary_table
+    from Sandbox.run_model import run_wage_correlation_model
+
+    summary = run_wage_correlation_model(inputs["prices"], inputs["wages"], draws=inputs["draws"], show=False,
+                                         random_seed=inputs["random_seed"], plot_output=outputs[0])
+    plot_summary_table(summary, "Boligpris mot lønn", output=outputs[1])
+
+
+def render_breakpoint_estimation(inputs, outputs):
+    from Sandbox.figures import plot_summary_table
+    from Sandbox.run_model import run_breakpoint_model
+
+    summary = run_breakpoint_model(inputs["relative_prices"], draws=inputs["draws"], tune=inputs["draws"], chains=2,
+                                   random_seed=inputs["random_seed"], show=False, plot_output=outputs[0])
+    plot_summary_table(summary, "Knekkpunkt", output=outputs[1])
+
+
+# Every figure of the report with its inputs. Loading the data is cheap, the model figures are
+# the expensive ones, and they are only sampled when their inputs changed.
+def report_jobs(draws=REPORT_DRAWS, seed=REPORT_SEED):
+    from Sandbox.load_data import load_national_prices, load_wage_growth, load_interest_rate, \
+        load_cost_factor_of_purchase, load_regional_prices, calculate_marginal_cost_increase
+    from Sandbox.main import absolute_to_relative_prices, monthly_to_quarterly
+
+    prices = load_national_prices(1992)
+    wages = load_wage_growth(1992)
+    stavanger = load_regional_prices()["Stavanger"]
+
+    def stats_inputs(region_prices, min_year):
+        return {"prices": region_prices, "min_year": min_year, "interest": load_interest_rate(min_year),
+                "wages": load_wage_growth(min_year), "cost": load_cost_factor_of_purchase(min_year)}
+
+    quarterly = {"prices": monthly_to_quarterly(prices), "wages": monthly_to_quarterly(wages)}
+    sampling = {"draws": draws, "random_seed": seed}
+    return [
+        ReportJob("stats_national", ["summary/stats_national.png"], render_stats, stats_inputs(prices, 1992)),
+        ReportJob("stats_stavanger", ["summary/stats_stavanger.png"], render_stats,
+                  stats_inputs(stavanger.prices, stavanger.start_year)),
+        ReportJob("price_trend_comparison", ["comparisons/price_trend_observed_vs_estimated.png"],
+                  render_price_growth, {"prices": prices}),
+        ReportJob("price_to_wage_comparison", ["comparisons/price_to_wage_observed_vs_estimated.png"],
+                  render_wages_to_prices, {"prices": prices, "wages": wages}),
+        ReportJob("changepoint_comparison", ["comparisons/changepoint_observed_vs_estimated.png"],
+                  render_changepoint_analysis, {"prices": stavanger.prices}),
+        ReportJob("marginal_cost_increase", ["comparisons/marginal_kostnadsendring.png"],
+                  render_marginal_cost_increase, {"marginal_cost_increase": calculate_marginal_cost_increase()}),
+        ReportJob("interest_to_cost", ["comparisons/totalkostnad_som_funksjona_av_rente.png"],
+                  render_interest_to_cost, {}),
+        ReportJob("price_trend_estimation", ["estimations/price_trend.png", "summary/summary_price_trend.png"],
+                  render_price_trend_estimation, {"prices": prices, **sampling}),
+        ReportJob("price_to_wage_estimation", ["estimations/price_to_wage.png", "summary/summary_price_to_wage.png"],
+                  render_wage_correlation_estimation, {**quarterly, **sampling}),
+        ReportJob("changepoint_estimation",
+                  ["estimations/changepoint_cauchy_px10.png", "summary/summary_changepoint_cauchy_px10.png"],
+                  render_breakpoint_estimation,
+                  {"relative_prices": absolute_to_relative_prices(stavanger.prices), **sampling}),
+    ]
+
+
+def use_agg_backend():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Runs in a worker process
+def render_job(job, results_dir):
+    use_agg_backend()
+    job.render(job.inputs, [str(Path(results_dir) / output) for output in job.outputs])
+    return job.name
+
+
+def load_manifest(results_dir):
+    manifest_path = Path(results_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(results_dir, manifest):
+    with open(Path(results_dir) / MANIFEST_FILE, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+
+def is_up_to_date(job, input_hash, results_dir, manifest):
+    return all(manifest.get(output) == input_hash and (Path(results_dir) / output).exists() for output in job.outputs)
+
+
+# Renders the report figures with the Agg backend into results_dir, in parallel worker processes.
+# Jobs whose input hash matches the one their figures were rendered from are skipped unless force is set.
+# names restricts the report to those jobs. Rendering into RESULTS_DIR overwrites the committed figures and
+# needs replace_committed. Returns the names of the rendered and the skipped jobs.
+def render_report(results_dir=REPORT_DIR, processes=None, force=False, names=None, jobs=None,
+                  replace_committed=False):
+    results_dir = Path(results_dir)
+    if results_dir.resolve() == RESULTS_DIR.resolve() and not replace_committed:
+        raise ValueError(f"{results_dir} holds the committed figures, "
+                         "pass replace_committed (--replace-committed) to render over them")
+    results_dir.mkdir(parents=True, exist_ok=True)
+    jobs = report_jobs() if jobs is None else jobs
+    if names:
+        unknown = set(names) - {job.name for job in jobs}
+        if unknown:
+            raise ValueError(f"unknown report figures {sorted(unknown)}")
+        jobs = [job for job in jobs if job.name in names]
+
+    manifest = load_manifest(results_dir)
+    hashes = {job.name: job.input_hash() for job in jobs}
+    pending = [job for job in jobs if force or not is_up_to_date(job, hashes[job.name], results_dir, manifest)]
+    skipped = [job.name for job in jobs if job not in pending]
+
+    rendered = []
+    if pending:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(render_job, job, results_dir): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                future.result()
+                manifest.update({output: hashes[job.name] for output in job.outputs})
+                save_manifest(results_dir, manifest)
+                rendered.append(job.name)
+    return rendered, skipped
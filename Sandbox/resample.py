@@ -0,0 +1,99 @@
+import numpy as np
+
+from Sandbox.TimeSeries import TimeSeries
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+# Regular grid of dates from start to end (inclusive).
+# frequency: 'D' daily, 'W' weekly (every 7 days from start) or 'M' first day of every month.
+def date_grid(start, end, frequency='M'):
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    if frequency == 'D':
+        return np.arange(start, end + ONE_DAY, ONE_DAY)
+    if frequency == 'W':
+        return np.arange(start, end + ONE_DAY, np.timedelta64(7, 'D'))
+    if frequency == 'M':
+        first_month = start.astype('datetime64[M]')
+        if first_month.astype('datetime64[D]') < start:
+            first_month += 1
+        return np.arange(first_month, end.astype('datetime64[M]') + 1).astype('datetime64[D]')
+    raise ValueError(f"unknown frequency {frequency}")
+
+
+# As-of join: for every target date, the value of the latest observation dated on or before it.
+# Used for step functions such as interest rates, where a value holds until the next announcement.
+# The series is sorted once (stable, so for equal dates the last row in input order wins)
+# and the whole target grid is mapped with one searchsorted. Targets before the first observation get NaN.
+def asof(series, target_dates):
+    target_dates = np.asarray(target_dates, dtype='datetime64[D]')
+    order = np.argsort(series.dates, kind='stable')
+    sorted_dates = series.dates[order]
+    sorted_values = series.values[order]
+
+    positions = np.searchsorted(sorted_dates, target_dates, side='right') - 1
+    values = np.where(positions >= 0, sorted_values[np.maximum(positions, 0)], np.nan)
+    return TimeSeries(target_dates, values)
+
+
+# Forward fill a step series onto a regular grid. The range is open-ended by default:
+# it starts at the first observation and ends at the last one.
+def forward_fill(series, start=None, end=None, frequency='M'):
+    if start is None:
+        start = series.dates.min()
+    if end is None:
+        end = series.dates.max()
+    return asof(series, date_grid(start, end, frequency))
+
+
+# First day of count consecutive months starting with the month of first_date.
+def month_starts(first_date, count):
+    first_month = np.datetime64(first_date, 'M')
+    return (first_month + np.arange(count)).astype('datetime64[D]')
+
+
+# Linear interpolation inside each period. starts and ends have shape (..., periods),
+# the result has shape (..., periods * steps) where step m of a period is start + (end - start) / steps * m.
+def linear_within_period(starts, ends, steps):
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    increase_per_step = (ends - starts) / steps
+    values = starts[..., None] + increase_per_step[..., None] * np.arange(steps)
+    return values.reshape(starts.shape[:-1] + (starts.shape[-1] * steps,))
+
+
+# Quarterly -> monthly. quarter_dates are the first days of consecutive quarters,
+# values has shape (quarters,) or (series, quarters) to resample many series in one call.
+# Each quarter runs linearly from the previous quarter's value to its own value, the first observed quarter is flat,
+# and the value of the last quarter is added as the first month after it. Quarters before a series' first
+# observation are NaN and stay NaN.
+def quarterly_to_monthly(quarter_dates, values):
+    values = np.asarray(values, dtype=np.float64)
+    starts = np.empty_like(values)
+    starts[..., 0] = values[..., 0]
+    starts[..., 1:] = values[..., :-1]
+    starts = np.where(np.isnan(starts), values, starts)
+
+    monthly = linear_within_period(starts, values, 3)
+    monthly = np.concatenate([monthly, values[..., -1:]], axis=-1)
+    return month_starts(quarter_dates[0], monthly.shape[-1]), monthly
+
+
+# Yearly -> monthly by linear interpolation from the end of the previous year.
+# values[..., i] is the level at the end of years[i]; the first year only serves as the start of the second.
+def yearly_to_monthly(years, values):
+    values = np.asarray(values, dtype=np.float64)
+    monthly = linear_within_period(values[..., :-1], values[..., 1:], 12)
+    return month_starts(f"{int(years[1])}-01", monthly.shape[-1]), monthly
+
+
+# Yearly rates in percent -> monthly index. The index starts at start_value and compounds once a year,
+# with linear steps between the start and end of each year.
+def compound_yearly_to_monthly(years, rates, start_value=100):
+    rates = np.asarray(rates, dtype=np.float64)
+    factors = (100 + rates) / 100
+    start = np.full(rates.shape[:-1] + (1,), float(start_value))
+    levels = np.cumprod(np.concatenate([start, factors], axis=-1), axis=-1)
+    monthly = linear_within_period(levels[..., :-1], levels[..., 1:], 12)
+    return month_starts(f"{int(years[0])}-01", monthly.shape[-1]), monthly
@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Sandbox.model_cache import ModelCache
+from Sandbox.run_model import price_trend_data, wage_correlation_data, store_run
+
+COLD_TUNE = 1000
+WARM_TUNE = 200
+
+# compiled models of the worker processes in parallel runs
+window_model_cache = ModelCache(match_shape=False)
+
+
+# (start, stop) index pairs of the windows. Rolling windows have a fixed length, expanding windows
+# all start at the beginning of the series and grow by step, from window observations.
+def window_bounds(n, window=60, step=1, expanding=False):
+    if expanding:
+        return [(0, stop) for stop in range(window, n + 1, step)]
+    return [(start, start + window) for start in range(0, n - window + 1, step)]
+
+
+# Posterior of one window, used to start the next: the posterior means of the model's free variables as
+# initial point, their posterior variances as the diagonal mass matrix and the final step size.
+class WarmStart:
+    def __init__(self, start, variance, step_size):
+        self.start = start
+        self.variance = variance
+        self.step_size = step_size
+
+    @classmethod
+    def from_trace(cls, model, trace):
+        names = [variable.name for variable in model.vars]
+        start = {name: trace[name].mean(axis=0) for name in names}
+        variance = model.dict_to_array({name: trace[name].var(axis=0) for name in names})
+        step_size = float(trace.get_sampler_stats('step_size')[-1])
+        return cls(start, variance, step_size)
+
+    # A NUTS step for the next window. scaling is the precision with is_cov=False, and NUTS divides
+    # step_scale by the fourth root of the number of parameters to get its first step size.
+    def step(self, model):
+        import pymc3 as pm
+
+        with model:
+            return pm.NUTS(scaling=1 / np.maximum(self.variance, 1e-10), is_cov=False,
+                           step_scale=self.step_size * model.ndim ** 0.25)
+
+
+def summarize_window(model, trace, window_start, observations, tune, seconds):
+    import pymc3 as pm
+
+    with model:
+        summary = pm.summary(trace, kind="stats", round_to="none")
+    summary["window_start"] = window_start
+    summary["observations"] = observations
+    summary["tune"] = tune
+    summary["seconds"] = seconds
+    return summary
+
+
+def fit_window(kind, data, draws, tune, chains, random_seed, model_cache, warm_start=None):
+    start_time = time.perf_counter()
+    sample_kwargs = {"draws": draws, "tune": tune, "chains": chains, "cores": 1, "random_seed": random_seed,
+                     "progressbar": False}
+    if warm_start is not None:
+        sample_kwargs.update(start=warm_start.start, step=warm_start.step(model_cache.get(kind, data).model))
+    model, trace = model_cache.sample(kind, data, **sample_kwargs)
+    return model, trace, time.perf_counter() - start_time
+
+
+def store_window(trace_store, kind, model, trace, window_start, window_end, tune, random_seed, seconds, run_info):
+    window = {"window_start": str(window_start), "window_end": str(window_end)}
+    store_run(trace_store, model, trace, trace, kind, dict(window, **(run_info or {})), draws=len(trace), tune=tune,
+              random_seed=random_seed, seconds=seconds)
+
+
+# Runs in a worker process when windows are fitted in parallel without warm starts.
+def fit_cold_window(kind, data, window_start, window_end, draws, tune, chains, random_seed, trace_store=None,
+                    run_info=None):
+    model, trace, seconds = fit_window(kind, data, draws, tune, chains, random_seed, window_model_cache)
+    store_window(trace_store, kind, model, trace, window_start, window_end, tune, random_seed, seconds, run_info)
+    return summarize_window(model, trace, window_start, len(next(iter(data.values()))), tune, seconds)
+
+
+# Re-estimates a model on every window and returns the posterior summaries as one table indexed by
+# (window end date, variable). window_data(start, stop) gives the model data of a window.
+# With warm_start each window starts from the posterior of the previous one and is tuned for warm_tune
+# iterations instead of tune. Without it the windows are independent and run in a pool of processes.
+# With a trace_store every window's trace is saved, with the window and run_info as metadata.
+def run_windows(kind, window_data, dates, bounds, draws=1000, tune=COLD_TUNE, warm_tune=WARM_TUNE, chains=2,
+                warm_start=True, processes=None, seed=8927, trace_store=None, run_info=None):
+    import pandas as pd
+
+    summaries = []
+    window_seeds = [[seed + i * chains + chain for chain in range(chains)] for i in range(len(bounds))]
+    if warm_start:
+        model_cache = ModelCache(match_shape=False)
+        state = None
+        for i, (start, stop) in enumerate(bounds):
+            window_tune = tune if state is None else warm_tune
+            model, trace, seconds = fit_window(kind, window_data(start, stop), draws, window_tune, chains,
+                                               window_seeds[i], model_cache, state)
+            state = WarmStart.from_trace(model, trace)
+            store_window(trace_store, kind, model, trace, dates[start], dates[stop - 1], window_tune, window_seeds[i],
+                         seconds, run_info)
+            summaries.append(summarize_window(model, trace, dates[start], stop - start, window_tune, seconds))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(fit_cold_window, kind, window_data(start, stop), dates[start], dates[stop - 1], draws,
+                                   tune, chains, window_seeds[i], trace_store, run_info)
+                       for i, (start, stop) in enumerate(bounds)]
+            summaries = [future.result() for future in futures]
+
+    window_ends = [dates[stop - 1] for _, stop in bounds]
+    return pd.concat(summaries, keys=window_ends, names=["window_end", "variable"])
+
+
+# Price trend slope over rolling or expanding windows. Each window is normalized to start at 1,
+# as the trend model has its intercept fixed at 1.
+def rolling_price_trend(prices, window=60, step=1, expanding=False, **kwargs):
+    return run_windows("price_trend", lambda start, stop: price_trend_data(prices[start:stop].normalize()),
+                       prices.dates, window_bounds(len(prices), window, step, expanding), **kwargs)
+
+
+# Wage coefficient and intercept of the wage correlation model over rolling or expanding windows.
+def rolling_wage_correlation(prices, wages, window=60, step=1, expanding=False, **kwargs):
+    return run_windows("wage_correlation",
+                       lambda start, stop: wage_correlation_data(prices[start:stop], wages[start:stop]),
+                       prices.dates, window_bounds(len(prices), window, step, expanding), **kwargs)
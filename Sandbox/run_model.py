@@ -1,81 +1,572 @@
 import numpy as np
-import arviz as az
-import matplotlib.pyplot as plt
-import pymc3 as pm
 
+from Sandbox import instrument
+from Sandbox.figures import show_or_save
+
+# pymc3, theano, arviz and matplotlib are imported inside the functions using them,
+# so importing this module stays cheap for callers that only need the data pipeline.
+
+
+# Normal priors (mu, sd) of the linear models. The observation sd is fixed at 1, so the posteriors
+# are also available in closed form, see conjugate.py.
+PRICE_TREND_PRIORS = {"beta": (0.01, 0.1)}
+PRICE_TREND_INTERCEPT = 1
+WAGE_CORRELATION_PRIORS = {"intercept": (-2.7, 0.5), "beta": (3.7, 0.5)}
+
+
+# method "nuts" samples the model with pymc3, "analytic" returns the exact conjugate posterior without sampling,
+# "advi" and "fullrank_advi" draw from a variational approximation (see fit_model), with the same summary table.
+# show=False skips the trace plot and printing. Returns the summary table.
+# With a model_cache (see model_cache.py) the compiled model is reused and only the data is swapped.
+# plot_output saves the trace plot to that file instead of showing it.
+# With a trace_store (see trace_store.py) the sampled trace is saved with the metadata in run_info.
+def run_price_trend_model(pricedata, method="nuts", draws=1000, show=True, model_cache=None, random_seed=None,
+                          plot_output=None, trace_store=None, run_info=None):
+    if method == "analytic":
+        from Sandbox.conjugate import price_trend_posterior
+        return show_summary(price_trend_posterior(pricedata), show)
+
+    import pymc3 as pm
+
+    trend_model, samples = fit_model("price_trend", price_trend_data(pricedata), method, model_cache,
+                                     draws=draws, cores=1, random_seed=random_seed, progressbar=show)
+    with trend_model:
+        summary = pm.summary(samples, kind="stats", round_to="none")
+        store_run(trace_store, trend_model, samples, samples, "price_trend", run_info, draws=draws,
+                  random_seed=random_seed, method=method)
+        if show or plot_output is not None:
+            pm.traceplot(samples)
+            show_or_save(plot_output)
+    return show_summary(summary, show)
+
+
+def run_wage_correlation_model(pricedata, wages, method="nuts", draws=1000, show=True, model_cache=None,
+                               random_seed=None, plot_output=None, trace_store=None, run_info=None):
+    if method == "analytic":
+        from Sandbox.conjugate import wage_correlation_posterior
+        return show_summary(wage_correlation_posterior(pricedata, wages), show)
+
+    import pymc3 as pm
+
+    wage_to_price_model, samples = fit_model("wage_correlation", wage_correlation_data(pricedata, wages), method,
+                                             model_cache, draws=draws, cores=1, random_seed=random_seed,
+                                             progressbar=show)
+    with wage_to_price_model:
+        summary = pm.summary(samples, kind="stats", round_to="none")
+        store_run(trace_store, wage_to_price_model, samples, samples, "wage_correlation", run_info, draws=draws,
+                  random_seed=random_seed, method=method)
+        if show or plot_output is not None:
+            pm.traceplot(samples)
+            show_or_save(plot_output)
+    return show_summary(summary, show)
+
+
+# Saves a sampled trace with its metadata when a trace store is given. posterior is the MultiTrace or
+# the InferenceData to save, samples the MultiTrace pm.sample returned. Returns the run id.
+def store_run(trace_store, model, posterior, samples, kind, run_info=None, **settings):
+    if trace_store is None:
+        return None
+    import arviz as az
+    from Sandbox.trace_store import save_run
+
+    if not isinstance(posterior, az.InferenceData):
+        posterior = az.from_pymc3(posterior, model=model)
+    # approximations drawn from by fit_model have no sampling time
+    sampling_seconds = getattr(samples.report, "t_sampling", None)
+    metadata = {"model": kind, "chains": samples.nchains, "sampling_seconds": sampling_seconds, **settings,
+                **(run_info or {})}
+    return save_run(trace_store, posterior, metadata)
+
+
+# summaries are returned unrounded and printed with 3 decimals like pm.summary
+def show_summary(summary, show):
+    if show:
+        print(summary.round(3))
+    return summary
+
+
+# Builds the model, or takes it from the model cache with the new data set, and samples it.
+# backend(model) may give the trace backend to record the draws in, see stream_model.
+# Returns the model and the MultiTrace.
+def sample_model(kind, data, model_cache=None, backend=None, **sample_kwargs):
+    if model_cache is not None:
+        return model_cache.sample(kind, data, backend, **sample_kwargs)
+
+    import pymc3 as pm
+
+    with MODEL_BUILDERS[kind](data) as model:
+        trace = pm.sample(return_inferencedata=False, trace=backend and backend(model), **sample_kwargs)
+    instrument.sampler_stats(kind, trace, cached=False)
+    return model, trace
+
+
+# Samples like sample_model, but the draws of var_names are summarized by a streaming.StreamingPosterior while
+# they are produced and not kept, so memory does not grow with draws or chains. derived(values) may add
+# variables computed from every draw. With a trace_store every thin-th draw is saved to it as a run, with
+# the metadata in run_info. Returns the model and the StreamingPosterior.
+def stream_model(kind, data, var_names, model_cache=None, derived=None, thin=1, trace_store=None, run_info=None,
+                 draws=1000, tune=1000, chains=None, cores=1, random_seed=None, **sample_kwargs):
+    from Sandbox.streaming import StreamingPosterior, streaming_traces
+    from Sandbox.trace_store import run_writer
+
+    # pm.sample's default
+    chains = chains or max(2, cores)
+    writer = run_writer(trace_store, {"model": kind, "chains": chains, "draws": draws, "tune": tune, "thin": thin,
+                                      "random_seed": random_seed, "streaming": True, **(run_info or {})}, chains)
+    seed = random_seed if np.isscalar(random_seed) or random_seed is None else random_seed[0]
+    posterior = StreamingPosterior(draws, seed, writer=writer, thin=thin)
+    try:
+        model, trace = sample_model(kind, data, model_cache,
+                                    lambda model: streaming_traces(model, posterior, chains, tune, var_names, derived),
+                                    draws=draws, tune=tune, chains=chains, cores=cores, random_seed=random_seed,
+                                    compute_convergence_checks=False, **sample_kwargs)
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        raise
+    if writer is not None:
+        posterior.run_id = writer.close(sampling_seconds=trace.report.t_sampling)
+    return model, posterior
+
+
+# method "nuts" samples the model like sample_model, "advi" and "fullrank_advi" fit a mean-field or a full-rank
+# Gaussian approximation instead (see approximate_model) and draw from it. Returns the model and the MultiTrace,
+# the approximation has one chain and no sampler statistics.
+def fit_model(kind, data, method="nuts", model_cache=None, **sample_kwargs):
+    if method == "nuts":
+        return sample_model(kind, data, model_cache, **sample_kwargs)
+    if method not in VARIATIONAL_METHODS:
+        raise ValueError(f"unknown inference method {method}")
+    fit_kwargs = {"draws": sample_kwargs.get("draws") or 1000, "random_seed": sample_kwargs.get("random_seed"),
+                  "progressbar": sample_kwargs.get("progressbar"), "start": sample_kwargs.get("start")}
+    if model_cache is not None:
+        return model_cache.approximate(kind, data, method, **fit_kwargs)
+    return approximate_model(kind, data, method, **fit_kwargs)
+
+
+# pymc3's variational family of every method
+VARIATIONAL_METHODS = {"advi": "mean_field", "fullrank_advi": "full_rank"}
+ADVI_MAX_ITERATIONS = 50000
+# pm.callbacks.CheckParametersConvergence stops the fit once the parameters of the approximation change less
+# than this, relative to their size, between checks
+ADVI_TOLERANCE = 1e-3
+ADVI_CHECK_EVERY = 100
+
+
+# pm.fit of a model from MODEL_BUILDERS, built for this one fit. With a model cache the built model is kept and
+# fitted again on new data instead, see fit_model.
+def approximate_model(kind, data, method="advi", draws=1000, random_seed=None, progressbar=False, start=None,
+                      max_iterations=ADVI_MAX_ITERATIONS):
+    return fit_approximation(kind, MODEL_BUILDERS[kind](data), method, draws, random_seed, progressbar, start,
+                             max_iterations)
+
+
+# Fits a mean-field ("advi") or full-rank ("fullrank_advi") Gaussian approximation with pymc3's defaults until
+# its parameters settle or max_iterations is reached, and draws from it. Returns the model and the MultiTrace.
+# This is pm.fit(method=method) with the group of variables given in model order: pymc3 collects them in a set
+# otherwise, and the order of its parameters, and with it the fit for a seed, changes from run to run.
+def fit_approximation(kind, model, method="advi", draws=1000, random_seed=None, progressbar=False, start=None,
+                      max_iterations=ADVI_MAX_ITERATIONS):
+    import pymc3 as pm
+
+    seed = random_seed if np.isscalar(random_seed) or random_seed is None else random_seed[0]
+    convergence = pm.callbacks.CheckParametersConvergence(every=ADVI_CHECK_EVERY, tolerance=ADVI_TOLERANCE)
+    with model, instrument.stage("advi", kind=kind, method=method) as current:
+        group = pm.Group(model.free_RVs, vfam=VARIATIONAL_METHODS[method], random_seed=seed, start=start)
+        approximation = pm.fit(n=max_iterations, method=pm.KLqp(pm.Approximation([group])),
+                               progressbar=bool(progressbar), callbacks=[convergence])
+        trace = approximation.sample(draws)
+        losses = approximation.hist
+        current.update(iterations=len(losses), converged=len(losses) < max_iterations,
+                       loss=float(np.mean(losses[-ADVI_CHECK_EVERY:])))
+    return model, trace
+
+
+# The models take their observations and predictors from pm.Data containers, so a built model can be
+# refitted on other data of the same shape with pm.set_data. The *_data functions give the container values.
+def price_trend_data(pricedata):
+    scaling_factor = 1
+    return {
+        "X": np.arange(0, len(pricedata), dtype=np.float64) * scaling_factor,
+        "observed_prices": pricedata.values * scaling_factor,
+    }
+
+
+def build_price_trend_model(data):
+    import pymc3 as pm
 
-def run_price_trend_model(pricedata):
     with pm.Model() as trend_model:
         scaling_factor = 1
-        X = np.array(list(map(lambda p: p * scaling_factor, range(0, len(pricedata)))))
-        observed_prices = np.array(list(map(lambda p: p.value * scaling_factor, pricedata)))
+        X = pm.Data('X', data["X"])
+        observed_prices = pm.Data('observed_prices', data["observed_prices"])
 
         # stdev = pm.HalfNormal('stdev', sd=1)
         # intercept = pm.Normal('intercept', mu=2.3, sd=1)
-        intercept = 1 * scaling_factor
-        coeff = pm.Normal('beta', mu=0.01, sd=0.1)
+        intercept = PRICE_TREND_INTERCEPT * scaling_factor
+        coeff = pm.Normal('beta', mu=PRICE_TREND_PRIORS["beta"][0], sd=PRICE_TREND_PRIORS["beta"][1])
 
         expected_price = X * coeff + intercept
         prices = pm.Normal('prices', mu=expected_price, observed=observed_prices)
+    return trend_model
 
-        samples = pm.sample(1000, cores=1)
 
-        pm.traceplot(samples)
-        plt.show()
-        print(pm.summary(samples, kind="stats"))
+def wage_correlation_data(pricedata, wages):
+    scale = 1
+    return {"X": wages.values * scale, "observed_prices": pricedata.values * scale}
 
 
-def run_wage_correlation_model(pricedata, wages):
+def build_wage_correlation_model(data):
+    import pymc3 as pm
+
     with pm.Model() as wage_to_price_model:
-        scale = 1
-        X = np.array(list(map(lambda p: p.value * scale, wages)))
-        observed_prices = np.array(list(map(lambda p: p.value * scale, pricedata)))
+        X = pm.Data('X', data["X"])
+        observed_prices = pm.Data('observed_prices', data["observed_prices"])
 
-        intercept = pm.Normal('intercept', mu=-2.7, sd=0.5)
-        coeff = pm.Normal('beta', mu=3.7, sd=0.5)
+        intercept = pm.Normal('intercept', mu=WAGE_CORRELATION_PRIORS["intercept"][0],
+                              sd=WAGE_CORRELATION_PRIORS["intercept"][1])
+        coeff = pm.Normal('beta', mu=WAGE_CORRELATION_PRIORS["beta"][0], sd=WAGE_CORRELATION_PRIORS["beta"][1])
 
         expected_price = X * coeff + intercept
         prices = pm.Normal('prices', mu=expected_price, observed=observed_prices)
+    return wage_to_price_model
+
+
+BREAKPOINT_SCALING_FACTOR = 10
+# Cauchy prior of the changepoint (alpha, beta), in months from the start of the series
+CHANGEPOINT_PRIOR = (100, 2)
+# Normal priors (mu, sd) of the scaled monthly price changes before and after the changepoint
+BREAKPOINT_PRIORS = {"early_trend": (0.1, 0.1), "late_trend": (-0.05, 0.1)}
+
+
+# show=False skips the trace plot and printing, for batch runs. Returns the summary table.
+# model selects the changepoint treatment: "cauchy" samples a continuous changepoint with a Cauchy prior,
+# "marginalized" sums the likelihood over every discrete changepoint position (see build_marginalized_breakpoint_model).
+# With prescan the changepoint prior is centred on the strongest changepoint segmentation.detect_changepoints finds,
+# and sampling starts from it and the mean changes before and after it, instead of the fixed CHANGEPOINT_PRIOR.
+# method "advi" or "fullrank_advi" fits a variational approximation instead of sampling (see fit_model), only
+# for the marginalized model: the likelihood of the cauchy model is flat in the changepoint between observations.
+# With streaming the draws are summarized while they are sampled instead of being kept (see stream_model), the
+# summary gets ess and r_hat columns and with a trace_store every thin-th draw is saved.
+def run_breakpoint_model(prices, draws=1000, tune=1000, chains=None, cores=1, random_seed=None, show=True,
+                         model="cauchy", model_cache=None, plot_output=None, trace_store=None, run_info=None,
+                         prescan=False, method="nuts", streaming=False, thin=1):
+    import arviz as az
+
+    relative_changes_np = prices.values * BREAKPOINT_SCALING_FACTOR
+    prior_location, start = CHANGEPOINT_PRIOR[0], None
+    if prescan:
+        prior_location, start = prescan_changepoint(relative_changes_np, prior_location)
+    if model == "cauchy":
+        kind, data = "breakpoint", breakpoint_data(relative_changes_np, prior_location)
+    elif model == "marginalized":
+        kind, data = "marginalized_breakpoint", changepoint_statistics(relative_changes_np, prior_location)
+        start = start and {name: value for name, value in start.items() if name != "changepoint"}
+    else:
+        raise ValueError(f"unknown breakpoint model {model}")
+    if method != "nuts" and model != "marginalized":
+        raise ValueError(f"{method} needs the marginalized breakpoint model")
+    if streaming:
+        if method != "nuts":
+            raise ValueError("streaming summaries are only available for sampling")
+        derived = changepoint_draws(data, random_seed) if model == "marginalized" else None
+        _, posterior = stream_model(kind, data, BREAKPOINT_VARIABLES, model_cache, derived, thin, trace_store,
+                                    dict(run_info or {}, prior_location=prior_location), draws=draws, tune=tune,
+                                    chains=chains, cores=cores, random_seed=random_seed, progressbar=show,
+                                    start=start)
+        if show or plot_output is not None:
+            az.plot_trace(posterior.inference_data(), var_names=BREAKPOINT_VARIABLES)
+            show_or_save(plot_output)
+        return show_summary(posterior.summary(BREAKPOINT_VARIABLES), show)
+
+    trend_change_model, samples = fit_model(kind, data, method, model_cache, draws=draws, tune=tune, chains=chains,
+                                            cores=cores, random_seed=random_seed, progressbar=show, start=start)
+
+    # az.plot_trace(samples, var_names=['changepoint', 'early_trend', 'late_trend'])
+    # trend_change_model.early_trend.summary()#
+    # trend_change_model.trace['early_trend']
+
+    trace = samples
+    if model == "marginalized":
+        samples = breakpoint_posterior(samples, relative_changes_np, random_seed, prior_location)
+    else:
+        samples = az.from_pymc3(samples, model=trend_change_model)
+    summary = az.summary(samples, var_names=BREAKPOINT_VARIABLES, kind="stats", round_to="none")
+    store_run(trace_store, trend_change_model, samples, trace, kind, run_info, draws=draws, tune=tune,
+              random_seed=random_seed, prior_location=prior_location, method=method)
+    if show or plot_output is not None:
+        az.plot_trace(samples, var_names=BREAKPOINT_VARIABLES)
+        show_or_save(plot_output)
+    return show_summary(summary, show)
+
+
+BREAKPOINT_VARIABLES = ["changepoint", "early_trend", "late_trend"]
+
+
+# Prior location and start point from the strongest detected changepoint, the defaults when none is found
+def prescan_changepoint(relative_changes, prior_location=CHANGEPOINT_PRIOR[0]):
+    from Sandbox.segmentation import detect_changepoints, segment_means, strongest_changepoint
+
+    changepoint = strongest_changepoint(relative_changes, detect_changepoints(relative_changes)[0])
+    if changepoint is None:
+        return prior_location, None
+    early_trend, late_trend = segment_means(relative_changes, [changepoint])
+    return changepoint, {"changepoint": float(changepoint), "early_trend": early_trend, "late_trend": late_trend}
+
+
+def breakpoint_data(relative_changes, prior_location=CHANGEPOINT_PRIOR[0]):
+    return {
+        "date_indexes": np.arange(0, len(relative_changes), dtype=np.float64),
+        "relative_changes": np.asarray(relative_changes, dtype=np.float64),
+        "changepoint_location": np.float64(prior_location),
+    }
+
+
+def build_breakpoint_model(data):
+    import pymc3 as pm
 
-        samples = pm.sample(1000, cores=1)
-
-        pm.traceplot(samples)
-        plt.show()
-        print(pm.summary(samples, kind="stats"))
-
-
-def run_breakpoint_model(prices):
     with pm.Model() as trend_change_model:
-        scaling_factor = 10
-        relative_changes = list(map(lambda p: p.value * scaling_factor, prices))
-        dates = list(map(lambda p: p.date, prices))
+        date_indexes = pm.Data('date_indexes', data["date_indexes"])
+        relative_changes = pm.Data('relative_changes', data["relative_changes"])
 
-        relative_changes_np = np.array(relative_changes)
-        date_indexes = np.arange(0, len(prices))
+        changepoint_location = pm.Data('changepoint_location', data["changepoint_location"])
 
         # Prior distributions
-        trend_change_point = pm.Cauchy('changepoint', alpha=100, beta=2)
-        early_trend = pm.Normal('early_trend', mu=0.1, sd=0.1)
-        late_trend = pm.Normal('late_trend', mu=-0.05, sd=0.1)
+        trend_change_point = pm.Cauchy('changepoint', alpha=changepoint_location, beta=CHANGEPOINT_PRIOR[1])
+        early_trend = pm.Normal('early_trend', mu=BREAKPOINT_PRIORS["early_trend"][0],
+                                sd=BREAKPOINT_PRIORS["early_trend"][1])
+        late_trend = pm.Normal('late_trend', mu=BREAKPOINT_PRIORS["late_trend"][0],
+                               sd=BREAKPOINT_PRIORS["late_trend"][1])
 
         # Transformed variable
         trend = pm.math.switch(trend_change_point >= date_indexes, early_trend, late_trend)
 
         # Likelyhood
-        price_change = pm.Normal('price_change', trend, observed=relative_changes_np)
+        price_change = pm.Normal('price_change', trend, observed=relative_changes)
+    return trend_change_model
+
+
+# Prefix sums of the observations for every candidate changepoint k = -1 .. n-1, where observations 0..k follow
+# the early trend and k+1..n-1 the late trend (k = -1: only the late trend). With these, the log likelihood of
+# all n+1 candidates is a handful of vector operations, O(n) per evaluation instead of O(n^2).
+def changepoint_statistics(relative_changes, prior_location=CHANGEPOINT_PRIOR[0]):
+    y = np.asarray(relative_changes, dtype=np.float64)
+    n = len(y)
+    candidates = np.arange(-1, n, dtype=np.float64)
+    sum_early = np.concatenate([[0.0], np.cumsum(y)])
+    sum_sq_early = np.concatenate([[0.0], np.cumsum(y * y)])
+    # same prior as the continuous model, CHANGEPOINT_PRIOR, evaluated at the candidates
+    log_prior = -np.log1p(((candidates - prior_location) / float(CHANGEPOINT_PRIOR[1])) ** 2)
+    return {
+        "candidates": candidates,
+        "log_prior": log_prior - np.logaddexp.reduce(log_prior),
+        "count_early": candidates + 1,
+        "count_late": n - (candidates + 1),
+        "sum_early": sum_early,
+        "sum_late": sum_early[-1] - sum_early,
+        "sum_sq_early": sum_sq_early,
+        "sum_sq_late": sum_sq_early[-1] - sum_sq_early,
+    }
+
+
+# statistics that only depend on the number of observations. The prior depends on the prior location too,
+# which the prescan sets per series, so it is a pm.Data container like the sums.
+CHANGEPOINT_SHAPE_STATISTICS = ["candidates", "count_early", "count_late"]
+
+
+# Log likelihood of every candidate changepoint. Works on theano tensors and on numpy arrays:
+# with early and late of shape (draws, 1) the result is (draws, n+1). The statistics may have a leading
+# region axis (see masked_changepoint_statistics), the last count_early is the number of observations.
+def changepoint_log_likelihood(statistics, early, late):
+    n = statistics["count_early"][..., -1, None]
+    early_sq_error = statistics["sum_sq_early"] - 2 * early * statistics["sum_early"] + statistics["count_early"] * early * early
+    late_sq_error = statistics["sum_sq_late"] - 2 * late * statistics["sum_late"] + statistics["count_late"] * late * late
+    return -0.5 * (early_sq_error + late_sq_error) - 0.5 * n * np.log(2 * np.pi)
+
+
+# Same likelihood as build_breakpoint_model with a discrete changepoint that is summed out with log-sum-exp,
+# so NUTS only sees the two smooth trend parameters. data is the output of changepoint_statistics.
+def build_marginalized_breakpoint_model(data):
+    import pymc3 as pm
 
-        samples = pm.sample(draws=1000, tune=1000, cores=1)
-
-        # az.plot_trace(samples, var_names=['changepoint', 'early_trend', 'late_trend'])
-        # trend_change_model.early_trend.summary()#
-        # trend_change_model.trace['early_trend']
-
-        pm.traceplot(samples)
-        plt.show()
-        print(pm.summary(samples, kind="stats"))
+    with pm.Model() as trend_change_model:
+        # the counts only depend on the number of observations, which is fixed for a built model
+        statistics = {name: value if name in CHANGEPOINT_SHAPE_STATISTICS else pm.Data(name, value)
+                      for name, value in data.items()}
+
+        early_trend = pm.Normal('early_trend', mu=BREAKPOINT_PRIORS["early_trend"][0],
+                                sd=BREAKPOINT_PRIORS["early_trend"][1])
+        late_trend = pm.Normal('late_trend', mu=BREAKPOINT_PRIORS["late_trend"][0],
+                               sd=BREAKPOINT_PRIORS["late_trend"][1])
+
+        log_joint = statistics["log_prior"] + changepoint_log_likelihood(statistics, early_trend, late_trend)
+        pm.Potential('price_change', pm.math.logsumexp(log_joint))
+    return trend_change_model
+
+
+# Posterior of the marginalized model as InferenceData, with a changepoint drawn for every draw of the trends
+# from its exact conditional distribution p(changepoint | early_trend, late_trend, data).
+# prior_location must be the one the model was fitted with.
+def breakpoint_posterior(samples, relative_changes, random_seed=None, prior_location=CHANGEPOINT_PRIOR[0]):
+    import arviz as az
+
+    statistics = changepoint_statistics(relative_changes, prior_location)
+    rng = np.random.default_rng(random_seed if np.isscalar(random_seed) or random_seed is None else random_seed[0])
+    early = np.stack(samples.get_values('early_trend', combine=False))
+    late = np.stack(samples.get_values('late_trend', combine=False))
+
+    log_joint = statistics["log_prior"] + changepoint_log_likelihood(statistics, early[..., None], late[..., None])
+    # Gumbel-max trick: argmax of log weights plus Gumbel noise is a draw from the normalized weights
+    changepoint = statistics["candidates"][np.argmax(log_joint + rng.gumbel(size=log_joint.shape), axis=-1)]
+    return az.from_dict(posterior={"changepoint": changepoint, "early_trend": early, "late_trend": late})
+
+
+# The derived function of streaming runs of the marginalized model (see stream_model): draws the changepoint of
+# one draw of the trends from its exact conditional distribution, like breakpoint_posterior.
+# statistics is the output of changepoint_statistics the model was fitted with.
+def changepoint_draws(statistics, random_seed=None):
+    rng = np.random.default_rng(random_seed if np.isscalar(random_seed) or random_seed is None else random_seed[0])
+
+    def draw(values):
+        log_joint = statistics["log_prior"] + changepoint_log_likelihood(statistics, values["early_trend"],
+                                                                         values["late_trend"])
+        return {"changepoint": statistics["candidates"][np.argmax(log_joint + rng.gumbel(size=log_joint.shape))]}
+
+    return draw
+
+
+HIERARCHICAL_BREAKPOINT_VARIABLES = ["changepoint", "early_trend", "late_trend", "mean_changepoint", "changepoint_scale",
+                                     "mean_early_trend", "early_trend_sd", "mean_late_trend", "late_trend_sd"]
+
+
+# All regions in one model, see build_hierarchical_breakpoint_model. changes is (regions, months) of relative
+# price changes on a common grid of months, NaN where a region has no observation (see batch.region_change_matrix).
+# Replaces one compilation and sampling per region by a single one. Returns the summary table, with the
+# region variables indexed like early_trend[Oslo]. changepoint is counted from the region's first month,
+# as in run_breakpoint_model, mean_changepoint from the first month of the grid.
+def run_hierarchical_breakpoint_model(regions, changes, draws=1000, tune=1000, chains=None, cores=1,
+                                      random_seed=None, show=True, model_cache=None, plot_output=None,
+                                      trace_store=None, run_info=None):
+    import arviz as az
+
+    data = masked_changepoint_statistics(np.asarray(changes) * BREAKPOINT_SCALING_FACTOR)
+    hierarchical_model, trace = sample_model("hierarchical_breakpoint", data, model_cache, draws=draws, tune=tune,
+                                             chains=chains, cores=cores, random_seed=random_seed, progressbar=show)
+    samples = hierarchical_breakpoint_posterior(trace, data, regions, random_seed)
+    summary = az.summary(samples, var_names=HIERARCHICAL_BREAKPOINT_VARIABLES, kind="stats", round_to="none")
+    store_run(trace_store, hierarchical_model, samples, trace, "hierarchical_breakpoint", run_info, draws=draws,
+              tune=tune, random_seed=random_seed, regions=list(regions))
+    if show or plot_output is not None:
+        az.plot_trace(samples, var_names=["mean_changepoint", "mean_early_trend", "mean_late_trend"])
+        show_or_save(plot_output)
+    return show_summary(summary, show)
+
+
+# changepoint_statistics for every row of changes at once. Months without an observation (NaN) add nothing to
+# the sums and counts, so regions starting later share the grid of the longest one. Candidates before a region's
+# first observation would all mean "only the late trend", they get candidate_offset -inf so only one of them counts.
+def masked_changepoint_statistics(changes):
+    changes = np.atleast_2d(np.asarray(changes, dtype=np.float64))
+    observed = ~np.isnan(changes)
+    y = np.where(observed, changes, 0.0)
+    zeros = np.zeros((len(y), 1))
+    count_early = np.concatenate([zeros, np.cumsum(observed, axis=1)], axis=1)
+    sum_early = np.concatenate([zeros, np.cumsum(y, axis=1)], axis=1)
+    sum_sq_early = np.concatenate([zeros, np.cumsum(y * y, axis=1)], axis=1)
+    candidates = np.arange(-1, y.shape[1], dtype=np.float64)
+    first_observed = observed.argmax(axis=1)
+    return {
+        "candidates": candidates,
+        "candidate_offset": np.where(candidates >= first_observed[:, None] - 1, 0.0, -np.inf),
+        "count_early": count_early,
+        "count_late": count_early[:, -1:] - count_early,
+        "sum_early": sum_early,
+        "sum_late": sum_early[:, -1:] - sum_early,
+        "sum_sq_early": sum_sq_early,
+        "sum_sq_late": sum_sq_early[:, -1:] - sum_sq_early,
+    }
+
+
+# Log prior of every region's candidates: a Cauchy around the common changepoint, normalized over the
+# candidates the region has. Works on theano tensors and on numpy arrays like changepoint_log_likelihood.
+def hierarchical_changepoint_log_prior(statistics, mean_changepoint, changepoint_scale, logsumexp):
+    log_prior = statistics["candidate_offset"] - np.log1p(((statistics["candidates"] - mean_changepoint)
+                                                           / changepoint_scale) ** 2)
+    return log_prior - logsumexp(log_prior)
+
+
+# The marginalized breakpoint model for all regions, with partial pooling: the region trends are drawn around
+# common means, and the region changepoints from a Cauchy around a common changepoint. Every variable is one
+# array over the regions and the changepoints are summed out per region, so NUTS only sees the trends and
+# the population parameters. data is the output of masked_changepoint_statistics.
+def build_hierarchical_breakpoint_model(data):
+    import pymc3 as pm
+
+    regions, candidates = data["count_early"].shape
+    with pm.Model() as hierarchical_model:
+        statistics = {name: pm.Data(name, value) for name, value in data.items()}
+
+        mean_early_trend = pm.Normal('mean_early_trend', mu=0.1, sd=0.1)
+        mean_late_trend = pm.Normal('mean_late_trend', mu=-0.05, sd=0.1)
+        early_trend_sd = pm.HalfNormal('early_trend_sd', sd=0.1)
+        late_trend_sd = pm.HalfNormal('late_trend_sd', sd=0.1)
+        # non-centered, the region offsets are standard normal
+        early_offset = pm.Normal('early_offset', mu=0, sd=1, shape=regions)
+        late_offset = pm.Normal('late_offset', mu=0, sd=1, shape=regions)
+        early_trend = pm.Deterministic('early_trend', mean_early_trend + early_trend_sd * early_offset)
+        late_trend = pm.Deterministic('late_trend', mean_late_trend + late_trend_sd * late_offset)
+
+        # months from the start of the grid
+        mean_changepoint = pm.Uniform('mean_changepoint', lower=-1, upper=candidates - 2)
+        changepoint_scale = pm.HalfNormal('changepoint_scale', sd=24)
+
+        log_prior = hierarchical_changepoint_log_prior(
+            statistics, mean_changepoint, changepoint_scale, lambda x: pm.math.logsumexp(x, axis=1))
+        log_likelihood = changepoint_log_likelihood(statistics, early_trend[:, None], late_trend[:, None])
+        pm.Potential('price_change', pm.math.logsumexp(log_prior + log_likelihood, axis=1).sum())
+    return hierarchical_model
+
+
+# Posterior of the hierarchical model as InferenceData with a region dimension. Every region's changepoint is
+# drawn from its exact conditional like in breakpoint_posterior, and counted from the region's first month.
+def hierarchical_breakpoint_posterior(samples, data, regions, random_seed=None):
+    import arviz as az
+    from scipy.special import logsumexp
+
+    rng = np.random.default_rng(random_seed if np.isscalar(random_seed) or random_seed is None else random_seed[0])
+    posterior = {name: np.stack(samples.get_values(name, combine=False))
+                 for name in HIERARCHICAL_BREAKPOINT_VARIABLES if name != "changepoint"}
+    first_observed = np.argmax(data["candidate_offset"] == 0, axis=1)
+
+    changepoint = np.empty_like(posterior["early_trend"])
+    # one chain at a time, the log weights are draws x regions x candidates
+    for chain in range(len(changepoint)):
+        log_prior = hierarchical_changepoint_log_prior(
+            data, posterior["mean_changepoint"][chain][:, None, None],
+            posterior["changepoint_scale"][chain][:, None, None], lambda x: logsumexp(x, axis=-1, keepdims=True))
+        log_joint = log_prior + changepoint_log_likelihood(data, posterior["early_trend"][chain][..., None],
+                                                           posterior["late_trend"][chain][..., None])
+        position = np.argmax(log_joint + rng.gumbel(size=log_joint.shape), axis=-1)
+        changepoint[chain] = data["candidates"][position] - first_observed
+    posterior["changepoint"] = changepoint
+
+    dims = {name: ["region"] for name in ["changepoint", "early_trend", "late_trend"]}
+    return az.from_dict(posterior=posterior, coords={"region": list(regions)}, dims=dims)
+
+
+MODEL_BUILDERS = {
+    "price_trend": build_price_trend_model,
+    "wage_correlation": build_wage_correlation_model,
+    "breakpoint": build_breakpoint_model,
+    "marginalized_breakpoint": build_marginalized_breakpoint_model,
+    "hierarchical_breakpoint": build_hierarchical_breakpoint_model,
+}
 
 
 def run_model():
+    import arviz as az
+    import matplotlib.pyplot as plt
+    import pymc3 as pm
+
     print(f"Running on PyMC3 v{pm.__version__}")
     # Initialize random number generator
     RANDOM_SEED = 8927
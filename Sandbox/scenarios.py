@@ -0,0 +1,157 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from Sandbox.load_data import INTEREST_MARGIN, PAYBACK_YEARS, DEBT_RATIO, MAX_DATE, interest_to_cost, \
+    load_interest_rate, load_regional_prices, load_wage_growth
+from Sandbox.resample import month_starts
+
+# Parameter axes of a sweep, in the order of the leading axes of the results
+PARAMETERS = ["margin", "payback_years", "debt_ratio", "rate_shock"]
+COST_FUNCTIONS = ["annuity", "regression"]
+PAYMENTS_PER_YEAR = 12
+# memory used for the results of one chunk of scenarios when writing a sweep to disk
+CHUNK_BYTES = 256 * 2 ** 20
+
+
+# Total cost of a purchase as a multiple of the price, for a loan of debt_ratio of the price paid back
+# as a monthly annuity over payback_years. interest is the yearly rate in percent. The rest of the price
+# is paid up front, so the cost is 1 at 0 interest. All arguments broadcast against each other.
+def annuity_cost(interest, payback_years=PAYBACK_YEARS, debt_ratio=DEBT_RATIO):
+    rate = np.asarray(interest, dtype=np.float64) / 100 / PAYMENTS_PER_YEAR
+    payments = np.asarray(payback_years) * PAYMENTS_PER_YEAR
+    zero = rate == 0
+    safe_rate = np.where(zero, 1.0, rate)
+    # payments * rate / (1 - (1 + rate) ** -payments), which goes to 1 as the rate goes to 0
+    repaid = np.where(zero, 1.0, payments * safe_rate / -np.expm1(-payments * np.log1p(safe_rate)))
+    return (1 - debt_ratio) + debt_ratio * repaid
+
+
+# The regression fit of load_data only describes its own loan, see interest_to_cost.
+def regression_cost(interest, payback_years=PAYBACK_YEARS, debt_ratio=DEBT_RATIO):
+    if np.any(np.asarray(payback_years) != PAYBACK_YEARS) or np.any(np.asarray(debt_ratio) != DEBT_RATIO):
+        raise ValueError(f"the regression cost is fitted for {PAYBACK_YEARS} years and a debt ratio of {DEBT_RATIO}, "
+                         "use the annuity cost for other loans")
+    return interest_to_cost(interest)
+
+
+def cost_function(name):
+    if name == "annuity":
+        return annuity_cost
+    if name == "regression":
+        return regression_cost
+    raise ValueError(f"unknown cost function {name}, expected one of {COST_FUNCTIONS}")
+
+
+# Monthly prices P and wages L of many regions on one grid of dates, shape (regions, months), and the
+# interest rate r on the same grid. Months before a region's first observation are NaN.
+# As in display_stats a region is compared with the wages normalized at its start year.
+class SweepInputs:
+    def __init__(self, regions, dates, prices, wages, interest_rates):
+        self.regions = list(regions)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.wages = np.asarray(wages, dtype=np.float64)
+        self.interest_rates = np.asarray(interest_rates, dtype=np.float64)
+
+    @classmethod
+    def from_regions(cls, regions=None, max_date=MAX_DATE):
+        collection = load_regional_prices()
+        regions = regions or collection.regions()
+        region_prices = [collection[region].prices for region in regions]
+        first_date = min(prices.dates[0] for prices in region_prices)
+        last_date = max(prices.dates[-1] for prices in region_prices)
+        dates = month_starts(first_date, int(np.datetime64(last_date, 'M') - np.datetime64(first_date, 'M')) + 1)
+
+        prices = np.full((len(regions), len(dates)), np.nan)
+        wages = np.full((len(regions), len(dates)), np.nan)
+        for row, region in enumerate(regions):
+            region_dates = region_prices[row].dates
+            columns = np.searchsorted(dates, region_dates)
+            prices[row, columns] = region_prices[row].values
+            wage = load_wage_growth(collection[region].start_year, max_date)
+            in_wage = np.isin(region_dates, wage.dates)
+            wages[row, columns[in_wage]] = wage.values[np.searchsorted(wage.dates, region_dates[in_wage])]
+
+        interest = load_interest_rate(first_date.item().year, max_date)
+        interest_rates = np.full(len(dates), np.nan)
+        in_grid = np.isin(interest.dates, dates)
+        interest_rates[np.searchsorted(dates, interest.dates[in_grid])] = interest.values[in_grid]
+        return cls(regions, dates, prices, wages, interest_rates)
+
+
+# The parameter values of a sweep as arrays, in the order of PARAMETERS.
+def parameter_axes(margins=(INTEREST_MARGIN,), payback_years=(PAYBACK_YEARS,), debt_ratios=(DEBT_RATIO,),
+                   rate_shocks=(0,)):
+    return [np.atleast_1d(np.asarray(values, dtype=np.float64))
+            for values in [margins, payback_years, debt_ratios, rate_shocks]]
+
+
+# Cost factor c, total cost K = P * c and K / L of the scenarios with the given flat indices into the grid,
+# shapes (scenarios, months) and (scenarios, regions, months).
+# The rate of a scenario is r + shock + margin, which for a shock of 0 is the net rate of load_data.
+def evaluate_scenarios(inputs, axes, flat_indices, cost="annuity"):
+    margin, payback_years, debt_ratio, rate_shock = [
+        axis[index][:, None] for axis, index in zip(axes, np.unravel_index(flat_indices, [len(a) for a in axes]))]
+    net_interest_rate = inputs.interest_rates + rate_shock + margin
+    cost_factor = cost_function(cost)(net_interest_rate, payback_years, debt_ratio)
+    total_cost = inputs.prices * cost_factor[:, None, :]
+    return cost_factor, total_cost, total_cost / inputs.wages
+
+
+# The full cube in memory: cost_factor has shape (margins, payback years, debt ratios, shocks, months),
+# total_cost and total_cost_to_wage (margins, payback years, debt ratios, shocks, regions, months).
+def sweep(inputs, margins=(INTEREST_MARGIN,), payback_years=(PAYBACK_YEARS,), debt_ratios=(DEBT_RATIO,),
+          rate_shocks=(0,), cost="annuity"):
+    axes = parameter_axes(margins, payback_years, debt_ratios, rate_shocks)
+    shape = tuple(len(axis) for axis in axes)
+    results = evaluate_scenarios(inputs, axes, np.arange(np.prod(shape)), cost)
+    return {name: result.reshape(shape + result.shape[1:])
+            for name, result in zip(["cost_factor", "total_cost", "total_cost_to_wage"], results)}
+
+
+# Same results as sweep, written to .npy files in output_dir chunk by chunk, so the grid can be larger than memory.
+# Returns the output directory; open the results with load_sweep.
+def sweep_to_disk(output_dir, inputs, margins=(INTEREST_MARGIN,), payback_years=(PAYBACK_YEARS,),
+                  debt_ratios=(DEBT_RATIO,), rate_shocks=(0,), cost="annuity", chunk_bytes=CHUNK_BYTES):
+    axes = parameter_axes(margins, payback_years, debt_ratios, rate_shocks)
+    shape = tuple(len(axis) for axis in axes)
+    scenarios = int(np.prod(shape))
+    regions, months = inputs.prices.shape
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    shapes = {"cost_factor": (months,), "total_cost": (regions, months), "total_cost_to_wage": (regions, months)}
+    outputs = {name: np.lib.format.open_memmap(output_dir / f"{name}.npy", mode='w+', dtype=np.float64,
+                                               shape=shape + result_shape)
+               for name, result_shape in shapes.items()}
+    flat_outputs = [outputs[name].reshape((scenarios,) + result_shape) for name, result_shape in shapes.items()]
+
+    scenario_bytes = 8 * (months + 2 * regions * months)
+    chunk = max(1, chunk_bytes // scenario_bytes)
+    for start in range(0, scenarios, chunk):
+        stop = min(start + chunk, scenarios)
+        for flat_output, result in zip(flat_outputs, evaluate_scenarios(inputs, axes, np.arange(start, stop), cost)):
+            flat_output[start:stop] = result
+    for output in outputs.values():
+        output.flush()
+
+    with open(output_dir / "axes.json", "w") as axes_file:
+        json.dump({
+            "cost": cost,
+            "parameters": {name: axis.tolist() for name, axis in zip(PARAMETERS, axes)},
+            "regions": inputs.regions,
+            "dates": [str(date) for date in inputs.dates],
+        }, axes_file, indent=1)
+    return output_dir
+
+
+# The axes and memory mapped results of sweep_to_disk
+def load_sweep(output_dir):
+    output_dir = Path(output_dir)
+    with open(output_dir / "axes.json") as axes_file:
+        axes = json.load(axes_file)
+    results = {name: np.load(output_dir / f"{name}.npy", mmap_mode='r')
+               for name in ["cost_factor", "total_cost", "total_cost_to_wage"]}
+    return axes, results
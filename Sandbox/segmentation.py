@@ -0,0 +1,113 @@
+import numpy as np
+
+# shortest segment, in blocks
+MIN_SEGMENT = 2
+# The monthly price series are interpolated from quarterly indexes (all regions, and the national index before
+# 2003), so three neighbouring monthly changes carry one observation. Segmenting quarter means keeps the
+# repeated months from being counted as independent evidence for a change.
+QUARTER_MONTHS = 3
+
+
+# Exact segmentation of series into segments of constant mean (PELT, Killick et al. 2012).
+# changes is one series or a (series, observations) matrix with NaN where a series has no observation,
+# as from batch.region_change_matrix. All series go through the dynamic programme together: every step is
+# a few array operations over series x candidate starts, and a candidate start is dropped for good once
+# PELT has pruned it in every series. Segment costs are the squared errors around the segment mean from
+# prefix sums, in units of the series' noise variance (estimated by noise_sd unless sd is given), and every
+# changepoint costs penalty, by default 2 log(observations) (BIC).
+# With block > 1 the series are segmented as means of block observations, changepoints fall between blocks.
+# Returns one array of changepoints per series. A changepoint k ends a segment after observation k, like the
+# changepoint of run_breakpoint_model.
+def detect_changepoints(changes, penalty=None, sd=None, min_segment=MIN_SEGMENT, block=QUARTER_MONTHS):
+    y = block_means(np.atleast_2d(np.asarray(changes, dtype=np.float64)), block)
+    observed = ~np.isnan(y)
+    sd = noise_sd(y) if sd is None else np.broadcast_to(np.asarray(sd, dtype=np.float64), (len(y),))
+    y = np.where(observed, y, 0.0) / sd[:, None]
+    count = prefix_sums(observed)
+    total = prefix_sums(y)
+    total_sq = prefix_sums(y * y)
+    if penalty is None:
+        penalty = 2 * np.log(np.maximum(count[:, -1], 2))
+    penalty = np.broadcast_to(np.asarray(penalty, dtype=np.float64), (len(y),))
+
+    series, length = y.shape
+    best = np.full((series, length + 1), np.inf)
+    best[:, 0] = -penalty
+    previous = np.zeros((series, length + 1), dtype=np.int64)
+    starts = np.empty(0, dtype=np.int64)
+    alive = np.empty((series, 0), dtype=bool)
+    for end in range(min_segment, length + 1):
+        starts = np.append(starts, end - min_segment)
+        alive = np.append(alive, np.ones((series, 1), dtype=bool), axis=1)
+        cost = best[:, starts] + segment_cost(count, total, total_sq, starts, end)
+        candidate_cost = np.where(alive, cost + penalty[:, None], np.inf)
+        choice = np.argmin(candidate_cost, axis=1)
+        best[:, end] = candidate_cost[np.arange(series), choice]
+        previous[:, end] = starts[choice]
+
+        alive &= cost <= best[:, end, None]
+        kept = alive.any(axis=0)
+        starts, alive = starts[kept], alive[:, kept]
+
+    return [(backtrack(row, length) + 1) * block - 1 for row in previous]
+
+
+# Means of every block observations, the last block may be shorter. NaN for blocks without observations.
+def block_means(y, block):
+    if block == 1:
+        return y
+    padded = np.full((len(y), -(-y.shape[1] // block) * block), np.nan)
+    padded[:, :y.shape[1]] = y
+    blocks = padded.reshape(len(y), -1, block)
+    observed = (~np.isnan(blocks)).sum(axis=2)
+    return np.divide(np.nansum(blocks, axis=2), observed, out=np.full(observed.shape, np.nan), where=observed > 0)
+
+
+def prefix_sums(values):
+    return np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)
+
+
+# Squared error around the mean of observations start..end-1, for an array of starts
+def segment_cost(count, total, total_sq, starts, end):
+    n = count[:, end, None] - count[:, starts]
+    segment_total = total[:, end, None] - total[:, starts]
+    mean_square = np.divide(segment_total ** 2, n, out=np.zeros_like(segment_total), where=n > 0)
+    return total_sq[:, end, None] - total_sq[:, starts] - mean_square
+
+
+def backtrack(previous, length):
+    changepoints = []
+    start = previous[length]
+    while start > 0:
+        changepoints.append(start - 1)
+        start = previous[start]
+    return np.array(changepoints[::-1], dtype=np.int64)
+
+
+# Noise sd of every series from the differences of neighbouring observations, which a change of the mean
+# only touches once. Series with constant values get 1.
+def noise_sd(y):
+    sd = np.nanstd(np.diff(y, axis=1), axis=1) / np.sqrt(2)
+    return np.where(np.isfinite(sd) & (sd > 0), sd, 1.0)
+
+
+# The changepoint that explains most of a series on its own: of the detected changepoints, the one that
+# splits the series into the two segments with the smallest total squared error. None without changepoints.
+def strongest_changepoint(changes, changepoints):
+    if len(changepoints) == 0:
+        return None
+    y = np.asarray(changes, dtype=np.float64)[None]
+    observed = ~np.isnan(y)
+    y = np.where(observed, y, 0.0)
+    count, total, total_sq = prefix_sums(observed), prefix_sums(y), prefix_sums(y * y)
+    ends = np.asarray(changepoints, dtype=np.int64) + 1
+    cost = [segment_cost(count, total, total_sq, np.array([0]), end)[0, 0]
+            + segment_cost(count, total, total_sq, np.array([end]), y.shape[1])[0, 0] for end in ends]
+    return int(changepoints[int(np.argmin(cost))])
+
+
+# Mean of every segment between the changepoints
+def segment_means(changes, changepoints):
+    y = np.asarray(changes, dtype=np.float64)
+    bounds = np.concatenate([[0], np.asarray(changepoints, dtype=np.int64) + 1, [len(y)]])
+    return np.array([np.nanmean(y[start:end]) for start, end in zip(bounds[:-1], bounds[1:])])
@@ -0,0 +1,255 @@
+import copy
+
+import numpy as np
+from pymc3.backends.base import BaseTrace, MultiTrace
+from pymc3.model import modelcontext
+
+# Draws kept per chain for the quantiles, the HDI and the trace plot
+RESERVOIR_DRAWS = 1000
+# Batch means kept per chain for the ESS. When they run full, neighbouring batches are merged and the
+# batch length doubles, so there are always between ESS_BATCHES / 2 and ESS_BATCHES of them.
+ESS_BATCHES = 64
+HDI_PROB = 0.94
+
+
+# Running mean and variance of arrays of one shape (Welford), one draw at a time
+class RunningMoments:
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.sum_sq = np.zeros(shape)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_sq += delta * (value - self.mean)
+
+    def variance(self):
+        return self.sum_sq / max(self.count - 1, 1)
+
+
+# Moments of the draws of several RunningMoments together (Chan et al.)
+def combine_moments(moments):
+    moments = [m for m in moments if m.count]
+    combined = RunningMoments(moments[0].mean.shape)
+    for m in moments:
+        count = combined.count + m.count
+        delta = m.mean - combined.mean
+        combined.mean = combined.mean + delta * m.count / count
+        combined.sum_sq = combined.sum_sq + m.sum_sq + delta * delta * combined.count * m.count / count
+        combined.count = count
+    return combined
+
+
+# Means of consecutive batches of draws, for the variance of a chain's mean under autocorrelation
+class BatchMeans:
+    def __init__(self, shape, batches=ESS_BATCHES):
+        self.sums = np.zeros((batches,) + shape)
+        self.length = 1
+        self.full = 0
+        self.current = np.zeros(shape)
+        self.in_current = 0
+
+    def add(self, value):
+        self.current += value
+        self.in_current += 1
+        if self.in_current < self.length:
+            return
+        self.sums[self.full] = self.current
+        self.full += 1
+        self.current = np.zeros_like(self.current)
+        self.in_current = 0
+        if self.full == len(self.sums):
+            half = len(self.sums) // 2
+            self.sums[:half] = self.sums[0::2] + self.sums[1::2]
+            self.sums[half:] = 0
+            self.full = half
+            self.length *= 2
+
+    def means(self):
+        return self.sums[:self.full] / self.length
+
+
+# Effective sample size by replicated batch means (Gong and Flegal 2016): the batch means of all chains are
+# taken around the overall mean, so chains that disagree lower the ESS, like in the rank-normalized ESS of
+# arviz. pooled holds the moments of all draws.
+def batch_means_ess(batches, pooled):
+    batches = [chain_batches for chain_batches in batches if chain_batches.full]
+    count = sum(chain_batches.full for chain_batches in batches)
+    if count < 2:
+        return np.full(pooled.mean.shape, np.nan)
+    squares = sum(chain_batches.length * ((chain_batches.means() - pooled.mean) ** 2).sum(axis=0)
+                  for chain_batches in batches)
+    mean_variance = squares / (count - 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(mean_variance > 0, pooled.count * pooled.variance() / mean_variance, float(pooled.count))
+
+
+# The statistics of one chain. The draws are split in halves for the split R-hat, and a reservoir sample
+# of the draws (Algorithm R) is kept, in draw order, for quantiles and plots.
+class ChainSummary:
+    def __init__(self, shapes, draws, reservoir_draws, rng):
+        self.half_length = max(draws // 2, 1)
+        self.halves = [{name: RunningMoments(shape) for name, shape in shapes.items()} for _ in range(2)]
+        self.batches = {name: BatchMeans(shape) for name, shape in shapes.items()}
+        self.reservoir = {name: np.empty((reservoir_draws,) + shape) for name, shape in shapes.items()}
+        self.positions = np.empty(reservoir_draws, dtype=np.int64)
+        self.rng = rng
+        self.count = 0
+        self.divergences = 0
+
+    def add(self, values):
+        half = self.halves[self.count >= self.half_length]
+        for name, value in values.items():
+            half[name].add(value)
+            self.batches[name].add(value)
+        slot = self.count if self.count < len(self.positions) else self.rng.integers(self.count + 1)
+        if slot < len(self.positions):
+            self.positions[slot] = self.count
+            for name, value in values.items():
+                self.reservoir[name][slot] = value
+        self.count += 1
+
+    def moments(self, name):
+        return combine_moments([half[name] for half in self.halves])
+
+    def draws(self, name):
+        kept = min(self.count, len(self.positions))
+        return self.reservoir[name][:kept][np.argsort(self.positions[:kept])]
+
+
+# Posterior statistics of a sampling run, gathered draw by draw by StreamingTrace without keeping the
+# draws: mean and sd (Welford), HDI from a reservoir sample of RESERVOIR_DRAWS per chain, the effective
+# sample size from batch means and the split R-hat from the moments of the chain halves.
+# Memory does not grow with the number of draws. draws is the number of draws per chain after tuning,
+# the variables and their shapes are those of the first draw added. With a writer (see trace_store.RunWriter)
+# every thin-th draw of every chain is also written to disk.
+class StreamingPosterior:
+    def __init__(self, draws, random_seed=None, reservoir_draws=RESERVOIR_DRAWS, writer=None, thin=1):
+        self.shapes = None
+        self.draws = draws
+        self.rng = np.random.default_rng(random_seed)
+        self.reservoir_draws = reservoir_draws
+        self.writer = writer
+        self.thin = thin
+        self.chains = {}
+
+    def chain(self, chain):
+        if chain not in self.chains:
+            self.chains[chain] = ChainSummary(self.shapes, self.draws, self.reservoir_draws, self.rng)
+        return self.chains[chain]
+
+    def add(self, chain, values, diverging=False):
+        if self.shapes is None:
+            self.shapes = {name: np.shape(value) for name, value in values.items()}
+        summary = self.chain(chain)
+        if self.writer is not None and summary.count % self.thin == 0:
+            self.writer.append(chain, values)
+        summary.add(values)
+        summary.divergences += bool(diverging)
+
+    @property
+    def divergences(self):
+        return sum(summary.divergences for summary in self.chains.values())
+
+    # Table like pm.summary(kind="stats") with ess and r_hat columns, one row per variable element
+    def summary(self, var_names=None, hdi_prob=HDI_PROB):
+        import pandas as pd
+
+        chains = [self.chains[chain] for chain in sorted(self.chains)]
+        tail = (1 - hdi_prob) / 2 * 100
+        columns = ["mean", "sd", f"hdi_{tail:g}%", f"hdi_{100 - tail:g}%", "ess", "r_hat"]
+        rows, index = [], []
+        for name in var_names or self.shapes:
+            moments = [summary.moments(name) for summary in chains]
+            pooled = combine_moments(moments)
+            lower, upper = hdi(np.concatenate([summary.draws(name) for summary in chains]), hdi_prob)
+            ess = batch_means_ess([summary.batches[name] for summary in chains], pooled)
+            r_hat = split_r_hat([half[name] for summary in chains for half in summary.halves])
+            statistics = [pooled.mean, np.sqrt(pooled.variance()), lower, upper, ess, r_hat]
+            for position in np.ndindex(self.shapes[name]):
+                index.append(element_name(name, position))
+                rows.append([float(statistic[position]) for statistic in statistics])
+        return pd.DataFrame(rows, index=index, columns=columns)
+
+    # The reservoir draws as InferenceData, for plots
+    def inference_data(self, var_names=None):
+        import arviz as az
+
+        chains = [self.chains[chain] for chain in sorted(self.chains)]
+        kept = min(summary.count for summary in chains)
+        return az.from_dict(posterior={name: np.stack([summary.draws(name)[:kept] for summary in chains])
+                                       for name in var_names or self.shapes})
+
+
+def element_name(name, position):
+    return f"{name}[{', '.join(map(str, position))}]" if position else name
+
+
+# Highest density interval of the draws along the first axis, the narrowest interval holding prob of them
+def hdi(draws, prob=HDI_PROB):
+    ordered = np.sort(draws, axis=0)
+    inside = int(np.floor(prob * len(ordered)))
+    widths = ordered[inside:] - ordered[:len(ordered) - inside]
+    start = np.expand_dims(np.argmin(widths, axis=0), 0)
+    return np.take_along_axis(ordered, start, 0)[0], np.take_along_axis(ordered, start + inside, 0)[0]
+
+
+# Split R-hat (Gelman et al.) from the moments of the chain halves
+def split_r_hat(halves):
+    halves = [half for half in halves if half.count > 1]
+    if len(halves) < 2:
+        return np.full(np.shape(halves[0].mean) if halves else (), np.nan)
+    length = np.mean([half.count for half in halves])
+    within = np.mean([half.variance() for half in halves], axis=0)
+    between = np.var([half.mean for half in halves], axis=0, ddof=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(((length - 1) / length * within + between) / within)
+
+
+# pymc3 trace backend that passes the draws after tuning to a StreamingPosterior instead of storing them.
+# Sampler statistics are not stored either: pm.sample sees a backend without them, divergences are counted.
+# derived(values) may add variables computed from every draw, like the changepoint of the marginalized model.
+class StreamingTrace(BaseTrace):
+    supports_sampler_stats = True
+
+    def __init__(self, posterior, chain, tune, var_names, derived=None, model=None):
+        model = modelcontext(model)
+        super().__init__("streaming", model, [model[name] for name in var_names if name in model.named_vars])
+        self.posterior = posterior
+        self.chain = chain
+        self.tune = tune
+        self.derived = derived
+        self.recorded = 0
+        self.discarded = 0
+
+    def setup(self, draws, chain, sampler_vars=None):
+        super().setup(draws, chain)
+        self.chain = chain
+
+    def record(self, point, sampler_stats=None):
+        self.recorded += 1
+        if self.recorded <= self.tune:
+            return
+        values = dict(zip(self.varnames, self.fn(point)))
+        if self.derived is not None:
+            values.update(self.derived(values))
+        self.posterior.add(self.chain, values, any(stats.get("diverging") for stats in sampler_stats or []))
+
+    def __len__(self):
+        return self.recorded - self.discarded
+
+    # pm.sample drops the tuning draws by slicing, they were never kept
+    def _slice(self, idx):
+        sliced = copy.copy(self)
+        sliced.discarded = self.discarded + (idx.start or 0)
+        return sliced
+
+    def get_values(self, varname, burn=0, thin=1):
+        raise ValueError("a streaming trace keeps no draws, see StreamingPosterior")
+
+
+# The trace argument of pm.sample for a streaming run of the model: one StreamingTrace per chain
+def streaming_traces(model, posterior, chains, tune, var_names, derived=None):
+    return MultiTrace([StreamingTrace(posterior, chain, tune, var_names, derived, model) for chain in range(chains)])
@@ -0,0 +1,209 @@
+import datetime
+import json
+import os
+import re
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_TRACE_DIR = Path(__file__).parent.parent / "traces"
+# draws per chunk on disk. A read of some draws only decompresses the chunks holding them.
+DRAW_CHUNK = 256
+COMPRESSION_LEVEL = 4
+
+
+# Posterior traces of model runs, one compressed NetCDF file per run with the InferenceData groups,
+# and a json file next to it with the run metadata (model, region, window, seed, timings, ...).
+# Listing runs only reads the json files. Reads open the NetCDF file lazily and load only the
+# variables, chains and draws that are selected.
+class TraceStore:
+    def __init__(self, root=DEFAULT_TRACE_DIR):
+        self.root = Path(root)
+
+    def trace_path(self, run_id):
+        return self.root / f"{run_id}.nc"
+
+    def metadata_path(self, run_id):
+        return self.root / f"{run_id}.json"
+
+    # Saves an InferenceData and returns the id of the run. Files are written under temporary names
+    # and renamed, so runs saved from many processes at once never show up half written.
+    def save(self, inference_data, metadata):
+        self.root.mkdir(parents=True, exist_ok=True)
+        run_id = new_run_id(metadata)
+        metadata = dict(metadata, run_id=run_id, created=datetime.datetime.now().isoformat(timespec="seconds"),
+                        groups=list(inference_data.groups()),
+                        variables=list(inference_data.posterior.data_vars))
+
+        temporary = self.root / f".{run_id}.nc.tmp"
+        mode = "w"
+        for group in inference_data.groups():
+            dataset = getattr(inference_data, group)
+            dataset.to_netcdf(temporary, mode=mode, group=group, engine="netcdf4",
+                              encoding={name: chunked_encoding(variable) for name, variable in dataset.data_vars.items()})
+            mode = "a"
+        os.replace(temporary, self.trace_path(run_id))
+        self.write_metadata(run_id, metadata)
+        return run_id
+
+    def write_metadata(self, run_id, metadata):
+        temporary = self.root / f".{run_id}.json.tmp"
+        with open(temporary, "w") as metadata_file:
+            json.dump(metadata, metadata_file, indent=1, default=str)
+        os.replace(temporary, self.metadata_path(run_id))
+
+    # RunWriter for a run whose draws are saved while they are sampled, see streaming.py
+    def writer(self, metadata, chains):
+        return RunWriter(self, metadata, chains)
+
+    # Metadata of the saved runs, oldest first. Keyword arguments select runs by metadata value,
+    # for example runs(model="breakpoint", region="Stavanger").
+    def runs(self, **selection):
+        runs = []
+        for metadata_path in self.root.glob("*.json"):
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+            if all(metadata.get(key) == value for key, value in selection.items()):
+                runs.append(metadata)
+        return sorted(runs, key=lambda metadata: (metadata["created"], metadata["run_id"]))
+
+    def metadata(self, run_id):
+        with open(self.metadata_path(run_id)) as metadata_file:
+            return json.load(metadata_file)
+
+    # Lazy xarray Dataset of one group, restricted to var_names, chains and draws (a slice, a list of
+    # positions or a number of draws from the start). Values are read from disk when they are used.
+    def open_group(self, run_id, group="posterior", var_names=None, chains=None, draws=None):
+        import xarray as xr
+
+        dataset = xr.open_dataset(self.trace_path(run_id), group=group, engine="netcdf4")
+        if var_names is not None:
+            dataset = dataset[list(var_names)]
+        selection = {}
+        if chains is not None and "chain" in dataset.dims:
+            selection["chain"] = chains
+        if draws is not None and "draw" in dataset.dims:
+            selection["draw"] = slice(0, draws) if isinstance(draws, int) else draws
+        return dataset.isel(selection)
+
+    # InferenceData with the selected part of the posterior, and of the sample stats when include_stats is set.
+    def open(self, run_id, var_names=None, chains=None, draws=None, include_stats=False):
+        import arviz as az
+
+        groups = {"posterior": self.open_group(run_id, "posterior", var_names, chains, draws)}
+        if include_stats:
+            groups["sample_stats"] = self.open_group(run_id, "sample_stats", None, chains, draws)
+        return az.InferenceData(**groups)
+
+    def summary(self, run_id, var_names=None, chains=None, draws=None, kind="stats"):
+        import arviz as az
+
+        return az.summary(self.open(run_id, var_names, chains, draws), kind=kind, round_to="none")
+
+    def delete(self, run_id):
+        self.trace_path(run_id).unlink(missing_ok=True)
+        self.metadata_path(run_id).unlink(missing_ok=True)
+
+
+# Writes the posterior of a run draw by draw, for samplers that do not keep their draws in memory.
+# The draw dimension of the NetCDF file is unlimited and every chain's draws are buffered and written
+# DRAW_CHUNK at a time, in the same layout and chunks as TraceStore.save. The variables are those of the
+# first draw appended. Like save, the run only shows up in the store when it is complete, after close.
+class RunWriter:
+    def __init__(self, store, metadata, chains):
+        import netCDF4
+
+        store.root.mkdir(parents=True, exist_ok=True)
+        self.store = store
+        self.run_id = new_run_id(metadata)
+        self.metadata = metadata
+        self.temporary = store.root / f".{self.run_id}.nc.tmp"
+        self.file = netCDF4.Dataset(self.temporary, "w")
+        self.posterior = self.file.createGroup("posterior")
+        self.posterior.createDimension("chain", chains)
+        self.posterior.createDimension("draw", None)
+        self.buffers = {chain: [] for chain in range(chains)}
+        self.written = {chain: 0 for chain in range(chains)}
+
+    def create_variables(self, values):
+        for name, value in values.items():
+            shape = list(np.shape(value))
+            dims = [f"{name}_dim_{axis}" for axis in range(len(shape))]
+            for dim, size in zip(dims, shape):
+                self.posterior.createDimension(dim, size)
+            self.posterior.createVariable(name, "f8", ["chain", "draw"] + dims, zlib=True,
+                                          complevel=COMPRESSION_LEVEL, chunksizes=[1, DRAW_CHUNK] + shape)
+
+    def append(self, chain, values):
+        if not self.posterior.variables:
+            self.create_variables(values)
+        self.buffers[chain].append(values)
+        if len(self.buffers[chain]) == DRAW_CHUNK:
+            self.flush(chain)
+
+    def flush(self, chain):
+        buffer = self.buffers[chain]
+        if not buffer:
+            return
+        start = self.written[chain]
+        for name, variable in self.posterior.variables.items():
+            variable[chain, start:start + len(buffer)] = np.stack([values[name] for values in buffer])
+        self.written[chain] += len(buffer)
+        self.buffers[chain] = []
+
+    # Writes the rest of the draws and the metadata, with the metadata given here added. Returns the run id.
+    def close(self, **metadata):
+        for chain in self.buffers:
+            self.flush(chain)
+        variables = list(self.posterior.variables)
+        self.file.close()
+        os.replace(self.temporary, self.store.trace_path(self.run_id))
+        self.store.write_metadata(self.run_id, dict(
+            self.metadata, **metadata, run_id=self.run_id,
+            created=datetime.datetime.now().isoformat(timespec="seconds"), groups=["posterior"], variables=variables,
+            draws_saved=min(self.written.values())))
+        return self.run_id
+
+    # Drops the run, after a failed sampling
+    def discard(self):
+        self.file.close()
+        self.temporary.unlink(missing_ok=True)
+
+
+# Chunks of one chain and DRAW_CHUNK draws, whole along the other dimensions.
+def chunked_encoding(variable):
+    encoding = {"zlib": True, "complevel": COMPRESSION_LEVEL}
+    if variable.dtype.kind in "fiub" and "draw" in variable.dims:
+        encoding["chunksizes"] = tuple(1 if dim == "chain" else min(size, DRAW_CHUNK) if dim == "draw" else size
+                                       for dim, size in zip(variable.dims, variable.shape))
+    return encoding
+
+
+# model-region-time-random, readable in a directory listing and unique across processes
+def new_run_id(metadata):
+    parts = [metadata.get("model", "run"), metadata.get("region")]
+    if metadata.get("window_end") is not None:
+        parts.append(f"window-{metadata['window_end']}")
+    parts.append(datetime.datetime.now().strftime("%Y%m%dT%H%M%S"))
+    parts.append(uuid.uuid4().hex[:8])
+    return "-".join(re.sub(r"[^A-Za-z0-9_.]+", "_", str(part)) for part in parts if part is not None)
+
+
+# Saves a run to the store when there is one, see the trace_store arguments of run_model, batch and rolling.
+# store is a TraceStore or the path of its directory.
+def save_run(store, inference_data, metadata):
+    if store is None:
+        return None
+    if not isinstance(store, TraceStore):
+        store = TraceStore(store)
+    return store.save(inference_data, metadata)
+
+
+# RunWriter of a run in the store when there is one, like save_run
+def run_writer(store, metadata, chains):
+    if store is None:
+        return None
+    if not isinstance(store, TraceStore):
+        store = TraceStore(store)
+    return store.writer(metadata, chains)
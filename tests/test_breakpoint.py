@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from Sandbox.comparison import segment_log_evidence
+from Sandbox.run_model import BREAKPOINT_PRIORS, breakpoint_posterior, changepoint_log_likelihood, \
+    changepoint_statistics, sample_model
+
+SEED = [8927, 8928]
+PRIOR_LOCATION = 30
+
+
+def relative_changes(seed=4521, length=60, changepoint=29):
+    rng = np.random.default_rng(seed)
+    return np.where(np.arange(length) <= changepoint, 0.3, -0.2) + rng.standard_normal(length)
+
+
+# The likelihood of every candidate changepoint k, observations 0..k early and the rest late, one at a time
+def test_changepoint_log_likelihood():
+    y = relative_changes()
+    statistics = changepoint_statistics(y, PRIOR_LOCATION)
+    early, late = 0.25, -0.1
+    expected = [stats.norm.logpdf(y, np.where(np.arange(len(y)) <= k, early, late)).sum()
+                for k in statistics["candidates"]]
+    np.testing.assert_allclose(changepoint_log_likelihood(statistics, early, late), expected, rtol=1e-10)
+
+    draws = np.array([[0.1], [0.3]])
+    likelihood = changepoint_log_likelihood(statistics, draws, -draws)
+    assert likelihood.shape == (2, len(y) + 1)
+    np.testing.assert_allclose(likelihood[1], changepoint_log_likelihood(statistics, 0.3, -0.3), rtol=1e-10)
+
+
+def test_changepoint_prior():
+    statistics = changepoint_statistics(relative_changes(), PRIOR_LOCATION)
+    assert np.exp(statistics["log_prior"]).sum() == pytest.approx(1.0)
+    assert statistics["candidates"][np.argmax(statistics["log_prior"])] == PRIOR_LOCATION
+
+
+# The posterior of the trends and the changepoint, exact by summing over the changepoint: given the changepoint
+# the segments are conjugate Normal models
+def exact_posterior(y, prior_location):
+    statistics = changepoint_statistics(y, prior_location)
+    log_posterior = statistics["log_prior"].copy()
+    moments = {}
+    for name, segment in (("early_trend", "early"), ("late_trend", "late")):
+        prior_mean, prior_sd = BREAKPOINT_PRIORS[name]
+        count, total = statistics[f"count_{segment}"], statistics[f"sum_{segment}"]
+        log_posterior += segment_log_evidence(count, total, statistics[f"sum_sq_{segment}"], prior_mean, prior_sd)
+        precision = 1 / prior_sd ** 2 + count
+        moments[name] = ((prior_mean / prior_sd ** 2 + total) / precision, 1 / precision)
+    probability = np.exp(log_posterior - np.logaddexp.reduce(log_posterior))
+
+    changepoint_mean = probability @ statistics["candidates"]
+    result = {"changepoint": (changepoint_mean, probability @ statistics["candidates"] ** 2 - changepoint_mean ** 2)}
+    for name, (mean, variance) in moments.items():
+        posterior_mean = probability @ mean
+        result[name] = (posterior_mean, probability @ (variance + mean ** 2) - posterior_mean ** 2)
+    return result
+
+
+# NUTS on the marginalized model, with changepoints drawn from their conditional, recovers the exact posterior
+def test_marginalized_posterior_matches_exact():
+    pytest.importorskip("pymc3")
+    import arviz as az
+
+    y = relative_changes()
+    _, trace = sample_model("marginalized_breakpoint", changepoint_statistics(y, PRIOR_LOCATION), draws=1000,
+                            tune=1000, chains=2, cores=1, random_seed=SEED, progressbar=False,
+                            compute_convergence_checks=False)
+    posterior = breakpoint_posterior(trace, y, SEED, PRIOR_LOCATION)
+    summary = az.summary(posterior, kind="all", round_to="none")
+    for name, (mean, variance) in exact_posterior(y, PRIOR_LOCATION).items():
+        assert abs(summary.loc[name, "mean"] - mean) < 5 * summary.loc[name, "mcse_mean"], name
+        assert summary.loc[name, "sd"] == pytest.approx(np.sqrt(variance), rel=0.15), name
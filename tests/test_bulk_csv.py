@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from Sandbox import bulk_csv
+
+
+def write_csv(tmp_path, text, encoding="utf-8"):
+    path = tmp_path / "extract.csv"
+    path.write_text(text, encoding=encoding)
+    return path
+
+
+def test_decimal_commas_and_quoted_fields(tmp_path):
+    path = write_csv(tmp_path, 'region;kvartal;indeks\n'
+                               '"Oslo; med Bærum";2020K1;"118,8"\n'
+                               '"Tromsø";2020K2;-0,5\n')
+    names, quarters, values = bulk_csv.read_columns(path, [0, 1, 2], ["text", "quarter", "decimal"])
+    np.testing.assert_array_equal(names, ["Oslo; med Bærum", "Tromsø"])
+    np.testing.assert_array_equal(quarters, np.array(["2020-01-01", "2020-04-01"], dtype='datetime64[D]'))
+    np.testing.assert_array_equal(values, [118.8, -0.5])
+
+
+def test_byte_order_mark(tmp_path):
+    path = write_csv(tmp_path, "dato;rente\n01.02.2021;1,25\n", encoding="utf-8-sig")
+    dates, rates = bulk_csv.read_columns(path, [0, 1], ["date", "decimal"])
+    np.testing.assert_array_equal(dates, np.array(["2021-02-01"], dtype='datetime64[D]'))
+    np.testing.assert_array_equal(rates, [1.25])
+
+    # without a header the mark would otherwise end up in the first date
+    path = write_csv(tmp_path, "01.02.2021;1,25\n", encoding="utf-8-sig")
+    dates, _ = bulk_csv.read_columns(path, [0, 1], ["date", "decimal"], header=False)
+    np.testing.assert_array_equal(dates, np.array(["2021-02-01"], dtype='datetime64[D]'))
+
+
+def test_quarters():
+    quarters = bulk_csv.parse_quarters(["1992K1", "1992K3", "2021K4"])
+    np.testing.assert_array_equal(quarters, np.array(["1992-01-01", "1992-07-01", "2021-10-01"],
+                                                     dtype='datetime64[D]'))
+
+
+@pytest.mark.parametrize("cell", ["1992K5", "1992K0", "1992Q3", "92K3", "1992K31"])
+def test_invalid_quarters(cell):
+    with pytest.raises(ValueError, match=cell):
+        bulk_csv.parse_quarters(["1992K1", cell])
+
+
+def test_dates():
+    dates = bulk_csv.parse_dates(["21.01.2021", "29.02.2020", "31.12.1999"])
+    np.testing.assert_array_equal(dates, np.array(["2021-01-21", "2020-02-29", "1999-12-31"],
+                                                  dtype='datetime64[D]'))
+
+
+@pytest.mark.parametrize("cell", ["29.02.2021", "31.04.2020", "00.01.2020", "01.13.2020", "1.1.2020", "2020-01-01"])
+def test_invalid_dates(cell):
+    with pytest.raises(ValueError, match=cell):
+        bulk_csv.parse_dates(["21.01.2021", cell])
+
+
+def test_invalid_decimal():
+    with pytest.raises(ValueError):
+        bulk_csv.parse_decimals(["1,5", ""])
+
+
+def test_short_rows_skipped(tmp_path):
+    path = write_csv(tmp_path, "år;lønn;x;inflasjon\n2019;100,5;;2,2\n2020;103\n\n2021;106,5;;3,5\n")
+    years, wages, inflation = bulk_csv.read_columns(path, [0, 1, 3], ["integer", "decimal", "decimal"])
+    np.testing.assert_array_equal(years, [2019, 2021])
+    np.testing.assert_array_equal(wages, [100.5, 106.5])
+    np.testing.assert_array_equal(inflation, [2.2, 3.5])
+
+
+def test_empty_file(tmp_path):
+    path = write_csv(tmp_path, "dato;rente\n")
+    dates, rates = bulk_csv.read_columns(path, [0, 1], ["date", "decimal"])
+    assert dates.dtype == np.dtype('datetime64[D]') and len(dates) == 0
+    assert rates.dtype == np.float64 and len(rates) == 0
+
+
+# Chunk boundaries, including ones falling on skipped rows, do not change the result
+@pytest.mark.parametrize("chunk_rows", [1, 2, 3, 1000])
+def test_chunked_reads(tmp_path, chunk_rows):
+    lines = [f"{day:02d}.03.2020;{day},5" if day % 4 else "short" for day in range(1, 29)]
+    path = write_csv(tmp_path, "dato;verdi\n" + "\n".join(lines) + "\n")
+    dates, values = bulk_csv.read_columns(path, [0, 1], ["date", "decimal"], chunk_rows=chunk_rows)
+    days = np.array([day for day in range(1, 29) if day % 4])
+    np.testing.assert_array_equal(dates, np.datetime64("2020-03-01") + (days - 1))
+    np.testing.assert_array_equal(values, days + 0.5)
+
+    chunks = list(bulk_csv.read_column_chunks(path, [0, 1], ["date", "decimal"], chunk_rows=chunk_rows))
+    assert len(chunks) == -(-len(lines) // chunk_rows)
+
+
+def test_one_kind_per_column(tmp_path):
+    path = write_csv(tmp_path, "dato;rente\n01.02.2021;1,25\n")
+    with pytest.raises(ValueError):
+        bulk_csv.read_columns(path, [0, 1], ["date"])
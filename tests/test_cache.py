@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from Sandbox.cache import LoaderCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.csv"
+    path.write_text("a;1\n")
+    return path
+
+
+def counting_loader(value="loaded"):
+    calls = []
+
+    def load():
+        calls.append(value)
+        return value
+
+    return load, calls
+
+
+def test_hit_after_miss(source):
+    cache = LoaderCache()
+    load, calls = counting_loader()
+    assert cache.get_or_load("series", [source], (2005,), load) == "loaded"
+    assert cache.get_or_load("series", [source], (2005,), load) == "loaded"
+    assert calls == ["loaded"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_parameters_and_kind_are_part_of_the_key(source):
+    cache = LoaderCache()
+    load, calls = counting_loader()
+    cache.get_or_load("series", [source], (2005,), load)
+    cache.get_or_load("series", [source], (2006,), load)
+    cache.get_or_load("other", [source], (2005,), load)
+    assert len(calls) == 3
+
+
+# Least recently used entries are dropped first, a hit counts as a use
+def test_least_recently_used_entry_is_evicted(source):
+    cache = LoaderCache(max_entries=2)
+    load, calls = counting_loader()
+    cache.get_or_load("series", [source], (1,), load)
+    cache.get_or_load("series", [source], (2,), load)
+    cache.get_or_load("series", [source], (1,), load)
+    cache.get_or_load("series", [source], (3,), load)
+    assert len(cache.entries) == 2
+    assert len(calls) == 3
+
+    cache.get_or_load("series", [source], (1,), load)
+    assert len(calls) == 3
+    cache.get_or_load("series", [source], (2,), load)
+    assert len(calls) == 4
+
+
+def test_modified_file_is_loaded_again(source):
+    cache = LoaderCache()
+    load, calls = counting_loader()
+    cache.get_or_load("series", [source], (), load)
+
+    source.write_text("a;2\n")
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    cache.get_or_load("series", [source], (), load)
+    assert len(calls) == 2
+    cache.get_or_load("series", [source], (), load)
+    assert len(calls) == 2
+
+
+def test_invalidate_file(source, tmp_path):
+    other = tmp_path / "other.csv"
+    other.write_text("b;1\n")
+    cache = LoaderCache()
+    load, calls = counting_loader()
+    cache.get_or_load("series", [source], (), load)
+    cache.get_or_load("series", [other], (), load)
+    cache.get_or_load("combined", [source, other], (), load)
+
+    cache.invalidate(source)
+    assert len(cache.entries) == 1
+    cache.get_or_load("series", [other], (), load)
+    assert len(calls) == 3
+
+    cache.invalidate()
+    assert len(cache.entries) == 0
+
+
+def test_file_reads(source):
+    cache = LoaderCache()
+    cache.record_file_read(source)
+    cache.record_file_read(source)
+    assert cache.stats()["file_reads"] == {str(source): 2}
+    cache.reset_stats()
+    assert cache.stats() == {"hits": 0, "misses": 0, "entries": 0, "file_reads": {}}
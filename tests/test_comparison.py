@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from Sandbox import comparison
+from Sandbox.run_model import BREAKPOINT_SCALING_FACTOR, PRICE_TREND_PRIORS
+
+pytest.importorskip("arviz")
+
+SEED = 8927
+
+
+# Monthly price changes, unscaled like compare_models takes them, with unit noise on the scaled changes
+def simulated_changes(rng, scaled_mean):
+    return (scaled_mean + rng.standard_normal(len(scaled_mean))) / BREAKPOINT_SCALING_FACTOR
+
+
+def wage_changes(rng, months=240):
+    return rng.normal(0.003, 0.03, months)
+
+
+# Exact leave-one-out predictive density of the trend model, y_i ~ N(beta * scaling factor, 1)
+def exact_trend_loo(changes):
+    y = changes * BREAKPOINT_SCALING_FACTOR
+    prior_mean, prior_sd = PRICE_TREND_PRIORS["beta"]
+    x = BREAKPOINT_SCALING_FACTOR
+    precision = 1 / prior_sd ** 2 + x * x * (len(y) - 1)
+    mean = (prior_mean / prior_sd ** 2 + x * (y.sum() - y)) / precision
+    variance = 1 + x * x / precision
+    return (-0.5 * (y - x * mean) ** 2 / variance - 0.5 * np.log(2 * np.pi * variance)).sum()
+
+
+@pytest.mark.parametrize("family, scaled_mean", [
+    ("breakpoint", np.where(np.arange(240) <= 99, 0.4, -0.3)),
+    ("wage_correlation", None),
+])
+def test_generating_family_ranks_first(family, scaled_mean):
+    rng = np.random.default_rng(SEED)
+    wages = wage_changes(rng)
+    if scaled_mean is None:
+        scaled_mean = 3.7 * BREAKPOINT_SCALING_FACTOR * wages
+    table, fits = comparison.compare_models(simulated_changes(rng, scaled_mean), wages, random_seed=SEED)
+    assert table.index[0] == family
+    assert table.loc[family, "rank"] == 0 and table.loc[family, "elpd_diff"] == 0
+    assert table["weight"].sum() == pytest.approx(1.0)
+    assert (table.loc[table.index[1:], "elpd_diff"] > 2 * table.loc[table.index[1:], "dse"]).all()
+    # observations next to the changepoint move its posterior, so only the linear models have no high Pareto k
+    assert (table.loc[["trend", "wage_correlation"], "high_pareto_k"] == 0).all()
+    assert set(fits) == set(comparison.MODEL_FAMILIES)
+
+
+# On a series without a trend change the models that can describe it are within their standard errors,
+# and the PPC p-values of the generating family are not extreme
+def test_trend_series():
+    rng = np.random.default_rng(SEED)
+    changes = simulated_changes(rng, np.full(240, 0.1))
+    table, _ = comparison.compare_models(changes, wage_changes(rng), random_seed=SEED)
+    assert table.loc["trend", "elpd_diff"] < 2 * table.loc["trend", "dse"] + 1
+    assert table.loc["trend", "p_loo"] == pytest.approx(1.0, abs=0.2)
+    for name in comparison.PPC_STATISTICS:
+        assert 0.025 < table.loc["trend", f"ppc_{name}"] < 0.975
+
+
+def test_psis_loo_matches_exact_loo():
+    rng = np.random.default_rng(SEED)
+    changes = simulated_changes(rng, np.full(240, 0.1))
+    table, _ = comparison.compare_models(changes, wage_changes(rng), random_seed=SEED, families=["trend"])
+    assert table.loc["trend", "elpd_loo"] == pytest.approx(exact_trend_loo(changes), abs=0.05)
+
+
+def test_unknown_family():
+    with pytest.raises(ValueError):
+        comparison.compare_models(np.zeros(10), np.zeros(10), families=["random_walk"])
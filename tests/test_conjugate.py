@@ -0,0 +1,33 @@
+import pytest
+
+from Sandbox.conjugate import compare_with_sampling
+from Sandbox.load_data import load_national_prices, load_wage_growth
+
+pytest.importorskip("pymc3")
+
+SEED = 8927
+DRAWS = 1000
+# largest difference of the sampled means to the analytic ones, and of the sds, in analytic sds
+MEAN_TOLERANCE = 0.15
+SD_TOLERANCE = 0.1
+
+
+@pytest.fixture(scope="module")
+def prices():
+    return load_national_prices(1992)
+
+
+def test_price_trend_matches_nuts(prices):
+    analytic, sampled, mean_error, sd_error = compare_with_sampling(prices, draws=DRAWS, random_seed=SEED)
+    assert list(sampled.index) == list(analytic.index) == ["beta"]
+    assert mean_error < MEAN_TOLERANCE
+    assert sd_error < SD_TOLERANCE
+
+
+def test_wage_correlation_matches_nuts(prices):
+    wages = load_wage_growth(1992)
+    analytic, sampled, mean_error, sd_error = compare_with_sampling(prices, wages, draws=DRAWS, random_seed=SEED)
+    assert list(sampled.index) == list(analytic.index) == ["intercept", "beta"]
+    assert mean_error < MEAN_TOLERANCE
+    assert sd_error < SD_TOLERANCE
+
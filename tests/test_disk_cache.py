@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+from Sandbox import disk_cache
+from Sandbox.RegionCollection import RegionCollection
+from Sandbox.RegionPrices import RegionPrices
+from Sandbox.TimeSeries import TimeSeries
+from Sandbox.disk_cache import DiskCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.csv"
+    path.write_text("a;1\n")
+    return path
+
+
+def series(first_value=1.0):
+    dates = np.datetime64("2020-01-01") + np.arange(3)
+    return TimeSeries(dates, first_value + np.arange(3.0))
+
+
+def counting_loader(value):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return value
+
+    return load, calls
+
+
+def test_entry_is_reused_by_a_new_process(source, tmp_path):
+    load, calls = counting_loader(series())
+    DiskCache(tmp_path / "cache").get_or_load("series", [source], (2005,), load)
+
+    cache = DiskCache(tmp_path / "cache")
+    stored = cache.get_or_load("series", [source], (2005,), load)
+    assert len(calls) == 1 and cache.stats()["hits"] == 1
+    assert not stored.values.flags.owndata
+    np.testing.assert_array_equal(stored.dates, series().dates)
+    np.testing.assert_array_equal(stored.values, series().values)
+
+
+def test_parameters_are_part_of_the_key(source, tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    load, calls = counting_loader(series())
+    cache.get_or_load("series", [source], (2005,), load)
+    cache.get_or_load("series", [source], (2006,), load)
+    assert len(calls) == 2
+
+
+# The key hashes the file contents: touching a file keeps its entry, changing it does not
+def test_key_follows_file_contents(source, tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    key = cache.key("series", [source], ())
+
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert DiskCache(tmp_path / "cache").key("series", [source], ()) == key
+
+    source.write_text("a;2\n")
+    assert DiskCache(tmp_path / "cache").key("series", [source], ()) != key
+    source.write_text("a;1\n")
+    assert DiskCache(tmp_path / "cache").key("series", [source], ()) == key
+
+
+def test_format_version_is_part_of_the_key(source, tmp_path, monkeypatch):
+    key = DiskCache(tmp_path / "cache").key("series", [source], ())
+    monkeypatch.setattr(disk_cache, "FORMAT_VERSION", disk_cache.FORMAT_VERSION + 1)
+    assert DiskCache(tmp_path / "cache").key("series", [source], ()) != key
+
+
+def test_regions_round_trip(source, tmp_path):
+    regions = RegionCollection([RegionPrices("Oslo", series(1.0), 2003), RegionPrices("Bergen", series(5.0)[1:], 2005)])
+    load, calls = counting_loader(regions)
+    DiskCache(tmp_path / "cache").get_or_load("regions", [source], (), load)
+
+    stored = DiskCache(tmp_path / "cache").get_or_load("regions", [source], (), load)
+    assert len(calls) == 1
+    assert stored.regions() == ["Oslo", "Bergen"]
+    for expected, region in zip(regions, stored):
+        assert region.start_year == expected.start_year
+        np.testing.assert_array_equal(region.prices.dates, expected.prices.dates)
+        np.testing.assert_array_equal(region.prices.values, expected.prices.values)
+
+
+def test_unsupported_value(source, tmp_path):
+    load, _ = counting_loader([1, 2, 3])
+    with pytest.raises(TypeError):
+        DiskCache(tmp_path / "cache").get_or_load("list", [source], (), load)
+    assert not [p for p in (tmp_path / "cache").iterdir() if not p.name.startswith(".tmp-")]
+
+
+def test_disabled_cache_always_loads(source, monkeypatch):
+    monkeypatch.setattr(disk_cache, "active_cache", None)
+    load, calls = counting_loader(series())
+    disk_cache.get_or_load("series", [source], (), load)
+    disk_cache.get_or_load("series", [source], (), load)
+    assert len(calls) == 2
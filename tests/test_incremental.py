@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from Sandbox.incremental import CsvTail, IncrementalNationalSeries
+from Sandbox.load_data import INTEREST_RATE_FILE, NATIONAL_MONTHLY_INDEX_FILE, WAGE_FILE, \
+    load_cost_factor_of_purchase, load_interest_rate, load_national_prices, load_rows, load_wage_growth, parse_date
+
+MIN_YEAR = 2005
+SERIES = ["index", "inflation", "wage", "interest", "prices", "wage_growth", "cost_factor", "total_cost",
+          "total_cost_to_wage"]
+
+
+def index_rows():
+    return load_rows(NATIONAL_MONTHLY_INDEX_FILE)
+
+
+def yearly_rows():
+    return load_rows(WAGE_FILE)
+
+
+def interest_rows():
+    rows = [row for row in load_rows(INTEREST_RATE_FILE) if len(row) > 1]
+    return sorted(rows, key=lambda row: parse_date(row[0]))
+
+
+def assert_same_series(actual, expected):
+    np.testing.assert_array_equal(actual.dates, expected.dates)
+    np.testing.assert_array_equal(actual.values, expected.values)
+
+
+def test_matches_full_rebuild():
+    series = IncrementalNationalSeries.from_files(MIN_YEAR)
+    prices = load_national_prices(MIN_YEAR, None)
+    wage_growth = load_wage_growth(MIN_YEAR, None)
+    cost_factor = load_cost_factor_of_purchase(MIN_YEAR, None)
+    assert_same_series(series["prices"], prices)
+    assert_same_series(series["wage_growth"], wage_growth)
+    assert_same_series(series["cost_factor"], cost_factor)
+    assert_same_series(series["interest"], load_interest_rate(MIN_YEAR, None))
+
+    total_cost = prices.multiply(cost_factor)
+    assert_same_series(series["total_cost"], total_cost)
+    assert_same_series(series["total_cost_to_wage"], total_cost.divide(wage_growth))
+
+
+# Rows arriving a few at a time, with some of them sent twice, end in the same series as all of them at once
+def test_appending_in_pieces():
+    expected = IncrementalNationalSeries.from_files(MIN_YEAR)
+    series = IncrementalNationalSeries(MIN_YEAR)
+    index, yearly, interest = index_rows(), yearly_rows(), interest_rows()
+
+    series.append_yearly_rows(yearly[:-3])
+    series.append_interest_rows(interest[:len(interest) // 2])
+    series.append_index_rows(index[:100])
+    series.append_index_rows(index[50:150])
+    series.append_interest_rows(interest[len(interest) // 2:])
+    series.append_yearly_rows(yearly[-5:])
+    series.append_index_rows(index[150:])
+
+    for name in SERIES:
+        assert_same_series(series[name], expected[name])
+
+
+def test_changed_positions():
+    series = IncrementalNationalSeries(MIN_YEAR)
+    index, yearly = index_rows(), yearly_rows()
+    series.append_yearly_rows(yearly)
+    series.append_index_rows(index[:-1])
+    months = len(series["index"])
+
+    # the index goes on after the last year of inflation, so P, K and K/L stay as they are
+    assert months > len(series["inflation"])
+    assert series.append_index_rows(index[-1:]) == {"index": months}
+    assert series.append_index_rows(index) == {}
+    assert series.append_yearly_rows(yearly) == {}
+
+
+# A new announcement sets the rate from its month on, the months up to it keep the last rate
+def test_new_interest_announcement():
+    series = IncrementalNationalSeries.from_files(MIN_YEAR)
+    before = series["interest"].values.copy()
+    next_month = (series["interest"].dates[-1].astype('datetime64[M]') + 2).astype('datetime64[D]')
+
+    changed = series.append_interest_rows([[next_month.item().strftime("%d.%m.%Y"), "9,5"]])
+    assert changed == {"interest": len(before), "cost_factor": len(before)}
+    np.testing.assert_array_equal(series["interest"].values, np.append(before, [before[-1], 9.5]))
+    assert len(series["cost_factor"]) == len(before) + 2
+
+
+def test_rejects_gaps_and_old_announcements():
+    series = IncrementalNationalSeries.from_files(MIN_YEAR)
+    with pytest.raises(ValueError):
+        series.append_yearly_rows([[str(series.last_year + 2), "1", "1", "1"]])
+    with pytest.raises(ValueError):
+        series.append_interest_rows([["01.01.2010", "1"]])
+
+
+def test_csv_tail(tmp_path):
+    path = tmp_path / "index.csv"
+    path.write_bytes(b"dato;indeks\n01.01.2020;100\n01.02.2020;10")
+    tail = CsvTail(path)
+    assert list(tail) == [["01.01.2020", "100"]]
+
+    with open(path, 'ab') as csv_file:
+        csv_file.write(b"1\n01.03.2020;102\n")
+    tail = CsvTail(path, tail.offset)
+    assert list(tail) == [["01.02.2020", "101"], ["01.03.2020", "102"]]
+    assert tail.offset == path.stat().st_size
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from Sandbox.model_cache import ModelCache
+from Sandbox.run_model import breakpoint_data, changepoint_statistics, sample_model
+
+pytest.importorskip("pymc3")
+
+SEED = [8927, 8928]
+SAMPLE_KWARGS = {"draws": 200, "tune": 200, "chains": 2, "cores": 1, "random_seed": SEED, "progressbar": False,
+                 "compute_convergence_checks": False}
+
+
+# Two regions of the same length, so they share one built model
+@pytest.fixture(scope="module")
+def regions():
+    rng = np.random.default_rng(8927)
+    a = np.concatenate([rng.normal(0.2, 1, 40), rng.normal(-0.1, 1, 40)])
+    b = np.concatenate([rng.normal(0.0, 1, 20), rng.normal(0.3, 1, 60)])
+    return a, b
+
+
+def draws(trace, names):
+    return {name: trace.get_values(name, combine=False) for name in names}
+
+
+@pytest.mark.parametrize("kind, data, names", [
+    ("marginalized_breakpoint", changepoint_statistics, ["early_trend", "late_trend"]),
+    ("breakpoint", breakpoint_data, ["changepoint", "early_trend", "late_trend"]),
+])
+def test_cached_fit_does_not_depend_on_earlier_fits(regions, kind, data, names):
+    a, b = regions
+    cache = ModelCache()
+    cache.sample(kind, data(a), **SAMPLE_KWARGS)
+    model, after_a = cache.sample(kind, data(b), **SAMPLE_KWARGS)
+    fresh_model, fresh = ModelCache().sample(kind, data(b), **SAMPLE_KWARGS)
+
+    assert len(cache.models) == 1 and model is not fresh_model
+    for name, values in draws(after_a, names).items():
+        np.testing.assert_array_equal(values, draws(fresh, names)[name])
+
+
+# pm.sample initializes the cached model like a model built for this fit (jitter+adapt_diag)
+def test_cached_fit_matches_uncached_fit(regions):
+    data = changepoint_statistics(regions[1])
+    _, cached = ModelCache().sample("marginalized_breakpoint", data, **SAMPLE_KWARGS)
+    _, uncached = sample_model("marginalized_breakpoint", data, **SAMPLE_KWARGS)
+    for name in ["early_trend", "late_trend"]:
+        np.testing.assert_array_equal(cached.get_values(name, combine=False), uncached.get_values(name, combine=False))
+
+
+def test_scalar_data_is_part_of_the_key(regions):
+    cache = ModelCache()
+    default = cache.key("breakpoint", breakpoint_data(regions[0]))
+    assert cache.key("breakpoint", breakpoint_data(regions[1])) == default
+    assert cache.key("breakpoint", breakpoint_data(regions[1], prior_location=20)) != default
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from Sandbox import projection
+from Sandbox.projection import PathSummary, ProjectionInputs
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def simulated_values(seed=5527, paths=20000):
+    rng = np.random.default_rng(seed)
+    # (paths, regions, months): a normal, a skewed and a nearly constant cell
+    return np.stack([rng.normal(10, 2, paths), rng.lognormal(0, 0.8, paths), 5 + 1e-6 * rng.normal(size=paths)],
+                    axis=1)[:, :, None]
+
+
+# The quantiles read from the histogram are within a bin of the exact sample quantiles
+def test_quantiles_match_numpy():
+    values = simulated_values()
+    summary = PathSummary.spanning(values)
+    summary.add(values)
+    expected = np.quantile(values, QUANTILES, axis=0)
+    assert (np.abs(summary.quantiles(QUANTILES) - expected) <= summary.width).all()
+    np.testing.assert_allclose(summary.mean(), values.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(summary.sd(), values.std(axis=0, ddof=1), rtol=1e-6)
+
+
+def test_merge_equals_one_summary():
+    values = simulated_values()
+    whole = PathSummary.spanning(values[:5000])
+    whole.add(values)
+    parts = [PathSummary(*whole.bounds()) for _ in range(3)]
+    for part, chunk in zip(parts, np.array_split(values, 3)):
+        part.add(chunk)
+    for part in parts[1:]:
+        parts[0].merge(part)
+    np.testing.assert_array_equal(parts[0].counts, whole.counts)
+    np.testing.assert_allclose(parts[0].mean(), whole.mean(), rtol=1e-12)
+    np.testing.assert_allclose(parts[0].quantiles(QUANTILES), whole.quantiles(QUANTILES), rtol=1e-12)
+
+
+# Values outside the bins land in the outer bins, so only the quantiles outside the bins are off
+def test_values_outside_the_bins():
+    values = simulated_values()[:, :1]
+    summary = PathSummary(np.array([[9.0]]), np.array([[0.002]]))
+    summary.add(values)
+    assert summary.counts.sum() == len(values)
+    assert summary.counts[0, 0, 0] == (values < 9.002).sum() and summary.counts[0, 0, -1] == (values >= 10.998).sum()
+    assert abs(summary.quantiles([0.5])[0, 0, 0] - np.median(values)) <= 0.002
+    assert 9.0 <= summary.quantiles([0.05])[0, 0, 0] <= 9.002
+
+
+def inputs():
+    return ProjectionInputs(["a", "b"], prices=[1.0, 2.0], wages=[1.0, 1.2], interest_rate=2.0, wage_drift=0.002,
+                            wage_volatility=0.005, interest_volatility=0.1)
+
+
+# The paths do not depend on how they are split into chunks. The bins come from the first chunk, so the
+# quantiles only agree within a bin.
+@pytest.mark.parametrize("model, draws", [("trend", {"beta": [0.002, 0.003, 0.004]}),
+                                          ("breakpoint", {"late_trend": [[0.1, 0.2], [0.3, 0.1]]})])
+def test_project_chunks(model, draws):
+    kwargs = {"paths": 3 * projection.PATH_BLOCK, "horizon": 24, "quantiles": QUANTILES}
+    whole = projection.project(inputs(), model, draws, **kwargs)
+    chunked = projection.project(inputs(), model, draws, memory_bytes=1, **kwargs)
+    for measure in projection.MEASURES:
+        np.testing.assert_allclose(chunked[measure]["mean"], whole[measure]["mean"], rtol=1e-10)
+        np.testing.assert_allclose(chunked[measure]["sd"], whole[measure]["sd"], rtol=1e-6)
+
+    settings = (inputs(), model, {k: np.asarray(v) for k, v in draws.items()}, kwargs["paths"], kwargs["horizon"],
+                projection.INTEREST_MARGIN, projection.PAYBACK_YEARS, projection.DEBT_RATIO, "regression", 8927)
+    values = projection.project_chunk(*settings[:3], range(3), *settings[3:])
+    for measure in projection.MEASURES:
+        expected = np.quantile(values[measure], QUANTILES, axis=0)
+        width = PathSummary.spanning(values[measure]).width
+        assert (np.abs(whole[measure]["quantiles"] - expected) <= width).all()
+        np.testing.assert_allclose(whole[measure]["mean"], values[measure].mean(axis=0), rtol=1e-10)
+
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        projection.project(inputs(), "random_walk", {"beta": [0.1]})
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("matplotlib")
+
+from Sandbox import report  # noqa: E402
+from Sandbox.report import ReportJob  # noqa: E402
+
+
+def render_line(inputs, outputs):
+    import matplotlib.pyplot as plt
+    from Sandbox.figures import show_or_save
+
+    plt.plot(inputs["values"])
+    show_or_save(outputs[0])
+
+
+def line_job(values):
+    return ReportJob("line", ["figures/line.png"], render_line, {"values": values})
+
+
+def test_default_output_is_not_the_committed_results():
+    assert report.REPORT_DIR != report.RESULTS_DIR
+    assert report.RESULTS_DIR in report.REPORT_DIR.parents
+
+
+# Rendering into results/ would overwrite the committed figures, that needs replace_committed
+def test_committed_results_need_replace_committed(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "RESULTS_DIR", tmp_path / "results")
+    with pytest.raises(ValueError):
+        report.render_report(tmp_path / "results", processes=1, jobs=[line_job([1, 2])])
+    assert not (tmp_path / "results").exists()
+
+    rendered, _ = report.render_report(tmp_path / "results", processes=1, jobs=[line_job([1, 2])],
+                                       replace_committed=True)
+    assert rendered == ["line"] and (tmp_path / "results" / "figures" / "line.png").exists()
+
+
+def test_unchanged_figures_are_skipped(tmp_path):
+    output_dir = tmp_path / "report"
+    assert report.render_report(output_dir, processes=1, jobs=[line_job([1, 2])]) == (["line"], [])
+    assert report.render_report(output_dir, processes=1, jobs=[line_job([1, 2])]) == ([], ["line"])
+    assert report.render_report(output_dir, processes=1, jobs=[line_job([1, 3])]) == (["line"], [])
+    assert report.render_report(output_dir, processes=1, jobs=[line_job([1, 3])], force=True) == (["line"], [])
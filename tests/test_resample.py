@@ -0,0 +1,157 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from Sandbox import resample
+from Sandbox.GroupedSeries import GroupedSeries
+from Sandbox.load_data import NATIONAL_QUARTERLY_INDEX_FILE, REGIONAL_INDEX_FILE, WAGE_FILE, get_regional_prices, \
+    load_columns, load_file, string_to_dates
+
+
+# The list-based resamplers the vectorized ones replaced, one value at a time
+
+
+def loop_quarterly_to_monthly(quarter_dates, values):
+    dates = []
+    monthly = []
+    for i, quarter_start in enumerate(quarter_dates):
+        quarter_start = quarter_start.item()
+        value_at_start_of_quarter = values[max(i - 1, 0)]
+        value_at_end_of_quarter = values[i]
+        for month_in_quarter in range(1, 4):
+            dates.append(datetime.date(quarter_start.year, quarter_start.month - 1 + month_in_quarter, 1))
+            increase_per_month = (value_at_end_of_quarter - value_at_start_of_quarter) / 3
+            monthly.append(value_at_start_of_quarter + increase_per_month * (month_in_quarter - 1))
+    last_date = dates[-1]
+    if last_date.month == 12:
+        dates.append(datetime.date(last_date.year + 1, 1, 1))
+    else:
+        dates.append(datetime.date(last_date.year, last_date.month + 1, 1))
+    monthly.append(values[-1])
+    return np.array(dates, dtype='datetime64[D]'), np.array(monthly)
+
+
+def loop_yearly_to_monthly(years, values):
+    dates = []
+    monthly = []
+    for i in range(1, len(years)):
+        increase_per_month = (values[i] - values[i - 1]) / 12
+        for month in range(1, 13):
+            dates.append(datetime.date(int(years[i]), month, 1))
+            monthly.append(values[i - 1] + increase_per_month * (month - 1))
+    return np.array(dates, dtype='datetime64[D]'), np.array(monthly)
+
+
+def loop_compound_yearly_to_monthly(years, rates, start_value=100):
+    dates = []
+    monthly = []
+    index_current = start_value
+    for year, rate in zip(years, rates):
+        year_start = index_current
+        index_current = index_current * ((100 + rate) / 100)
+        increase_per_month = (index_current - year_start) / 12
+        for month in range(1, 13):
+            dates.append(datetime.date(int(year), month, 1))
+            monthly.append(year_start + increase_per_month * (month - 1))
+    return np.array(dates, dtype='datetime64[D]'), np.array(monthly)
+
+
+def quarters(first, count):
+    return (np.datetime64(first, 'M') + 3 * np.arange(count)).astype('datetime64[D]')
+
+
+def assert_same_series(actual, expected):
+    np.testing.assert_array_equal(actual[0], expected[0])
+    np.testing.assert_allclose(actual[1], expected[1], rtol=1e-12, equal_nan=True)
+
+
+def test_quarterly_to_monthly_national_index():
+    quarter_dates, values = load_columns(NATIONAL_QUARTERLY_INDEX_FILE, [0, 1])
+    assert_same_series(resample.quarterly_to_monthly(quarter_dates, values),
+                       loop_quarterly_to_monthly(quarter_dates, values))
+
+
+# Every region in one call, each region from its first observed quarter like transform_regional_prices
+def test_quarterly_to_monthly_regions():
+    grouped_prices = GroupedSeries.from_columns(*load_columns(REGIONAL_INDEX_FILE, [0, 1, 2]))
+    quarter_dates, prices = get_regional_prices(grouped_prices, grouped_prices.categories())
+    month_dates, monthly = resample.quarterly_to_monthly(quarter_dates, prices)
+    assert monthly.shape == (len(prices), 3 * len(quarter_dates) + 1)
+
+    first_observed = (~np.isnan(prices)).argmax(axis=1)
+    assert len(np.unique(first_observed)) > 1
+    for row, first in enumerate(first_observed):
+        expected = loop_quarterly_to_monthly(quarter_dates[first:], prices[row, first:])
+        assert_same_series((month_dates[3 * first:], monthly[row, 3 * first:]), expected)
+        assert np.isnan(monthly[row, :3 * first]).all()
+
+
+def test_quarterly_to_monthly_single_quarter():
+    dates, values = resample.quarterly_to_monthly(quarters("2020-10", 1), [105.0])
+    np.testing.assert_array_equal(dates, np.array(["2020-10-01", "2020-11-01", "2020-12-01", "2021-01-01"],
+                                                  dtype='datetime64[D]'))
+    np.testing.assert_array_equal(values, [105.0] * 4)
+    assert_same_series((dates, values), loop_quarterly_to_monthly(quarters("2020-10", 1), [105.0]))
+
+
+# A series starting after the others is NaN up to its first quarter, which is flat like a first quarter
+def test_quarterly_to_monthly_late_start():
+    quarter_dates = quarters("2019-01", 4)
+    values = np.array([[100.0, 102.0, 101.0, 104.0], [np.nan, np.nan, 50.0, 53.0]])
+    _, monthly = resample.quarterly_to_monthly(quarter_dates, values)
+    assert_same_series(resample.quarterly_to_monthly(quarter_dates, values[0]),
+                       loop_quarterly_to_monthly(quarter_dates, values[0]))
+    assert np.isnan(monthly[1, :6]).all()
+    np.testing.assert_allclose(monthly[1, 6:], [50.0, 50.0, 50.0, 50.0, 51.0, 52.0, 53.0])
+
+
+# A missing quarter inside a series stays missing and the quarter after it starts flat again.
+# transform_regional_prices rejects such series before resampling.
+def test_quarterly_to_monthly_gap():
+    quarter_dates = quarters("2019-01", 4)
+    _, monthly = resample.quarterly_to_monthly(quarter_dates, [100.0, np.nan, 106.0, 109.0])
+    np.testing.assert_allclose(monthly[:3], [100.0, 100.0, 100.0])
+    assert np.isnan(monthly[3:6]).all()
+    np.testing.assert_allclose(monthly[6:], [106.0, 106.0, 106.0, 106.0, 107.0, 108.0, 109.0])
+
+
+def test_quarterly_to_monthly_across_year_end():
+    dates, _ = resample.quarterly_to_monthly(quarters("2019-07", 2), [100.0, 103.0])
+    assert dates[-1] == np.datetime64("2020-01-01")
+
+
+def test_yearly_to_monthly_wages():
+    wage = load_file(WAGE_FILE, 0, 1)
+    years = [int(w.date) for w in wage]
+    values = [w.value for w in wage]
+    assert_same_series(resample.yearly_to_monthly(years, values), loop_yearly_to_monthly(years, values))
+
+
+def test_yearly_to_monthly_two_years():
+    dates, values = resample.yearly_to_monthly([2019, 2020], [100.0, 112.0])
+    assert dates[0] == np.datetime64("2020-01-01") and len(dates) == 12
+    np.testing.assert_allclose(values, 100.0 + np.arange(12))
+
+
+def test_compound_yearly_to_monthly_inflation():
+    inflation = string_to_dates(load_file(WAGE_FILE, 0, 3))
+    years = inflation.dates.astype('datetime64[Y]').astype(int) + 1970
+    assert_same_series(resample.compound_yearly_to_monthly(years, inflation.values),
+                       loop_compound_yearly_to_monthly(years, inflation.values))
+
+
+def test_compound_yearly_to_monthly_single_year():
+    dates, values = resample.compound_yearly_to_monthly([2020], [12.0], start_value=50)
+    assert_same_series((dates, values), loop_compound_yearly_to_monthly([2020], [12.0], start_value=50))
+    np.testing.assert_allclose(values, 50.0 + 0.5 * np.arange(12))
+
+
+# Many series in one call match the series one at a time
+@pytest.mark.parametrize("resampler", [resample.yearly_to_monthly, resample.compound_yearly_to_monthly])
+def test_yearly_resamplers_batch(resampler):
+    years = np.arange(2000, 2010)
+    values = np.random.default_rng(8927).uniform(1, 10, size=(3, len(years)))
+    dates, batch = resampler(years, values)
+    for row in range(len(values)):
+        assert_same_series((dates, batch[row]), resampler(years, values[row]))
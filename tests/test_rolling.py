@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from Sandbox.load_data import load_national_prices, load_wage_growth
+from Sandbox.model_cache import ModelCache
+from Sandbox.rolling import COLD_TUNE, WARM_TUNE, WarmStart, fit_window, window_bounds
+from Sandbox.run_model import price_trend_data, wage_correlation_data
+
+pytest.importorskip("pymc3")
+
+DRAWS = 1000
+CHAINS = 2
+
+
+# like rolling_price_trend and rolling_wage_correlation
+def window_data(kind, start, stop):
+    prices = load_national_prices(2005)
+    if kind == "price_trend":
+        return price_trend_data(prices[start:stop].normalize())
+    return wage_correlation_data(prices[start:stop], load_wage_growth(2005)[start:stop])
+
+
+# The second of two overlapping windows, warm started from the first, against a cold fit of it. The means
+# must agree within five Monte Carlo standard errors of their difference and the sds within 15%.
+@pytest.mark.parametrize("kind", ["price_trend", "wage_correlation"])
+def test_warm_start_matches_cold_fit(kind):
+    import arviz as az
+
+    first, second = window_bounds(len(load_national_prices(2005)), window=60, step=12)[:2]
+    cache = ModelCache(match_shape=False)
+    model, trace, _ = fit_window(kind, window_data(kind, *first), DRAWS, COLD_TUNE, CHAINS, [1, 2], cache)
+    warm_start = WarmStart.from_trace(model, trace)
+    model, warm, _ = fit_window(kind, window_data(kind, *second), DRAWS, WARM_TUNE, CHAINS, [3, 4], cache,
+                                warm_start)
+    _, cold, _ = fit_window(kind, window_data(kind, *second), DRAWS, COLD_TUNE, CHAINS, [5, 6], ModelCache())
+
+    with model:
+        warm_data, cold_data = az.from_pymc3(warm), az.from_pymc3(cold)
+    for name in [variable.name for variable in model.vars]:
+        warm_values, cold_values = warm[name], cold[name]
+        mcse = np.hypot(float(az.mcse(warm_data, var_names=[name])[name]),
+                        float(az.mcse(cold_data, var_names=[name])[name]))
+        assert abs(warm_values.mean() - cold_values.mean()) < 5 * mcse
+        assert warm_values.std() == pytest.approx(cold_values.std(), rel=0.15)
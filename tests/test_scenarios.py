@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+
+from Sandbox import scenarios
+from Sandbox.load_data import DEBT_RATIO, PAYBACK_YEARS, interest_to_cost, load_cost_factor_of_purchase, \
+    load_regional_prices, load_wage_growth
+from Sandbox.scenarios import SweepInputs
+
+REGIONS = ["Oslo med Baerum", "Stavanger"]
+
+
+# Monthly payment of a loan of 1 over payback_years at the yearly interest in percent, times the number of payments
+def annuity_repaid(interest, payback_years):
+    rate = interest / 100 / 12
+    payments = payback_years * 12
+    return payments * rate * (1 + rate) ** payments / ((1 + rate) ** payments - 1)
+
+
+def test_annuity_cost():
+    for interest, payback_years, debt_ratio in [(3.0, 30, 0.85), (6.5, 20, 0.6), (0.5, 5, 1.0)]:
+        expected = (1 - debt_ratio) + debt_ratio * annuity_repaid(interest, payback_years)
+        assert scenarios.annuity_cost(interest, payback_years, debt_ratio) == pytest.approx(expected, rel=1e-12)
+
+
+# At 0 interest only the price is paid back, and the cost is continuous there
+def test_annuity_cost_at_zero_interest():
+    assert scenarios.annuity_cost(0.0) == 1.0
+    assert scenarios.annuity_cost(1e-9) == pytest.approx(1.0, abs=1e-9)
+    assert scenarios.annuity_cost(-0.5) < 1.0
+
+
+def test_annuity_cost_broadcasts():
+    cost = scenarios.annuity_cost(np.array([1.0, 4.0])[:, None], np.array([10, 20, 30]), 0.5)
+    assert cost.shape == (2, 3)
+    assert cost[1, 2] == scenarios.annuity_cost(4.0, 30, 0.5)
+
+
+def test_regression_cost():
+    interest = np.array([1.0, 5.0])
+    np.testing.assert_array_equal(scenarios.regression_cost(interest), interest_to_cost(interest))
+    with pytest.raises(ValueError):
+        scenarios.regression_cost(3.0, payback_years=20)
+    with pytest.raises(ValueError):
+        scenarios.cost_function("bullet")
+
+
+# Every region on the common grid has the prices of its own series and the wages normalized at its start year
+def test_sweep_inputs_from_regions():
+    inputs = SweepInputs.from_regions(REGIONS)
+    collection = load_regional_prices()
+    assert inputs.prices.shape == inputs.wages.shape == (len(REGIONS), len(inputs.dates))
+    for row, region in enumerate(REGIONS):
+        prices = collection[region].prices
+        columns = np.searchsorted(inputs.dates, prices.dates)
+        np.testing.assert_array_equal(inputs.dates[columns], prices.dates)
+        np.testing.assert_array_equal(inputs.prices[row, columns], prices.values)
+        assert np.isnan(inputs.prices[row, :columns[0]]).all()
+
+        wages = load_wage_growth(collection[region].start_year)
+        np.testing.assert_array_equal(inputs.wages[row, np.searchsorted(inputs.dates, wages.dates)], wages.values)
+
+
+# The scenario with the default loan and no shock, with the regression cost, is the cost factor of load_data
+def test_default_scenario_matches_loaders():
+    inputs = SweepInputs.from_regions(REGIONS)
+    cost_factor = load_cost_factor_of_purchase(inputs.dates[0].item().year)
+    result = scenarios.sweep(inputs, cost="regression")
+    assert result["cost_factor"].shape == (1, 1, 1, 1, len(inputs.dates))
+    columns = np.searchsorted(inputs.dates, cost_factor.dates)
+    np.testing.assert_allclose(result["cost_factor"][0, 0, 0, 0, columns], cost_factor.values, rtol=1e-12)
+    np.testing.assert_allclose(result["total_cost"][0, 0, 0, 0],
+                               inputs.prices * result["cost_factor"][0, 0, 0, 0], rtol=1e-12)
+
+
+# Every scenario of the grid, one at a time
+def test_sweep_matches_scenarios_one_at_a_time():
+    inputs = SweepInputs.from_regions(REGIONS)
+    grid = {"margins": [1.5, 2.5], "payback_years": [20, 30], "debt_ratios": [0.6, DEBT_RATIO],
+            "rate_shocks": [0, 1, 3]}
+    result = scenarios.sweep(inputs, **grid)
+    for index in np.ndindex(result["cost_factor"].shape[:4]):
+        margin, payback_years, debt_ratio, shock = [values[i] for values, i in zip(grid.values(), index)]
+        cost_factor = scenarios.annuity_cost(inputs.interest_rates + shock + margin, payback_years, debt_ratio)
+        np.testing.assert_allclose(result["cost_factor"][index], cost_factor, rtol=1e-12)
+        np.testing.assert_allclose(result["total_cost_to_wage"][index], inputs.prices * cost_factor / inputs.wages,
+                                   rtol=1e-12)
+
+
+def test_sweep_to_disk_matches_sweep(tmp_path):
+    inputs = SweepInputs.from_regions(REGIONS)
+    grid = {"margins": [1.5, 2.5], "payback_years": [PAYBACK_YEARS], "debt_ratios": [0.6, DEBT_RATIO],
+            "rate_shocks": [0, 1, 3]}
+    expected = scenarios.sweep(inputs, **grid)
+    # a few scenarios per chunk, the last chunk shorter
+    scenario_bytes = 8 * len(inputs.dates) * (1 + 2 * len(REGIONS))
+    output_dir = scenarios.sweep_to_disk(tmp_path / "sweep", inputs, chunk_bytes=5 * scenario_bytes, **grid)
+
+    axes, results = scenarios.load_sweep(output_dir)
+    for name, values in expected.items():
+        np.testing.assert_array_equal(results[name], values)
+    assert axes["parameters"]["rate_shock"] == [0, 1, 3]
+    assert axes["regions"] == REGIONS and len(axes["dates"]) == len(inputs.dates)
+    with open(output_dir / "axes.json") as axes_file:
+        assert json.load(axes_file)["cost"] == "annuity"
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from Sandbox import segmentation
+
+
+# Optimal partitioning without pruning: every start of the last segment is tried for every end
+def exhaustive_changepoints(y, penalty, min_segment):
+    best = np.full(len(y) + 1, np.inf)
+    best[0] = -penalty
+    previous = np.zeros(len(y) + 1, dtype=np.int64)
+    for end in range(min_segment, len(y) + 1):
+        for start in range(0, end - min_segment + 1):
+            segment = y[start:end]
+            cost = best[start] + ((segment - segment.mean()) ** 2).sum() + penalty
+            if cost < best[end]:
+                best[end], previous[end] = cost, start
+    return segmentation.backtrack(previous, len(y))
+
+
+def shifted_series(rng, length, breaks, means, sd=1.0):
+    bounds = np.concatenate([[0], np.asarray(breaks) + 1, [length]])
+    mean = np.concatenate([np.full(stop - start, m) for start, stop, m in zip(bounds[:-1], bounds[1:], means)])
+    return mean + rng.normal(0, sd, length)
+
+
+@pytest.mark.parametrize("block", [1, 3])
+def test_known_break(block):
+    y = shifted_series(np.random.default_rng(4521), 120, [59], [0.0, 3.0])
+    [changepoints] = segmentation.detect_changepoints(y, block=block)
+    np.testing.assert_array_equal(changepoints, [59])
+    assert segmentation.strongest_changepoint(y, changepoints) == 59
+    np.testing.assert_allclose(segmentation.segment_means(y, changepoints), [y[:60].mean(), y[60:].mean()])
+
+
+def test_no_break_in_noise():
+    y = np.random.default_rng(812).normal(0, 1, 120)
+    [changepoints] = segmentation.detect_changepoints(y, block=1)
+    assert len(changepoints) == 0
+    assert segmentation.strongest_changepoint(y, changepoints) is None
+
+
+# Pruning does not change the result of the exact dynamic programme
+@pytest.mark.parametrize("seed", range(5))
+def test_same_as_exhaustive_search(seed):
+    rng = np.random.default_rng(seed)
+    y = shifted_series(rng, 60, [14, 29, 44], rng.normal(0, 1.5, 4), sd=0.5)
+    [changepoints] = segmentation.detect_changepoints(y, penalty=4.0, sd=1.0, block=1)
+    np.testing.assert_array_equal(changepoints, exhaustive_changepoints(y, 4.0, segmentation.MIN_SEGMENT))
+
+
+# Series segmented together, with NaN before the first observation, match the series segmented one at a time
+def test_matrix_of_series():
+    rng = np.random.default_rng(3390)
+    rows = [shifted_series(rng, 90, [29], [2.0, -2.0]), shifted_series(rng, 90, [44, 68], [0.0, 4.0, 1.0]),
+            rng.normal(0, 1, 90)]
+    rows[1][:15] = np.nan
+    together = segmentation.detect_changepoints(np.array(rows))
+    for row, changepoints in zip(rows, together):
+        observed = ~np.isnan(row)
+        [alone] = segmentation.detect_changepoints(row[observed])
+        np.testing.assert_array_equal(changepoints, alone + np.flatnonzero(observed)[0])
+    np.testing.assert_array_equal(together[0], [29])
+    np.testing.assert_array_equal(together[1], [44, 68])
+
+
+def test_block_means():
+    y = np.array([[1.0, 2.0, 3.0, np.nan, np.nan, np.nan, 7.0]])
+    np.testing.assert_array_equal(segmentation.block_means(y, 3), [[2.0, np.nan, 7.0]])
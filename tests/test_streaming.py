@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pymc3")
+az = pytest.importorskip("arviz")
+
+from Sandbox import streaming  # noqa: E402
+
+
+def autocorrelated_chains(rng, chains, draws, phi=0.0, offsets=None):
+    noise = rng.normal(size=(chains, draws))
+    values = np.empty_like(noise)
+    values[:, 0] = noise[:, 0]
+    for draw in range(1, draws):
+        values[:, draw] = phi * values[:, draw - 1] + np.sqrt(1 - phi ** 2) * noise[:, draw]
+    return values + (0.0 if offsets is None else np.asarray(offsets)[:, None])
+
+
+def stream(values, reservoir_draws=streaming.RESERVOIR_DRAWS):
+    posterior = streaming.StreamingPosterior(values.shape[1], random_seed=0, reservoir_draws=reservoir_draws)
+    for chain, chain_values in enumerate(values):
+        for value in chain_values:
+            posterior.add(chain, {"x": np.asarray(value)})
+    return posterior
+
+
+def test_running_moments():
+    values = np.random.default_rng(31).normal(3.0, 2.0, size=(500, 2, 3))
+    moments = streaming.RunningMoments((2, 3))
+    for value in values:
+        moments.add(value)
+    np.testing.assert_allclose(moments.mean, values.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(moments.variance(), values.var(axis=0, ddof=1), rtol=1e-12)
+
+
+def test_combine_moments():
+    values = np.random.default_rng(32).normal(size=(3, 200, 4)) + np.arange(3)[:, None, None]
+    parts = []
+    for part in (values[0], values[1][:50], values[2]):
+        moments = streaming.RunningMoments((4,))
+        for value in part:
+            moments.add(value)
+        parts.append(moments)
+    pooled = np.concatenate([values[0], values[1][:50], values[2]])
+    combined = streaming.combine_moments(parts + [streaming.RunningMoments((4,))])
+    assert combined.count == len(pooled)
+    np.testing.assert_allclose(combined.mean, pooled.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(combined.variance(), pooled.var(axis=0, ddof=1), rtol=1e-12)
+
+
+# After the batches run full the batch length doubles, and the kept means are those of equally long batches
+@pytest.mark.parametrize("draws", [5, 8, 100, 1000])
+def test_batch_means(draws):
+    values = np.random.default_rng(draws).normal(size=draws)
+    batches = streaming.BatchMeans((), batches=8)
+    for value in values:
+        batches.add(value)
+    assert 4 <= batches.full <= 8 or draws < 8
+    used = batches.full * batches.length
+    np.testing.assert_allclose(batches.means(), values[:used].reshape(batches.full, batches.length).mean(axis=1))
+
+
+def test_summary_matches_arviz():
+    values = autocorrelated_chains(np.random.default_rng(2291), 4, 2000, phi=0.5)
+    summary = stream(values, reservoir_draws=2000).summary().loc["x"]
+    assert summary["mean"] == pytest.approx(values.mean(), rel=1e-9)
+    assert summary["sd"] == pytest.approx(values.std(ddof=1), rel=1e-9)
+    lower, upper = az.hdi(values.reshape(-1), hdi_prob=streaming.HDI_PROB)
+    assert (summary["hdi_3%"], summary["hdi_97%"]) == pytest.approx((lower, upper), rel=1e-9)
+    assert summary["r_hat"] == pytest.approx(float(az.rhat(values, method="split")), abs=1e-9)
+    assert summary["ess"] == pytest.approx(float(az.ess(values, method="mean")), rel=0.3)
+
+
+# A chain that disagrees with the others raises the split R-hat as in arviz. The batch means only see the
+# disagreement within the batch length, so the ESS drops, but much less than the ESS of arviz.
+def test_disagreeing_chains():
+    rng = np.random.default_rng(7810)
+    agreeing = stream(autocorrelated_chains(rng, 4, 1000)).summary().loc["x"]
+    values = autocorrelated_chains(rng, 4, 1000, offsets=[0.0, 0.0, 0.0, 1.5])
+    summary = stream(values).summary().loc["x"]
+    assert summary["r_hat"] == pytest.approx(float(az.rhat(values, method="split")), abs=1e-9)
+    assert summary["r_hat"] > 1.1 and agreeing["r_hat"] < 1.01
+    assert summary["ess"] < 0.3 * agreeing["ess"]
+
+
+def test_reservoir_keeps_draw_order():
+    values = np.arange(5000, dtype=np.float64)[None]
+    draws = stream(values, reservoir_draws=100).chains[0].draws("x")
+    assert len(draws) == 100
+    assert (np.diff(draws) > 0).all()
+    # a uniform sample of the draws, not the first ones
+    assert draws[-1] > 4000
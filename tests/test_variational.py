@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from Sandbox.conjugate import wage_correlation_posterior
+from Sandbox.load_data import load_national_prices, load_wage_growth
+from Sandbox.main import monthly_to_quarterly
+from Sandbox.model_cache import ModelCache
+from Sandbox.run_model import approximate_model, fit_model, price_trend_data, wage_correlation_data
+
+pytest.importorskip("pymc3")
+
+SEED = 8927
+DRAWS = 2000
+
+
+@pytest.fixture(scope="module")
+def quarterly():
+    return monthly_to_quarterly(load_national_prices(1992)), monthly_to_quarterly(load_wage_growth(1992))
+
+
+# Fits the approximation that fit_model draws from, without a cache or with one that fitted other data first
+@pytest.mark.parametrize("method", ["advi", "fullrank_advi"])
+def test_cached_fit_matches_uncached_fit(quarterly, method):
+    prices, wages = quarterly
+    data = wage_correlation_data(prices, wages)
+    cache = ModelCache()
+    fit_model("wage_correlation", wage_correlation_data(prices, wages.multiply(1.1)), method, cache, draws=DRAWS,
+              random_seed=SEED + 1)
+    _, cached = fit_model("wage_correlation", data, method, cache, draws=DRAWS, random_seed=SEED)
+    _, uncached = approximate_model("wage_correlation", data, method, draws=DRAWS, random_seed=SEED)
+    assert len(cache.models) == 1
+    for name in ["intercept", "beta"]:
+        np.testing.assert_array_equal(cached[name], uncached[name])
+
+
+# The wage correlation posterior is Gaussian, so the full-rank approximation can match it, and mean-field ADVI
+# its means, though not the sds of the correlated intercept and coefficient.
+@pytest.mark.parametrize("method, sd_tolerance", [("advi", None), ("fullrank_advi", 0.25)])
+def test_approximation_matches_exact_posterior(quarterly, method, sd_tolerance):
+    exact = wage_correlation_posterior(*quarterly)
+    _, trace = approximate_model("wage_correlation", wage_correlation_data(*quarterly), method, draws=DRAWS,
+                                 random_seed=SEED)
+    for name in exact.index:
+        assert abs(trace[name].mean() - exact.loc[name, "mean"]) < 0.25 * exact.loc[name, "sd"]
+        if sd_tolerance is not None:
+            assert trace[name].std() == pytest.approx(exact.loc[name, "sd"], rel=sd_tolerance)
+
+
+def test_unknown_method():
+    data = price_trend_data(load_national_prices(1992))
+    with pytest.raises(ValueError, match="unknown inference method"):
+        fit_model("price_trend", data, "svgd")